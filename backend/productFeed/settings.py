@@ -28,6 +28,21 @@ ALLOWED_HOSTS = ['*']
 DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 
 
+# Deployment roles: the optional stacks a worker mounts next to the REST API. The GraphQL stack (graphene) and the
+# Swagger docs stack are only installed and routed for the roles which serve them, and even then they are imported on
+# the first request. Workers which only serve REST or run management commands never import them. The Django admin is
+# only routed for the roles which serve it.
+DEPLOYMENT_ROLES = {
+    'all': ('graphql', 'docs', 'admin'),
+    'graphql': ('graphql',),
+    'docs': ('docs',),
+    'admin': ('admin',),
+    'rest': (),
+    'worker': (),
+}
+DEPLOYMENT_ROLE = os.environ.get('DEPLOYMENT_ROLE', 'all')
+OPTIONAL_STACKS = DEPLOYMENT_ROLES[DEPLOYMENT_ROLE]
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -38,8 +53,8 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
-    'rest_framework_swagger',
-    'graphene_django',
+    *(['rest_framework_swagger'] if 'docs' in OPTIONAL_STACKS else []),
+    *(['graphene_django'] if 'graphql' in OPTIONAL_STACKS else []),
     'django_filters',
     'product_feed'
 ]
@@ -52,6 +67,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'product_feed.middleware.PrimaryPinMiddleware',
 ]
 
 ROOT_URLCONF = 'productFeed.urls'
@@ -91,6 +107,22 @@ DATABASES = {
     }
 }
 
+# Read replicas, one database alias per host in DB_REPLICA_HOSTS (comma separated). Product reads and GraphQL queries are
+# only routed to them when DB_REPLICA_HOSTS is set. The first alias always exists so the test suite can use it as a
+# stand-in replica in a second local database.
+DB_REPLICA_HOSTS = [host.strip() for host in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+DATABASE_REPLICAS = [f'replica_{index}' for index in range(len(DB_REPLICA_HOSTS))]
+for index, host in enumerate(DB_REPLICA_HOSTS or [DATABASES['default']['HOST']]):
+    DATABASES[f'replica_{index}'] = dict(
+        DATABASES['default'], HOST=host, TEST={'NAME': f"test_{DATABASES['default']['NAME']}_replica_{index}"},
+    )
+DATABASE_ROUTERS = ['product_feed.routers.ReplicaRouter']
+
+# Clients which have written are pinned to the primary database for this many seconds, so they read their own writes
+# while the replicas catch up.
+PRIMARY_PIN_SECONDS = int(os.environ.get('PRIMARY_PIN_SECONDS', 10))
+PRIMARY_PIN_COOKIE = 'db_primary_pin'
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -157,4 +189,88 @@ REST_FRAMEWORK = {
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'staticfiles')]
 VENV_PATH = os.path.dirname(BASE_DIR)
 STATIC_ROOT = os.path.join(VENV_PATH, 'staticfiles')
-USE_UNICODE = True
\ No newline at end of file
+USE_UNICODE = True
+# Upper bound of a decompressed feed upload, protects the feed upload endpoint from decompression bombs. The JSON
+# document is parsed as a whole, a worker holds the decompressed text and the parsed rows, several times this size, in
+# memory while it parses a feed, so keep it well below the memory of a web worker.
+FEED_UPLOAD_MAX_DECOMPRESSED_SIZE = int(os.environ.get('FEED_UPLOAD_MAX_DECOMPRESSED_SIZE', 64 * 1024 ** 2))
+
+# Maximum number of products created by one list posted to the products endpoint, a larger list is refused with 413.
+PRODUCT_BULK_CREATE_MAX_SIZE = int(os.environ.get('PRODUCT_BULK_CREATE_MAX_SIZE', 1000))
+
+# Dry run feed uploads: the rows of a feed are validated in chunks of FEED_VALIDATION_CHUNK_SIZE across a pool of
+# FEED_VALIDATION_WORKERS processes per web worker, started with the FEED_VALIDATION_START_METHOD (forkserver or spawn).
+# Every web worker has its own pool, keep the size small; 0 validates in the web worker.
+FEED_VALIDATION_WORKERS = int(os.environ.get('FEED_VALIDATION_WORKERS', 2))
+FEED_VALIDATION_START_METHOD = os.environ.get('FEED_VALIDATION_START_METHOD', 'forkserver')
+FEED_VALIDATION_CHUNK_SIZE = int(os.environ.get('FEED_VALIDATION_CHUNK_SIZE', 10000))
+
+# Partial feed uploads commit the valid rows in chunks of FEED_INGEST_CHUNK_SIZE rows.
+FEED_INGEST_CHUNK_SIZE = int(os.environ.get('FEED_INGEST_CHUNK_SIZE', 1000))
+
+# The product list and detail pages are assembled from the product documents refreshed by the ingestion paths, the
+# rebuild_documents command renders all of them and check_documents verifies them.
+PRODUCT_DOCUMENTS = os.environ.get('PRODUCT_DOCUMENTS', 'true').lower() in ('1', 'true', 'yes')
+
+# The detail endpoint reads the products of a code from the memory mapped code index at PRODUCT_CODE_INDEX_PATH, shared
+# by the workers of a host, while the index is complete up to the newest change token of the database. Every committed
+# write rebuilds the index of the host it was made on, only the codes it changed unless more than
+# PRODUCT_CODE_INDEX_MAX_CHANGES changes were committed since the index was built or something was deleted. A host
+# which takes no writes runs build_code_index, e.g. periodically. Without a path the detail endpoint always reads the
+# database.
+PRODUCT_CODE_INDEX_PATH = os.environ.get('PRODUCT_CODE_INDEX_PATH', '')
+PRODUCT_CODE_INDEX_MAX_CHANGES = int(os.environ.get('PRODUCT_CODE_INDEX_MAX_CHANGES', 10000))
+
+# Concurrent ingestions: the feeds of one supplier queue on the supplier's advisory lock, the Item rows are locked by
+# ranges of ITEM_LOCK_RANGE_SIZE codes. A lock wait of INGESTION_LOCK_WAIT_WARNING seconds or more is logged as a warning.
+ITEM_LOCK_RANGE_SIZE = int(os.environ.get('ITEM_LOCK_RANGE_SIZE', 10000))
+INGESTION_LOCK_WAIT_WARNING = float(os.environ.get('INGESTION_LOCK_WAIT_WARNING', 1))
+
+# Admission control of the feed uploads, shared by all the workers through the database: at most
+# FEED_ADMISSION_MAX_INGESTIONS feeds with FEED_ADMISSION_MAX_ROWS rows in total are ingested at once, and at most
+# FEED_ADMISSION_SUPPLIER_MAX_INGESTIONS feeds with FEED_ADMISSION_SUPPLIER_MAX_ROWS rows of one supplier. An upload
+# without room does not wait, it is refused with 429 and a Retry-After of FEED_ADMISSION_RETRY_AFTER seconds.
+FEED_ADMISSION_MAX_INGESTIONS = int(os.environ.get('FEED_ADMISSION_MAX_INGESTIONS', 4))
+FEED_ADMISSION_MAX_ROWS = int(os.environ.get('FEED_ADMISSION_MAX_ROWS', 200000))
+FEED_ADMISSION_SUPPLIER_MAX_INGESTIONS = int(os.environ.get('FEED_ADMISSION_SUPPLIER_MAX_INGESTIONS', 2))
+FEED_ADMISSION_SUPPLIER_MAX_ROWS = int(os.environ.get('FEED_ADMISSION_SUPPLIER_MAX_ROWS', 100000))
+FEED_ADMISSION_RETRY_AFTER = int(os.environ.get('FEED_ADMISSION_RETRY_AFTER', 10))
+
+# Django admin: a changelist estimated at fewer than ADMIN_EXACT_COUNT_THRESHOLD rows is counted exactly, the bulk
+# actions write ADMIN_ACTION_CHUNK_SIZE objects per transaction.
+ADMIN_EXACT_COUNT_THRESHOLD = int(os.environ.get('ADMIN_EXACT_COUNT_THRESHOLD', 10000))
+ADMIN_ACTION_CHUNK_SIZE = int(os.environ.get('ADMIN_ACTION_CHUNK_SIZE', 10000))
+
+# Catalog snapshots: rows per record batch, a Parquet row group or an Arrow IPC message.
+SNAPSHOT_BATCH_SIZE = int(os.environ.get('SNAPSHOT_BATCH_SIZE', 65536))
+
+# Number of (code, type) pairs kept in the process local Item identity cache of the ingestion paths.
+ITEM_IDENTITY_CACHE_SIZE = int(os.environ.get('ITEM_IDENTITY_CACHE_SIZE', 100000))
+
+# The GraphQL schema is resolved from its dotted path when the GraphQL view is first used. The schema has no _debug
+# field, so graphene's debug middleware (added by default with DEBUG) would only wrap the cursors of every database.
+GRAPHENE = {
+    'SCHEMA': 'product_feed.schema.schema',
+    'MIDDLEWARE': [],
+}
+
+# GraphQL endpoint: number of parsed and validated query documents kept per process, and the static limits a query
+# must stay within before it is executed. Fields below a list field count GRAPHQL_LIST_COST_FACTOR times.
+GRAPHQL_DOCUMENT_CACHE_SIZE = int(os.environ.get('GRAPHQL_DOCUMENT_CACHE_SIZE', 1000))
+GRAPHQL_MAX_DEPTH = int(os.environ.get('GRAPHQL_MAX_DEPTH', 10))
+GRAPHQL_MAX_COST = int(os.environ.get('GRAPHQL_MAX_COST', 5000))
+GRAPHQL_LIST_COST_FACTOR = int(os.environ.get('GRAPHQL_LIST_COST_FACTOR', 10))
+
+# API docs: the schema artifact written by the build_api_schema command and the packages it is introspected from, every
+# module of the packages is fingerprinted since the views, serializers and fieldsets are spread over them. The artifact
+# is regenerated in process when one of the modules has changed since it was written.
+API_SCHEMA_TITLE = 'Product Feed API'
+API_SCHEMA_PATH = os.environ.get('API_SCHEMA_PATH', os.path.join(BASE_DIR, 'api_schema.json'))
+API_SCHEMA_SOURCE_PACKAGES = ['product_feed']
+API_SCHEMA_MAX_AGE = int(os.environ.get('API_SCHEMA_MAX_AGE', 3600))
+
+# On demand profiling of the feed upload, product list and GraphQL views. Admin users profile a request with the
+# X-Profile header or the profile query parameter, PROFILING_SAMPLE_RATE (0 to 1) profiles a share of all requests.
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_SAMPLE_INTERVAL = float(os.environ.get('PROFILING_SAMPLE_INTERVAL', 0.005))
+PROFILING_OUTPUT_DIR = os.environ.get('PROFILING_OUTPUT_DIR', os.path.join(BASE_DIR, 'profiles'))
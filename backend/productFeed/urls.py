@@ -14,18 +14,24 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
+from django.contrib import admin
 from django.urls import include, path
-from rest_framework_swagger.views import get_swagger_view
-
-# Define the Swagger schema view
-schema_view = get_swagger_view(title='Product Feed API')
+from product_feed.lazy import lazy_view
 
 urlpatterns = [
 
     # This endpoint for the product_feed class urls
     path('api/', include('product_feed.urls')),
 
-    # The swagger URL is for the Swagger API docs
-    path('', schema_view),
-
 ]
+
+if 'docs' in settings.OPTIONAL_STACKS:
+    # The swagger URL is for the Swagger API docs, it serves the precomputed schema and the swagger stack is imported
+    # on the first request
+    urlpatterns.append(
+        path('', lazy_view('product_feed.openapi.CachedSchemaView', title=settings.API_SCHEMA_TITLE), name='api_docs'),
+    )
+
+if 'admin' in settings.OPTIONAL_STACKS:
+    urlpatterns.append(path('admin/', admin.site.urls))
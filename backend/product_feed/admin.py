@@ -1,3 +1,280 @@
-from django.contrib import admin
+import json
 
-# Register your models here.
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .cache import item_cache
+from .models import AttributeValue, Change, Feed, Item, Product, RelatedProduct
+from .serializers import normalize_code, record_changes
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+        This is the paginator of the admin changelists. A COUNT(*) of a table with millions of rows reads the whole
+        table, so the count is estimated: from the planner statistics in pg_class.reltuples for an unfiltered
+        changelist, and from the planner's row estimate for a filtered or searched one. Only an estimate below
+        ADMIN_EXACT_COUNT_THRESHOLD rows is replaced with the exact count, which is cheap then.
+    """
+
+    def estimate(self):
+        """
+        :return: estimate : (float) the estimated number of rows of the changelist, -1 if the table has no statistics
+        """
+        queryset = self.object_list
+        with connections[queryset.db].cursor() as cursor:
+            if queryset.query.where:
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                return plan[0]['Plan']['Plan Rows']
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+            return cursor.fetchone()[0]
+
+    @cached_property
+    def count(self):
+        estimate = self.estimate()
+        if estimate < settings.ADMIN_EXACT_COUNT_THRESHOLD:
+            return self.object_list.count()
+        return int(estimate)
+
+
+def id_batches(queryset):
+    """
+    Iterate over the primary keys of a queryset in batches of ADMIN_ACTION_CHUNK_SIZE, every batch is a query of its
+    own so the batches can be written in transactions of their own.
+    :param queryset :(QuerySet):
+    :return: batches : (generator : list : int)
+    """
+    ids = queryset.order_by('pk').values_list('pk', flat=True)
+    last = None
+    while True:
+        batch = list((ids if last is None else ids.filter(pk__gt=last))[:settings.ADMIN_ACTION_CHUNK_SIZE])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+
+
+class AttributeListFilter(admin.SimpleListFilter):
+    """
+        Filters a changelist by a dictionary encoded attribute. The choices are read from the attribute's dictionary
+        instead of a SELECT DISTINCT over the table, see attribute_filter.
+    """
+    attribute = None
+
+    def lookups(self, request, model_admin):
+        values = AttributeValue.objects.filter(attribute=self.attribute).order_by('value').values_list(
+            'value', flat=True)
+        return [(value, value) for value in values]
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        return queryset.filter(**{self.parameter_name: self.value()})
+
+
+def attribute_filter(field_name):
+    """
+    :param field_name :(str): a DictionaryEncodedField of the model
+    :return: AttributeListFilter of the field
+    """
+    return type(f'{field_name.title().replace("_", "")}ListFilter', (AttributeListFilter,), {
+        'title': field_name.replace('_', ' '),
+        'parameter_name': field_name,
+        'attribute': field_name,
+    })
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    """
+        This is the base admin of the product feed models, built for tables with millions of rows: the changelist is
+        counted with EstimatedCountPaginator and never counted twice, the foreign keys of list_display are joined with
+        list_select_related, and the delete action runs as set based deletes in batches instead of collecting and
+        listing every object on a confirmation page.
+
+        methods:
+            - delete_selected_set
+            - delete_ids
+            - delete_model
+            - deleted_changes
+            - changes
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    ordering = ('-pk',)
+    actions = ('delete_selected_set',)
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    @admin.action(description='Delete selected %(verbose_name_plural)s', permissions=['delete'])
+    def delete_selected_set(self, request, queryset):
+        deleted = 0
+        for ids in id_batches(queryset):
+            with transaction.atomic():
+                deleted += self.delete_ids(ids)
+        self.message_user(request, f'Deleted {deleted} {self.opts.verbose_name_plural}.', messages.SUCCESS)
+
+    def delete_ids(self, ids):
+        """
+        :param ids :(list : int): a batch of primary keys
+        :return: deleted : (int) the number of deleted objects of the admin's model
+        """
+        changes = self.deleted_changes(ids)
+        deleted = self.model.objects.filter(pk__in=ids).delete()[1].get(self.opts.label, 0)
+        if changes:
+            record_changes(changes)
+        return deleted
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            self.delete_ids([obj.pk])
+
+    def deleted_changes(self, ids):
+        """
+        :param ids :(list : int): a batch of primary keys about to be deleted
+        :return: changes : (list : Change) the change feed rows of the products and items deleted with the objects,
+            the deletions move the conditional GET validators of the product endpoints
+        """
+        return []
+
+    def changes(self, obj, change):
+        """
+        :return: changes : (list : Change) the change feed rows of an object saved with the admin form
+        """
+        return []
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # like the ingestion paths, record the saved object in the change feed and refresh its documents
+        changes = self.changes(form.instance, change)
+        if changes:
+            record_changes(changes)
+
+
+class CodeSearchMixin:
+    """
+        Searches the changelist by an item's code or a gtin with an exact, indexed lookup, the search term is normalized
+        like the stored codes.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        try:
+            search_term = normalize_code(search_term.strip())
+        except ValueError:
+            pass
+        return super().get_search_results(request, queryset, search_term)
+
+
+@admin.register(Feed)
+class FeedAdmin(ScalableModelAdmin):
+    list_display = ('id', 'supplier_id', 'user_id', 'session_id', 'session_start_time', 'session_end_time')
+    search_fields = ('supplier_id__exact',)
+
+    def deleted_changes(self, ids):
+        return [Change(model=Change.PRODUCT, object_id=pk, action=Change.DELETED)
+                for pk in Product.objects.filter(product_feed_id__in=ids).values_list('pk', flat=True)]
+
+
+@admin.register(Product)
+class ProductAdmin(CodeSearchMixin, ScalableModelAdmin):
+    list_display = ('id', 'item_code', 'amount', 'bbd', 'lot_number', 'supplier_id', 'updated_at')
+    list_select_related = ('item', 'product_feed')
+    list_filter = ('updated_at',)
+    search_fields = ('item__code__exact',)
+    raw_id_fields = ('item', 'product_feed')
+
+    @admin.display(description='item code', ordering='item__code')
+    def item_code(self, product):
+        return product.item.code
+
+    @admin.display(description='supplier id')
+    def supplier_id(self, product):
+        return product.product_feed.supplier_id if product.product_feed else None
+
+    def deleted_changes(self, ids):
+        return [Change(model=Change.PRODUCT, object_id=pk, action=Change.DELETED) for pk in ids]
+
+    def changes(self, obj, change):
+        return [Change(model=Change.PRODUCT, object_id=obj.pk, action=Change.UPDATED if change else Change.CREATED)]
+
+
+@admin.register(Item)
+class ItemAdmin(CodeSearchMixin, ScalableModelAdmin):
+    list_display = ('id', 'code', 'type', 'brand', 'description', 'status', 'validation_status', 'updated_at')
+    list_filter = (attribute_filter('validation_status'), attribute_filter('status'), 'updated_at')
+    search_fields = ('code__exact',)
+    raw_id_fields = ('related_products',)
+    actions = ScalableModelAdmin.actions + ('mark_validated', 'mark_unvalidated')
+
+    def deleted_changes(self, ids):
+        # the identity cache must not resolve a deleted item
+        for key in Item.objects.filter(pk__in=ids).values_list('code', 'type'):
+            item_cache.discard(key)
+        return [Change(model=Change.PRODUCT, object_id=pk, action=Change.DELETED)
+                for pk in Product.objects.filter(item_id__in=ids).values_list('pk', flat=True)] + [
+            Change(model=Change.ITEM, object_id=pk, action=Change.DELETED) for pk in ids]
+
+    def changes(self, obj, change):
+        # the identity cache must not skip the next ingestion of the item's data as unchanged
+        item_cache.discard((obj.code, obj.type))
+        return [Change(model=Change.ITEM, object_id=obj.pk, action=Change.UPDATED if change else Change.CREATED)]
+
+    def set_validation_status(self, request, queryset, validation_status):
+        """
+        Update the validation status of the selected items with one UPDATE per batch, record the items in the change
+        feed and refresh their documents in the same transaction.
+        """
+        updated = 0
+        for ids in id_batches(queryset):
+            with transaction.atomic():
+                keys = list(Item.objects.filter(pk__in=ids).values_list('code', 'type'))
+                updated += Item.objects.filter(pk__in=ids).update(validation_status=validation_status,
+                                                                  updated_at=timezone.now())
+                record_changes([Change(model=Change.ITEM, object_id=pk, action=Change.UPDATED) for pk in ids])
+            for key in keys:
+                item_cache.discard(key)
+        self.message_user(request, f'Marked {updated} items as {validation_status}.', messages.SUCCESS)
+
+    @admin.action(description='Mark selected items as validated', permissions=['change'])
+    def mark_validated(self, request, queryset):
+        self.set_validation_status(request, queryset, 'validated')
+
+    @admin.action(description='Mark selected items as unvalidated', permissions=['change'])
+    def mark_unvalidated(self, request, queryset):
+        self.set_validation_status(request, queryset, 'unvalidated')
+
+
+@admin.register(RelatedProduct)
+class RelatedProductAdmin(CodeSearchMixin, ScalableModelAdmin):
+    list_display = ('id', 'gtin', 'trade_item_unit_descriptor')
+    search_fields = ('gtin__exact',)
+
+    def touch_linked_items(self, related_product_ids):
+        """
+        Touch the items the related products are linked to, their representation renders the related products.
+        :param related_product_ids :(list : int):
+        :return: changes : (list : Change) the change feed rows of the items
+        """
+        item_ids = list(Item.related_products.through.objects.filter(
+            relatedproduct_id__in=related_product_ids).values_list('item_id', flat=True).distinct())
+        Item.objects.filter(pk__in=item_ids).update(updated_at=timezone.now())
+        return [Change(model=Change.ITEM, object_id=item_id, action=Change.UPDATED) for item_id in item_ids]
+
+    def changes(self, obj, change):
+        return self.touch_linked_items([obj.pk])
+
+    def delete_ids(self, ids):
+        changes = self.touch_linked_items(ids)
+        deleted = super().delete_ids(ids)
+        record_changes(changes)
+        return deleted
@@ -0,0 +1,127 @@
+import logging
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from rest_framework.exceptions import Throttled
+
+from .coordination import ADMISSION_LOCK
+from .models import IngestionTicket
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionBusy(Throttled):
+    """
+        Raised when a feed upload is not admitted, the REST framework answers it with 429 and a Retry-After header.
+    """
+    default_detail = 'The feed ingestion is at capacity.'
+    extra_detail_singular = 'Retry in {wait} second.'
+    extra_detail_plural = 'Retry in {wait} seconds.'
+    default_code = 'ingestion_busy'
+
+    def __init__(self):
+        super().__init__(wait=settings.FEED_ADMISSION_RETRY_AFTER)
+
+
+def feed_size(data):
+    """
+    :param data :(Object): the parsed feed upload
+    :return: (str, int) the supplier id and the number of rows of the feed
+    """
+    if not isinstance(data, dict):
+        return '', 0
+    amounts = data.get('amounts')
+    return str(data.get('supplier_id') or ''), len(amounts) if isinstance(amounts, list) else 0
+
+
+@contextmanager
+def _admission():
+    """
+    Serialize an admission decision with those of every other worker and delete the tickets whose session ended
+    without releasing them. A ticket is locked with the session level advisory lock of its id as a single bigint key,
+    which never collides with the two key locks of the ingestion.
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, 0)', [ADMISSION_LOCK])
+            cursor.execute(
+                f'DELETE FROM {IngestionTicket._meta.db_table} ticket WHERE NOT EXISTS ('
+                f"SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND objsubid = 1 AND granted "
+                f'AND database = (SELECT oid FROM pg_database WHERE datname = current_database()) '
+                f'AND (classid::bigint << 32 | objid::bigint) = ticket.id)'
+            )
+            if cursor.rowcount:
+                logger.warning('Deleted %d ingestion tickets of ended sessions', cursor.rowcount)
+        yield
+
+
+def _fits(ingestions, rows_in_flight, rows, max_ingestions, max_rows):
+    # a feed larger than the row limit is admitted when nothing else is ingested
+    return ingestions < max_ingestions and (not ingestions or rows_in_flight + rows <= max_rows)
+
+
+def check_capacity():
+    """
+    Refuse an upload before its body is read when every ingestion slot is taken.
+    :raises IngestionBusy:
+    """
+    with _admission():
+        ingestions = IngestionTicket.objects.count()
+    if ingestions >= settings.FEED_ADMISSION_MAX_INGESTIONS:
+        logger.warning('Refused a feed upload, %d ingestions are in flight', ingestions)
+        raise IngestionBusy()
+
+
+def _acquire(supplier_id, rows):
+    """
+    :return: ticket : (IngestionTicket) the ticket of the upload if the ingestions in flight, globally and of its
+        supplier, leave room for another ingestion and its rows
+    :raises IngestionBusy: if there is no room
+    """
+    with _admission():
+        supplier = Q(supplier_id=supplier_id)
+        in_flight = IngestionTicket.objects.aggregate(
+            ingestions=Count('id'),
+            rows=Sum('rows'),
+            supplier_ingestions=Count('id', filter=supplier),
+            supplier_rows=Sum('rows', filter=supplier),
+        )
+        if not (
+            _fits(in_flight['ingestions'], in_flight['rows'] or 0, rows,
+                  settings.FEED_ADMISSION_MAX_INGESTIONS, settings.FEED_ADMISSION_MAX_ROWS)
+            and _fits(in_flight['supplier_ingestions'], in_flight['supplier_rows'] or 0, rows,
+                      settings.FEED_ADMISSION_SUPPLIER_MAX_INGESTIONS, settings.FEED_ADMISSION_SUPPLIER_MAX_ROWS)
+        ):
+            logger.warning('Refused a feed upload of supplier %s with %d rows, %d ingestions with %d rows are in '
+                           'flight', supplier_id, rows, in_flight['ingestions'], in_flight['rows'] or 0)
+            raise IngestionBusy()
+        ticket = IngestionTicket.objects.create(supplier_id=supplier_id, rows=rows)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)', [ticket.pk])
+    return ticket
+
+
+def _release(ticket):
+    IngestionTicket.objects.filter(pk=ticket.pk).delete()
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_unlock(%s)', [ticket.pk])
+
+
+@contextmanager
+def admit(supplier_id, rows):
+    """
+    Hold an ingestion slot for the block. The upload is admitted right away if the ingestions in flight, globally and
+    of its supplier, leave room for another ingestion and its rows, else it is refused: an upload never waits in the
+    web worker, so a burst of uploads cannot take every worker. The tickets are rows of the database, so the limits
+    hold across all the web workers.
+    :param supplier_id :(str): the supplier of the feed
+    :param rows :(int): the number of rows of the feed
+    :raises IngestionBusy: if there is no room for the upload
+    """
+    ticket = _acquire(supplier_id, rows)
+    try:
+        yield ticket
+    finally:
+        _release(ticket)
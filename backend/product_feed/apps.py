@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ProductConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'product_feed'
+
+    def ready(self):
+        # register the signal receivers
+        from . import signals  # noqa: F401
@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+
+class LRUCache:
+    """
+        This is a bounded, thread safe, process local least recently used cache with hit and miss counters.
+
+        :param
+            - max_size : int (the number of entries kept, the least recently used entry is evicted beyond)
+
+        methods:
+            - get
+            - set
+            - discard
+            - clear
+            - stats
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """
+        :return: stats : (Object) the hit and miss counters and the size of the cache
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'max_size': self.max_size}
+
+
+class ItemIdentityCache(LRUCache):
+    """
+        This is the identity map of the ingestion paths from an Item's (code, type) to its primary key. It only spares
+        the lookup of an item, the item is still written by its primary key, so the writes of other processes are
+        never skipped.
+
+        Entries written inside a transaction are only published once the transaction commits, so a rolled back create
+        never leaves an identifier in the cache that is not in the database.
+
+        methods:
+            - set_on_commit
+    """
+
+    def set_on_commit(self, key, item_id, using=DEFAULT_DB_ALIAS):
+        transaction.on_commit(lambda: self.set(key, item_id), using=using)
+
+
+item_cache = ItemIdentityCache(settings.ITEM_IDENTITY_CACHE_SIZE)
@@ -0,0 +1,234 @@
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+
+# The code index file, all integers little endian:
+#   header  : magic, version, the change token the index is complete up to, the offset and number of the table records
+#   payload : for every code, the newest product and item updated_at in microseconds since the epoch, the number of
+#             products and every product's primary key and JSON document prefixed with its length
+#   table   : a record per code sorted by code, the code padded to CODE_SIZE bytes and the offset and size of its payload
+MAGIC = b'PFCI'
+VERSION = 2
+HEADER = struct.Struct('<4sHqQI')
+CODE_SIZE = 20
+RECORD = struct.Struct(f'<{CODE_SIZE}sQI')
+WATERMARK = struct.Struct('<qqI')
+PRODUCT = struct.Struct('<qI')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+NO_TIME = -2 ** 63
+
+CodeIndexEntry = namedtuple('CodeIndexEntry', ('product_max', 'item_max', 'documents'))
+EMPTY_ENTRY = CodeIndexEntry(None, None, [])
+
+
+def _micros(value):
+    return NO_TIME if value is None else (value - EPOCH) // MICROSECOND
+
+
+def _datetime(value):
+    return None if value == NO_TIME else EPOCH + value * MICROSECOND
+
+
+def encode_payload(product_max, item_max, products):
+    """
+    :param product_max :(DateTime): the newest updated_at of the code's products
+    :param item_max :(DateTime): the newest updated_at of the code's items
+    :param products :(list : (int, str)): the primary key and the JSON document of every product of the code
+    :return: payload : (bytes) the payload of the code in the code index
+    """
+    parts = [WATERMARK.pack(_micros(product_max), _micros(item_max), len(products))]
+    for pk, document in products:
+        document = document.encode()
+        parts.append(PRODUCT.pack(pk, len(document)))
+        parts.append(document)
+    return b''.join(parts)
+
+
+def write_code_index(path, entries, token):
+    """
+    Write the code index to a temporary file next to it and atomically replace the index, the readers keep the mapping
+    of the file they opened until they see the new one.
+    :param path :(str): the code index file
+    :param entries :(iterable : (str, bytes)): the code and the payload of every code, every code once, see
+        encode_payload
+    :param token :(int): the change token of the snapshot the entries are read from
+    :return: codes : (int) the number of codes in the index
+    """
+    partial = f'{path}.{os.getpid()}.partial'
+    records = []
+    with open(partial, 'wb') as index:
+        index.write(bytes(HEADER.size))
+        for code, payload in entries:
+            key = code.encode()
+            if len(key) > CODE_SIZE:
+                continue
+            records.append((key.ljust(CODE_SIZE, b'\0'), index.tell(), len(payload)))
+            index.write(payload)
+
+        table_offset = index.tell()
+        records.sort()
+        for record in records:
+            index.write(RECORD.pack(*record))
+        index.seek(0)
+        index.write(HEADER.pack(MAGIC, VERSION, token, table_offset, len(records)))
+        index.flush()
+        os.fsync(index.fileno())
+    os.replace(partial, path)
+    return len(records)
+
+
+class CodeIndex:
+    """
+        This is the read only view of the code index file from an item's code to the pre-rendered documents of its
+        products. The file is memory mapped, so all the worker processes of a host share its pages in the page cache
+        instead of every process caching the products; a lookup is a binary search over the mapped table. The file is
+        remapped when it has been replaced, and it is only served while it is complete up to the newest change token
+        of the database, which every write moves, see record_changes.
+
+        methods:
+            - token
+            - is_fresh
+            - lookup
+            - product_ids
+            - payloads
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+        self._header = None
+
+    def _open(self, path):
+        """
+        :return: (mmap, tuple) the mapping and the header of the current index file, (None, None) if there is no index
+        """
+        try:
+            identity = os.stat(path)
+        except FileNotFoundError:
+            return None, None
+        identity = (path, identity.st_ino, identity.st_mtime_ns)
+        with self._lock:
+            if self._file != identity:
+                with open(path, 'rb') as index:
+                    mapping = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+                header = HEADER.unpack_from(mapping)
+                if header[:2] != (MAGIC, VERSION):
+                    mapping, header = None, None
+                self._file, self._map, self._header = identity, mapping, header
+            return self._map, self._header
+
+    def token(self, path=None):
+        """
+        :param path :(str): the code index file, defaults to PRODUCT_CODE_INDEX_PATH
+        :return: token : (int) the change token the index is complete up to, None if there is no index
+        """
+        path = path or settings.PRODUCT_CODE_INDEX_PATH
+        header = self._open(path)[1] if path else None
+        return None if header is None else header[2]
+
+    def is_fresh(self, token, path=None):
+        """
+        :param token :(int): the newest change token of the database
+        :param path :(str): the code index file, defaults to PRODUCT_CODE_INDEX_PATH
+        :return: fresh : (bool) whether the index exists and no change was committed after its snapshot
+        """
+        index_token = self.token(path)
+        return index_token is not None and index_token >= token
+
+    def _find(self, mapping, header, key):
+        """
+        :return: (int, int) the offset and the size of the payload of the padded code, None if it is not in the index
+        """
+        _, _, _, table_offset, count = header
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            position = table_offset + middle * RECORD.size
+            found = mapping[position:position + CODE_SIZE]
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                return RECORD.unpack_from(mapping, position)[1:]
+        return None
+
+    def _products(self, mapping, header, code):
+        """
+        :return: (tuple, generator) the newest product and item updated_at in microseconds and the primary key and
+            the document offset and length of every product of the code; None if the code is not in the index
+        """
+        key = code.encode()
+        if len(key) > CODE_SIZE:
+            return None
+        found = self._find(mapping, header, key.ljust(CODE_SIZE, b'\0'))
+        if found is None:
+            return None
+        offset = found[0]
+        product_max, item_max, count = WATERMARK.unpack_from(mapping, offset)
+
+        def products(offset=offset + WATERMARK.size):
+            for _ in range(count):
+                pk, length = PRODUCT.unpack_from(mapping, offset)
+                offset += PRODUCT.size
+                yield pk, offset, length
+                offset += length
+        return (product_max, item_max), products()
+
+    def lookup(self, code, token, path=None):
+        """
+        :param code :(str): the item's code as it is stored
+        :param token :(int): the newest change token of the database
+        :param path :(str): the code index file, defaults to PRODUCT_CODE_INDEX_PATH
+        :return: entry : (CodeIndexEntry) the watermark and the product documents of the code, EMPTY_ENTRY if the code
+            has no products, None if there is no fresh index
+        """
+        path = path or settings.PRODUCT_CODE_INDEX_PATH
+        if not path:
+            return None
+        mapping, header = self._open(path)
+        if mapping is None or header[2] < token:
+            return None
+        found = self._products(mapping, header, code)
+        if found is None:
+            return EMPTY_ENTRY
+        (product_max, item_max), products = found
+        return CodeIndexEntry(_datetime(product_max), _datetime(item_max),
+                              [mapping[offset:offset + length].decode() for _, offset, length in products])
+
+    def product_ids(self, code, path=None):
+        """
+        :param code :(str): the item's code as it is stored
+        :param path :(str): the code index file, defaults to PRODUCT_CODE_INDEX_PATH
+        :return: ids : (set : int) the primary keys of the products of the code in the index, fresh or not
+        """
+        path = path or settings.PRODUCT_CODE_INDEX_PATH
+        mapping, header = self._open(path) if path else (None, None)
+        found = None if mapping is None else self._products(mapping, header, code)
+        return set() if found is None else {pk for pk, _, _ in found[1]}
+
+    def payloads(self, path=None):
+        """
+        :param path :(str): the code index file, defaults to PRODUCT_CODE_INDEX_PATH
+        :return: payloads : (generator : (str, bytes)) the code and the payload of every code in the index, fresh or
+            not, see write_code_index
+        """
+        path = path or settings.PRODUCT_CODE_INDEX_PATH
+        mapping, header = self._open(path) if path else (None, None)
+        if mapping is None:
+            return
+        _, _, _, table_offset, count = header
+        for position in range(table_offset, table_offset + count * RECORD.size, RECORD.size):
+            key, offset, size = RECORD.unpack_from(mapping, position)
+            yield key.rstrip(b'\0').decode(), mapping[offset:offset + size]
+
+
+code_index = CodeIndex()
@@ -0,0 +1,111 @@
+import hashlib
+
+from django.conf import settings
+from django.db import connections, router
+
+from .code_index import code_index
+from .models import Change, Item, Product
+
+# the token and the time of the latest deletion, resolved from the partial index of the deletions
+LATEST_DELETION = (
+    f'(SELECT id FROM {Change._meta.db_table} WHERE action = %s ORDER BY id DESC LIMIT 1), '
+    f'(SELECT created_at FROM {Change._meta.db_table} WHERE action = %s ORDER BY id DESC LIMIT 1)'
+)
+
+
+def _change_state(request):
+    """
+    Read the newest change token and the latest deletion in one query and memoize them on the request.
+    :param request : (Request)
+    :return: (tuple) newest change token, latest deletion token, latest deletion time
+    """
+    if not hasattr(request, '_change_state'):
+        with connections[router.db_for_read(Product)].cursor() as cursor:
+            cursor.execute(
+                f'SELECT (SELECT id FROM {Change._meta.db_table} ORDER BY id DESC LIMIT 1), {LATEST_DELETION}',
+                [Change.DELETED, Change.DELETED],
+            )
+            token, deletion_token, deleted_at = cursor.fetchone()
+        request._change_state = (token or 0, deletion_token, deleted_at)
+    return request._change_state
+
+
+def lookup_code(request, code):
+    """
+    Look up the code in the code index and memoize the entry on the request, the conditional GET callables and the
+    detail view use the same entry. The index is only served if it is complete up to the newest change token of the
+    database, so an index which missed a write of any host is never served.
+    :param request : (Request)
+    :param code : (str) the item's code
+    :return: entry : (CodeIndexEntry) or None if there is no fresh index
+    """
+    if not hasattr(request, '_code_index_entry'):
+        request._code_index_entry = None
+        if settings.PRODUCT_CODE_INDEX_PATH:
+            request._code_index_entry = code_index.lookup(code, _change_state(request)[0])
+    return request._code_index_entry
+
+
+def _watermark(request, code=None):
+    """
+    Compute the change watermark of the requested product resource and memoize it on the request, because the
+    ETag and the Last-Modified callables of the condition decorator are called one after another for the same request.
+
+    The watermark is the newest updated_at of the products and of their items, and the latest deletion of the change
+    feed, a deleted product does not move the newest updated_at. The columns are indexed so the watermark is resolved
+    from the indexes in one query without reading the row data. The updated_at of a code in a fresh code index are read
+    from the index, with the latest deletion of the query which checked the index's freshness.
+    :param request : (Request)
+    :param code : (str) item's code for the detail resource, None for the listing
+    :return: (tuple) newest product updated_at, newest item updated_at, latest deletion token, latest deletion time
+    """
+    if not hasattr(request, '_product_watermark'):
+        product_table, item_table = Product._meta.db_table, Item._meta.db_table
+        entry = None if code is None else lookup_code(request, code)
+        if entry is not None:
+            request._product_watermark = (entry.product_max, entry.item_max) + _change_state(request)[1:]
+            return request._product_watermark
+        if code is None:
+            sql = (f'SELECT (SELECT MAX(updated_at) FROM {product_table}), (SELECT MAX(updated_at) FROM {item_table}), '
+                   f'{LATEST_DELETION}')
+            params = [Change.DELETED, Change.DELETED]
+        else:
+            sql = (f'SELECT MAX(product.updated_at), MAX(item.updated_at), {LATEST_DELETION} '
+                   f'FROM {product_table} product JOIN {item_table} item ON item.id = product.item_id '
+                   f'WHERE item.code = %s')
+            params = [Change.DELETED, Change.DELETED, code]
+        with connections[router.db_for_read(Product)].cursor() as cursor:
+            cursor.execute(sql, params)
+            request._product_watermark = cursor.fetchone()
+    return request._product_watermark
+
+
+def product_etag(request, code=None, **kwargs):
+    """
+    ETag callable for the product list and detail views.
+    The tag changes as soon as a product or an item is written or deleted, for the page and the renderer that was
+    asked.
+    :param request : (Request)
+    :param code : (str) item's code for the detail resource
+    :return: etag : (str)
+    """
+    product_max, item_max, deletion_token, _ = _watermark(request, code)
+    key = '|'.join((
+        request.get_full_path(),
+        request.META.get('HTTP_ACCEPT', ''),
+        product_max.isoformat() if product_max else '',
+        item_max.isoformat() if item_max else '',
+        str(deletion_token or ''),
+    ))
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def product_last_modified(request, code=None, **kwargs):
+    """
+    Last-Modified callable for the product list and detail views.
+    :param request : (Request)
+    :param code : (str) item's code for the detail resource
+    :return: last_modified : (DateTime) or None if there are no products yet
+    """
+    product_max, item_max, _, deleted_at = _watermark(request, code)
+    return max(filter(None, (product_max, item_max, deleted_at)), default=None)
@@ -0,0 +1,152 @@
+import logging
+import time
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.db.models import Max
+
+from .models import Change
+
+logger = logging.getLogger(__name__)
+
+# the first keys of the two key advisory locks of the ingestion, they keep its locks apart from any other advisory lock
+SUPPLIER_LOCK = 1
+ITEM_RANGE_LOCK = 2
+# the transaction level lock the admission decisions of the feed uploads are serialized on, see admission
+ADMISSION_LOCK = 3
+# the session level lock the code index rebuilds of all the workers queue on, see documents.rebuild_code_index
+CODE_INDEX_LOCK = 4
+# the transaction level lock the change tokens are allocated under, see lock_change_feed
+CHANGE_FEED_LOCK = 5
+
+# the lock waits of the ingestion running in the current context, by lock kind
+_lock_waits = ContextVar('lock_waits', default=None)
+
+
+def _int4(value):
+    """
+    :return: key : (int) the value folded into the signed 32 bit range of an advisory lock key
+    """
+    return (value % 2 ** 32) - 2 ** 31
+
+
+def supplier_key(supplier_id):
+    """
+    :param supplier_id :(str):
+    :return: key : (int) the advisory lock key of the supplier
+    """
+    return _int4(zlib.crc32(str(supplier_id).encode()))
+
+
+def item_range_key(code):
+    """
+    The Item keys are locked by ranges of ITEM_LOCK_RANGE_SIZE codes, the codes of one supplier mostly share their
+    company prefix and so a few ranges.
+    :param code :(str): the normalized item's code
+    :return: key : (int) the advisory lock key of the code's range
+    """
+    try:
+        return _int4(int(code) // settings.ITEM_LOCK_RANGE_SIZE)
+    except (TypeError, ValueError):
+        return _int4(zlib.crc32(str(code).encode()))
+
+
+def item_sort_key(item_data):
+    """
+    :param item_data :(Object): the validated item data
+    :return: (tuple) the order the ingestion writes the items in, the same for every ingestion
+    """
+    return item_data.get('code') or '', item_data.get('type') or ''
+
+
+def _acquire(kind, sql, params):
+    start = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+    waited = time.perf_counter() - start
+
+    waits = _lock_waits.get()
+    if waits is not None:
+        waits[kind] = waits.get(kind, 0) + waited
+    if waited >= settings.INGESTION_LOCK_WAIT_WARNING:
+        logger.warning('Waited %.3fs for the %s lock of an ingestion', waited, kind, extra={
+            'lock': kind, 'lock_wait': waited})
+    else:
+        logger.debug('Waited %.3fs for the %s lock of an ingestion', waited, kind, extra={
+            'lock': kind, 'lock_wait': waited})
+
+
+@contextmanager
+def track_lock_waits():
+    """
+    Collect the time the ingestion inside the block waits for its locks.
+    :return: waits : (dict) the seconds waited by lock kind, supplier or items, filled as the block runs
+    """
+    waits = {}
+    token = _lock_waits.set(waits)
+    try:
+        yield waits
+    finally:
+        _lock_waits.reset(token)
+
+
+@contextmanager
+def supplier_lock(supplier_id):
+    """
+    Hold the session level advisory lock of the supplier for the block, so the ingestions of one supplier queue while
+    those of different suppliers run in parallel. The lock is held across the transactions of the block, it must be
+    taken before and released after them.
+    :param supplier_id :(str):
+    """
+    key = supplier_key(supplier_id)
+    _acquire('supplier', 'SELECT pg_advisory_lock(%s, %s)', [SUPPLIER_LOCK, key])
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s, %s)', [SUPPLIER_LOCK, key])
+
+
+def lock_item_ranges(codes):
+    """
+    Take the transaction level advisory locks of the Item key ranges of the codes, all at once and in ascending key
+    order. An ingestion takes its range locks before it writes any item and none afterwards, so two ingestions never
+    wait on each other's Item rows and cannot deadlock; they only queue if their ranges overlap.
+    :param codes :(list : str): the normalized item's codes the transaction writes
+    """
+    keys = sorted({item_range_key(code) for code in codes})
+    if keys:
+        _acquire('items', 'SELECT pg_advisory_xact_lock(%s, key) FROM unnest(%s::integer[]) AS key',
+                 [ITEM_RANGE_LOCK, keys])
+
+
+def lock_change_feed():
+    """
+    Take the transaction level lock of the change feed, the last lock of a writing transaction. The change tokens are
+    allocated while it is held and it is released on commit, so the tokens become visible in commit order: a consumer
+    which has seen a token never sees a lower one appear afterwards. Only the end of the writing transactions is
+    serialized, the lock is taken once their rows are written.
+    """
+    _acquire('changes', 'SELECT pg_advisory_xact_lock(%s, 0)', [CHANGE_FEED_LOCK])
+
+
+def latest_change_token(using=DEFAULT_DB_ALIAS):
+    """
+    The change tokens are allocated in commit order under the lock of the change feed, see lock_change_feed, so a
+    change committed after the newest visible token always gets a higher token: the token is a watermark of everything
+    committed up to it, for the incremental snapshots and the code index.
+    :param using :(str): the database alias
+    :return: token : (int) the newest token of the change feed, 0 if there are no changes yet
+    """
+    return Change.objects.using(using).aggregate(token=Max('id'))['token'] or 0
+
+
+def server_timing(waits):
+    """
+    :param waits :(dict): the seconds waited by lock kind, see track_lock_waits
+    :return: header : (str) the Server-Timing header value of the lock waits in milliseconds
+    """
+    return ', '.join(f'{kind}-lock;dur={seconds * 1000:.1f}' for kind, seconds in sorted(waits.items()))
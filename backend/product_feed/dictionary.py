@@ -0,0 +1,215 @@
+import threading
+
+from django.apps import apps
+from django.core.exceptions import FieldError
+from django.db import connections, models
+
+# a code never assigned, a lookup of a value which is not in the dictionary matches no row
+UNKNOWN_CODE = -1
+
+# the lookups which compare the codes like the values, the other lookups of a CharField would compare the codes
+SUPPORTED_LOOKUPS = ('exact', 'in', 'isnull')
+
+_insert_connections = {}
+_insert_lock = threading.Lock()
+
+
+def insert_connection(using):
+    """
+    The autocommit connection the dictionaries of the process insert their new values with, one per database. It is
+    opened on the first new value and kept for the lifetime of the process, the inserts are serialized by _insert_lock.
+    :param using :(str): the database alias
+    :return: DatabaseWrapper
+    """
+    connection = _insert_connections.get(using)
+    if connection is None:
+        connection = _insert_connections[using] = connections.create_connection(using)
+        connection.inc_thread_sharing()
+    elif connection.connection is not None and not connection.is_usable():
+        connection.close()
+    return connection
+
+
+def close_insert_connections():
+    """
+    Close the insert connections of the process, e.g. before the test databases are dropped.
+    """
+    with _insert_lock:
+        for connection in _insert_connections.values():
+            connection.close()
+
+
+class AttributeDictionary:
+    """
+        This is the process local dictionary of one encoded attribute, the encode map from value to code and the
+        decode map from code to value.
+
+        New values are inserted by a dedicated autocommit connection, so a code is committed before any row stores it
+        and the maps never hold a code which a rolled back transaction assigned. A value or a code missing from the
+        maps is read from the database on its own. The codes of an attribute are numbered from one in insertion order
+        and never reused.
+
+        :param
+            - attribute : str (the name of the attribute the codes belong to)
+
+        methods:
+            - encode
+            - decode
+            - clear
+    """
+    def __init__(self, attribute):
+        self.attribute = attribute
+        self._codes = {}
+        self._values = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def table():
+        return apps.get_model('product_feed', 'AttributeValue')._meta.db_table
+
+    def _remember(self, code, value):
+        with self._lock:
+            self._codes[value] = code
+            self._values[code] = value
+
+    def _fetch(self, key_column, key, using):
+        """
+        Read the entry of a value or a code missing from the maps, a miss reads that entry only.
+        :return: (int, str) the code and the value, None if the entry is not in the dictionary
+        """
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'SELECT code, value FROM {self.table()} WHERE attribute = %s AND {key_column} = %s',
+                           [self.attribute, key])
+            entry = cursor.fetchone()
+        if entry is not None:
+            self._remember(*entry)
+        return entry
+
+    def _insert(self, value, using):
+        """
+        Insert the value with the next code of the attribute on the autocommit connection of the process, see
+        insert_connection. A concurrent insert of the same value wins, a concurrent insert of another value with the
+        same code is retried with the next code.
+        """
+        with _insert_lock:
+            with insert_connection(using).cursor() as cursor:
+                while True:
+                    cursor.execute(
+                        f'INSERT INTO {self.table()} (attribute, code, value) '
+                        f'SELECT %s, COALESCE(MAX(code), 0) + 1, %s FROM {self.table()} WHERE attribute = %s '
+                        f'ON CONFLICT DO NOTHING RETURNING code',
+                        [self.attribute, value, self.attribute],
+                    )
+                    row = cursor.fetchone()
+                    if row is None:
+                        cursor.execute(f'SELECT code FROM {self.table()} WHERE attribute = %s AND value = %s',
+                                       [self.attribute, value])
+                        row = cursor.fetchone()
+                    if row is not None:
+                        return row[0]
+
+    def encode(self, value, using, create=False):
+        """
+        :param value :(str):
+        :param using :(str): the database alias
+        :param create :(bool): add the value to the dictionary if it is not in it yet
+        :return: code : (int) UNKNOWN_CODE for a value which is not in the dictionary and not created
+        """
+        code = self._codes.get(value)
+        if code is None:
+            entry = self._fetch('value', value, using)
+            code = entry and entry[0]
+        if code is None:
+            if not create:
+                return UNKNOWN_CODE
+            code = self._insert(value, using)
+            self._remember(code, value)
+        return code
+
+    def decode(self, code, using):
+        """
+        :param code :(int):
+        :param using :(str): the database alias
+        :return: value : (str)
+        """
+        try:
+            return self._values[code]
+        except KeyError:
+            entry = self._fetch('code', code, using)
+        if entry is None:
+            raise ValueError(f'Unknown code {code} of the {self.attribute} dictionary.')
+        return entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._codes.clear()
+            self._values.clear()
+
+
+dictionaries = {}
+
+
+class DictionaryEncodedField(models.CharField):
+    """
+        A low cardinality string attribute stored as a small integer code of the attribute's dictionary. The Python
+        value, the forms and the serializers stay those of a CharField; only the exact, in and isnull lookups are
+        supported, any other lookup or transform raises a FieldError, and ordering follows the codes.
+
+        :param
+            - attribute : str (the dictionary of the field, defaults to the field name)
+            - small : bool (smallint codes, integer codes for attributes with more than 32767 values)
+    """
+
+    def __init__(self, *args, attribute=None, small=True, **kwargs):
+        self.attribute = self.explicit_attribute = attribute
+        self.small = small
+        super().__init__(*args, **kwargs)
+
+    def contribute_to_class(self, cls, name, *args, **kwargs):
+        super().contribute_to_class(cls, name, *args, **kwargs)
+        self.attribute = self.attribute or name
+        self.dictionary = dictionaries.setdefault(self.attribute, AttributeDictionary(self.attribute))
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.explicit_attribute:
+            kwargs['attribute'] = self.explicit_attribute
+        if not self.small:
+            kwargs['small'] = False
+        return name, path, args, kwargs
+
+    def db_type(self, connection):
+        return 'smallint' if self.small else 'integer'
+
+    def get_lookup(self, lookup_name):
+        if lookup_name not in SUPPORTED_LOOKUPS:
+            raise FieldError(f'Unsupported lookup "{lookup_name}" of the dictionary encoded field {self.name}, only '
+                             f'{", ".join(SUPPORTED_LOOKUPS)} compare the values.')
+        return super().get_lookup(lookup_name)
+
+    def get_transform(self, lookup_name):
+        raise FieldError(f'Unsupported transform "{lookup_name}" of the dictionary encoded field {self.name}.')
+
+    def cast_db_type(self, connection):
+        return self.db_type(connection)
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return self.dictionary.decode(value, connection.alias)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None:
+            return value
+        return self.dictionary.encode(value, connection.alias)
+
+    def get_db_prep_save(self, value, connection):
+        if hasattr(value, 'as_sql'):
+            # an expression, e.g. the CASE of bulk_update, its values are encoded when it is compiled
+            return value
+        value = self.get_prep_value(value)
+        if value is None:
+            return value
+        return self.dictionary.encode(value, connection.alias, create=True)
@@ -0,0 +1,298 @@
+import json
+import logging
+import threading
+import time
+from itertools import chain
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils.functional import cached_property
+
+from .code_index import code_index, encode_payload, write_code_index
+from .coordination import CODE_INDEX_LOCK, latest_change_token
+from .models import Change, Item, ItemDocument, Product, ProductDocument
+from .serializers import ProductSerializer, render_documents, render_json
+
+logger = logging.getLogger(__name__)
+
+
+def join_document(product_document, item_document):
+    """
+    :param product_document :(str): the stored document of a product, without its item
+    :param item_document :(str): the stored document of the product's item
+    :return: document : (str) the document of the product with its item
+    """
+    return f'{product_document[:-1]},"item":{item_document}}}'
+
+
+def load_documents(product_ids, using):
+    """
+    Load the documents of the products by concatenating their stored documents with those of their items, no model is
+    instantiated and nothing is serialized. A product whose document or whose item's document is not stored yet, e.g.
+    one written before the documents existed, is rendered with ProductSerializer.
+    :param product_ids :(list : int):
+    :param using :(str): the database alias to read from
+    :return: documents : (list : str) the JSON documents in the order of the ids, deleted products are skipped
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'SELECT product.id, product_document.document, item_document.document '
+            f'FROM {Product._meta.db_table} product '
+            f'LEFT JOIN {ProductDocument._meta.db_table} product_document ON product_document.product_id = product.id '
+            f'LEFT JOIN {ItemDocument._meta.db_table} item_document ON item_document.item_id = product.item_id '
+            f'WHERE product.id = ANY(%s)',
+            [list(product_ids)],
+        )
+        documents = {
+            pk: join_document(product_document, item_document)
+            for pk, product_document, item_document in cursor.fetchall()
+            if product_document is not None and item_document is not None
+        }
+
+    missing = [pk for pk in product_ids if pk not in documents]
+    if missing:
+        products = Product.objects.using(using).filter(pk__in=missing).select_related('item').prefetch_related(
+            'item__related_products')
+        documents.update((product.pk, render_json(ProductSerializer(product).data)) for product in products)
+    return [documents[pk] for pk in product_ids if pk in documents]
+
+
+class DocumentResponse(HttpResponse):
+    """
+        A JSON response whose body is assembled from stored documents. The data of the response is parsed from the
+        body on access only, for the callers which inspect it like the data of a REST framework Response.
+    """
+
+    def __init__(self, content, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content, **kwargs)
+
+    @cached_property
+    def data(self):
+        return json.loads(self.content)
+
+
+def batches(queryset, size):
+    """
+    Iterate over a queryset in primary key order in batches, every batch is a query of its own.
+    :param queryset :(QuerySet):
+    :param size :(int): the number of objects per batch
+    :return: batches : (generator : list) the objects of every batch
+    """
+    last = None
+    while True:
+        batch = queryset.order_by('pk')
+        if last is not None:
+            batch = batch.filter(pk__gt=last)
+        batch = list(batch[:size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1].pk
+
+
+def document_batches(size):
+    """
+    Render the documents of all the items and then of all the products, batch by batch.
+    :param size :(int): the number of objects per batch
+    :return: batches : (generator : (dict, dict)) the product documents and the item documents of every batch, see
+        render_documents
+    """
+    for items in batches(Item.objects.prefetch_related('related_products'), size):
+        yield render_documents(items=items)
+    for products in batches(Product.objects.all(), size):
+        yield render_documents(products=products)
+
+
+def stale_documents(product_documents, item_documents):
+    """
+    Compare freshly rendered documents with the stored ones.
+    :param product_documents :(dict): the rendered product documents by product primary key
+    :param item_documents :(dict): the rendered item documents by item primary key
+    :return: (dict, dict, int) the product documents and the item documents which are missing or differ from the
+        stored ones, and how many of them are missing
+    """
+    stored_products = dict(ProductDocument.objects.filter(pk__in=product_documents).values_list('pk', 'document'))
+    stored_items = dict(ItemDocument.objects.filter(pk__in=item_documents).values_list('pk', 'document'))
+    stale_products = {pk: document for pk, document in product_documents.items()
+                      if stored_products.get(pk) != document}
+    stale_items = {pk: document for pk, document in item_documents.items() if stored_items.get(pk) != document}
+    missing = len(set(product_documents) - set(stored_products)) + len(set(item_documents) - set(stored_items))
+    return stale_products, stale_items, missing
+
+
+def code_index_entries(using, codes=None, batch_size=10000):
+    """
+    Read the documents of the products grouped by their item's code from a server side cursor, in the current
+    transaction.
+    :param using :(str): the database alias to read from
+    :param codes :(set : str): only read the products of these codes, all of them if None
+    :param batch_size :(int): the rows fetched per round trip
+    :return: entries : (generator : (str, bytes)) the code and the payload of every code, the newest product and item
+        updated_at and the documents of the code's products in primary key order, see write_code_index
+    """
+    group = None
+
+    def entry():
+        code, product_max, item_max, documents = group
+        missing = [pk for pk, document in documents if document is None]
+        rendered = dict(zip(missing, load_documents(missing, using))) if missing else {}
+        return code, encode_payload(product_max, item_max, [(pk, document or rendered[pk]) for pk, document in documents
+                                                            if document or pk in rendered])
+
+    where, params = ('', []) if codes is None else ('WHERE item.code = ANY(%s) ', [list(codes)])
+    with connections[using].chunked_cursor() as cursor:
+        cursor.execute(
+            f'SELECT item.code, product.id, product.updated_at, item.updated_at, product_document.document, '
+            f'item_document.document '
+            f'FROM {Product._meta.db_table} product '
+            f'JOIN {Item._meta.db_table} item ON item.id = product.item_id '
+            f'LEFT JOIN {ProductDocument._meta.db_table} product_document ON product_document.product_id = product.id '
+            f'LEFT JOIN {ItemDocument._meta.db_table} item_document ON item_document.item_id = product.item_id '
+            f'{where}ORDER BY item.code, product.id',
+            params,
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for code, pk, product_updated, item_updated, product_document, item_document in rows:
+                if group is None or group[0] != code:
+                    if group is not None:
+                        yield entry()
+                    group = [code, product_updated, item_updated, []]
+                group[1] = max(group[1], product_updated)
+                group[2] = max(group[2], item_updated)
+                document = None
+                if product_document is not None and item_document is not None:
+                    document = join_document(product_document, item_document)
+                group[3].append((pk, document))
+    if group is not None:
+        yield entry()
+
+
+def changed_codes(using, since, path):
+    """
+    Find the codes of the code index whose entries the changes committed after its snapshot touch. The changes of the
+    products and of the items are resolved to the current codes of the products, an entry is rewritten with all the
+    products of its code.
+    :param using :(str): the database alias to read from
+    :param since :(int): the change token of the index
+    :param path :(str): the code index file
+    :return: codes : (set : str) the codes to rewrite, None if the index must be rebuilt in full: there are more than
+        PRODUCT_CODE_INDEX_MAX_CHANGES changes, something was deleted or a product moved to another code
+    """
+    changes = list(Change.objects.using(using).filter(pk__gt=since).order_by('pk').values_list(
+        'model', 'object_id', 'action')[:settings.PRODUCT_CODE_INDEX_MAX_CHANGES + 1])
+    if len(changes) > settings.PRODUCT_CODE_INDEX_MAX_CHANGES:
+        return None
+    if any(action == Change.DELETED for _, _, action in changes):
+        return None
+
+    product_ids = {object_id for model, object_id, _ in changes if model == Change.PRODUCT}
+    item_ids = {object_id for model, object_id, _ in changes if model == Change.ITEM}
+    created = {object_id for model, object_id, action in changes
+               if model == Change.PRODUCT and action == Change.CREATED}
+    products = {}
+    for pk, code in Product.objects.using(using).filter(
+            Q(pk__in=product_ids) | Q(item_id__in=item_ids)).values_list('pk', 'item__code'):
+        products.setdefault(code, set()).add(pk)
+    for code, pks in products.items():
+        # a product of the index which is not in the entry of its code moved there from another code
+        if pks - created - code_index.product_ids(code, path):
+            return None
+    return set(products)
+
+
+def rebuild_code_index(using=DEFAULT_DB_ALIAS, force=False):
+    """
+    Bring the code index up to the newest change token, from one repeatable read snapshot of the documents. Only the
+    entries of the codes changed after the index's token are read again and merged with the other entries of the
+    index, see changed_codes. The rebuilds of all the workers queue on an advisory lock, a rebuild which finds the
+    index fresh once it holds the lock skips, so a burst of writes rebuilds the index once or twice instead of once per
+    write.
+    :param using :(str): the database alias to read from
+    :param force :(bool): rebuild the whole index even if it is fresh
+    :return: codes : (int) the number of codes in the rebuilt index, None if the index was fresh or is disabled
+    """
+    path = settings.PRODUCT_CODE_INDEX_PATH
+    if not path:
+        return None
+    database = connections[using]
+    with database.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_lock(%s, 0)', [CODE_INDEX_LOCK])
+    try:
+        start = time.perf_counter()
+        outermost = not database.in_atomic_block
+        with transaction.atomic(using=using):
+            if outermost:
+                with database.cursor() as cursor:
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+            token = latest_change_token(using)
+            since = None if force else code_index.token(path)
+            if since is not None and since >= token:
+                return None
+            codes = None if since is None else changed_codes(using, since, path)
+            if codes is None:
+                entries = code_index_entries(using)
+            else:
+                entries = chain(((code, payload) for code, payload in code_index.payloads(path) if code not in codes),
+                                code_index_entries(using, codes))
+            count = write_code_index(path, entries, token)
+        if codes is None:
+            logger.info('Rebuilt the code index with %d codes in %.3fs', count, time.perf_counter() - start)
+        else:
+            logger.info('Updated %d of the %d codes of the code index in %.3fs', len(codes), count,
+                        time.perf_counter() - start)
+        return count
+    finally:
+        with database.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s, 0)', [CODE_INDEX_LOCK])
+
+
+class CodeIndexRebuilder:
+    """
+        Rebuilds the code index in a background thread of the process, so a write does not wait for it. A rebuild
+        requested while one is running is coalesced into one more rebuild once it ends.
+
+        methods:
+            - schedule
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = False
+        self.thread = None
+
+    def schedule(self):
+        """
+        :return: thread : (Thread) the thread which runs the rebuild, None if the code index is disabled
+        """
+        if not settings.PRODUCT_CODE_INDEX_PATH:
+            return None
+        with self._lock:
+            self._pending = True
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='code-index-rebuild', daemon=True)
+                self.thread.start()
+            return self.thread
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        self.thread = None
+                        return
+                    self._pending = False
+                try:
+                    rebuild_code_index()
+                except Exception:
+                    logger.exception('The code index could not be rebuilt')
+        finally:
+            connection.close()
+
+
+code_index_rebuilder = CodeIndexRebuilder()
@@ -0,0 +1,151 @@
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+
+def serializer_path(serializer):
+    """
+    :param serializer :(Serializer): a bound serializer
+    :return: path : (tuple : str) the field names from the root serializer to the serializer
+    """
+    names = []
+    while getattr(serializer, 'parent', None) is not None:
+        if serializer.field_name:
+            names.append(serializer.field_name)
+        serializer = serializer.parent
+    return tuple(reversed(names))
+
+
+def _nested_fields(field):
+    """
+    :return: fields : (dict) the fields of a nested serializer field, None for a plain field
+    """
+    if isinstance(field, serializers.ListSerializer):
+        field = field.child
+    return field.fields if isinstance(field, serializers.BaseSerializer) else None
+
+
+class Fieldset:
+    """
+        This is the sparse fieldset of a read request, ?fields=id,amount,item.code selects the fields to render and
+        ?expand=item.related_products the nested objects to render in full.
+
+        A nested object which is selected without any of its fields and is not expanded is rendered as its primary key,
+        or the list of primary keys for a to-many relation. The queryset is pruned with the fieldset, only the selected
+        columns are loaded and a relation is joined or prefetched only if it is rendered.
+
+        methods:
+            - from_request
+            - prune_fields
+            - prune_queryset
+    """
+
+    def __init__(self, tree, expand):
+        self.tree = tree
+        self.expand = expand
+
+    @classmethod
+    def from_request(cls, request, serializer_class):
+        """
+        :param request :(Request):
+        :param serializer_class :(Serializer): the serializer the fields are validated against
+        :return: Fieldset or None if the request does not ask for a sparse fieldset
+        :raises ValidationError: if a field is not a field of the serializer
+        """
+        fields = request.query_params.get('fields')
+        if not fields:
+            return None
+        expand = {path.strip() for path in request.query_params.get('expand', '').split(',') if path.strip()}
+        tree = {}
+        # an expanded object is selected as well
+        for path in [path.strip() for path in fields.split(',')] + sorted(expand):
+            node, serializer_fields = tree, serializer_class().fields
+            for name in filter(None, path.split('.')):
+                if serializer_fields is None or name not in serializer_fields:
+                    raise ValidationError({'fields': [f'Unknown field {path}.']})
+                node = node.setdefault(name, {})
+                serializer_fields = _nested_fields(serializer_fields[name])
+        return cls(tree, expand)
+
+    def node(self, path):
+        """
+        :return: node : (dict) the selected fields below the path, empty if the object is selected as a whole
+        """
+        node = self.tree
+        for name in path:
+            node = node.get(name, {})
+        return node
+
+    def renders_object(self, path):
+        """
+        :return: (bool) whether the nested object at the path is rendered, or only its primary key
+        """
+        return bool(self.node(path)) or '.'.join(path) in self.expand
+
+    def prune_fields(self, path, fields):
+        """
+        Keep the selected fields of the serializer at the path and replace the nested serializers which are not
+        rendered with their primary key.
+        :param path :(tuple : str):
+        :param fields :(dict): the serializer fields
+        :return: fields : (dict)
+        """
+        node = self.node(path)
+        if node:
+            fields = {name: field for name, field in fields.items() if name in node}
+        for name, field in fields.items():
+            if isinstance(field, serializers.BaseSerializer) and not self.renders_object(path + (name,)):
+                fields[name] = serializers.PrimaryKeyRelatedField(
+                    read_only=True, many=isinstance(field, serializers.ListSerializer))
+        return fields
+
+    def _plan(self, model, path, prefix=''):
+        """
+        :return: (list, list, list) the only, select_related and prefetch_related arguments for the model at the path
+        """
+        node = self.node(path)
+        if node:
+            model_fields = [model._meta.get_field(name) for name in node]
+        else:
+            model_fields = list(model._meta.concrete_fields) + list(model._meta.many_to_many)
+
+        only, select, prefetch = [], [], []
+        for field in model_fields:
+            field_path = path + (field.name,)
+            if field.many_to_many or field.one_to_many:
+                queryset = field.related_model.objects.only('pk')
+                if self.renders_object(field_path):
+                    related_only, related_select, related_prefetch = self._plan(field.related_model, field_path)
+                    queryset = field.related_model.objects.only(*related_only).select_related(
+                        *related_select).prefetch_related(*related_prefetch)
+                prefetch.append(Prefetch(prefix + field.name, queryset=queryset))
+            elif field.is_relation and self.renders_object(field_path):
+                only.append(prefix + field.name)
+                select.append(prefix + field.name)
+                related_only, related_select, related_prefetch = self._plan(
+                    field.related_model, field_path, f'{prefix}{field.name}__')
+                only, select, prefetch = only + related_only, select + related_select, prefetch + related_prefetch
+            else:
+                only.append(prefix + field.name)
+        return only, select, prefetch
+
+    def prune_queryset(self, queryset):
+        """
+        :param queryset :(QuerySet):
+        :return: queryset : (QuerySet) which loads the selected columns and relations only
+        """
+        only, select, prefetch = self._plan(queryset.model, ())
+        return queryset.only(*only).select_related(*select).prefetch_related(*prefetch)
+
+
+class SparseFieldsetMixin:
+    """
+    Prunes the fields of the serializer to the sparse fieldset found in the serializer context, if any.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = self.context.get('fieldset')
+        if fieldset is None:
+            return fields
+        return fieldset.prune_fields(serializer_path(self), fields)
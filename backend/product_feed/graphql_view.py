@@ -0,0 +1,203 @@
+import hashlib
+import json
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import HttpResponseBadRequest, HttpResponseNotAllowed
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView, HttpError
+from graphql import ExecutionResult, GraphQLError, execute, parse, validate
+from graphql.language import FieldNode, FragmentDefinitionNode, FragmentSpreadNode, OperationDefinitionNode, \
+    OperationType
+from graphql.type import get_named_type, get_nullable_type, is_list_type
+from graphql.utilities import get_operation_ast
+
+from .cache import LRUCache
+from .models import PersistedQuery
+from .profiling import ProfiledViewMixin
+from .routers import replica_reads
+
+# a parsed query with its validation errors and its static depth and cost
+CompiledQuery = namedtuple('CompiledQuery', ('document', 'errors', 'depth', 'cost'))
+
+document_cache = LRUCache(settings.GRAPHQL_DOCUMENT_CACHE_SIZE)
+
+
+def _analyse(schema, selection_set, parent_type, fragments, depth):
+    """
+    Walk a selection set and compute its depth and its cost. Every field costs one, the fields below a list field count
+    GRAPHQL_LIST_COST_FACTOR times since the size of the list is not known before execution. The introspection fields
+    are not descended into.
+    :return: (int, int) the depth and the cost of the selection set
+    """
+    max_depth, cost = depth, 0
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            cost += 1
+            field = getattr(parent_type, 'fields', {}).get(selection.name.value)
+            if selection.name.value.startswith('__') or field is None or selection.selection_set is None:
+                max_depth = max(max_depth, depth + 1)
+                continue
+            field_depth, field_cost = _analyse(schema, selection.selection_set, get_named_type(field.type),
+                                               fragments, depth + 1)
+            if is_list_type(get_nullable_type(field.type)):
+                field_cost *= settings.GRAPHQL_LIST_COST_FACTOR
+            max_depth, cost = max(max_depth, field_depth), cost + field_cost
+        else:
+            if isinstance(selection, FragmentSpreadNode):
+                fragment = fragments[selection.name.value]
+            else:
+                fragment = selection
+            fragment_type = parent_type
+            if fragment.type_condition is not None:
+                fragment_type = schema.get_type(fragment.type_condition.name.value)
+            fragment_depth, fragment_cost = _analyse(schema, fragment.selection_set, fragment_type, fragments, depth)
+            max_depth, cost = max(max_depth, fragment_depth), cost + fragment_cost
+    return max_depth, cost
+
+
+def compile_query(schema, query):
+    """
+    Parse, validate and statically analyse a query string. The query is rejected if the depth or the cost of one of its
+    operations exceeds GRAPHQL_MAX_DEPTH or GRAPHQL_MAX_COST.
+    :param schema :(GraphQLSchema):
+    :param query :(str):
+    :return: CompiledQuery
+    """
+    try:
+        document = parse(query)
+    except GraphQLError as error:
+        return CompiledQuery(None, [error], 0, 0)
+
+    errors = validate(schema, document)
+    if errors:
+        return CompiledQuery(document, errors, 0, 0)
+
+    fragments = {definition.name.value: definition for definition in document.definitions
+                 if isinstance(definition, FragmentDefinitionNode)}
+    depth, cost = 0, 0
+    for definition in document.definitions:
+        if isinstance(definition, OperationDefinitionNode):
+            root_type = schema.get_root_type(definition.operation)
+            operation_depth, operation_cost = _analyse(schema, definition.selection_set, root_type, fragments, 0)
+            depth, cost = max(depth, operation_depth), max(cost, operation_cost)
+
+    if depth > settings.GRAPHQL_MAX_DEPTH:
+        errors = [GraphQLError(f'Query depth {depth} exceeds the maximum depth {settings.GRAPHQL_MAX_DEPTH}.')]
+    elif cost > settings.GRAPHQL_MAX_COST:
+        errors = [GraphQLError(f'Query cost {cost} exceeds the maximum cost {settings.GRAPHQL_MAX_COST}.')]
+    return CompiledQuery(document, errors, depth, cost)
+
+
+class CachedGraphQLView(ProfiledViewMixin, GraphQLView):
+    """
+        This is the GraphQL view of the product feed. It extends the graphene view with:
+
+            - persisted queries: the client sends extensions.persistedQuery.sha256Hash with the query once to register
+              it, and afterwards only the hash. A query is only registered if it is valid and within the depth and cost
+              limits. An unknown hash answers PersistedQueryNotFound.
+            - a bounded LRU cache of the parsed and validated documents keyed by the sha256 hash of the query, so a
+              known query is neither parsed nor validated again.
+            - a static depth and cost analysis which rejects expensive queries before they are executed.
+            - query operations read from the read replicas unless the client is pinned to the primary database.
+            - on demand profiling, see ProfiledViewMixin.
+
+        methods:
+            - get_extensions
+            - get_compiled_query
+            - execute_graphql_request
+    """
+
+    @staticmethod
+    def get_extensions(request, data):
+        extensions = request.GET.get('extensions') or data.get('extensions') or {}
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest('Extensions are invalid JSON.'))
+        return extensions if isinstance(extensions, dict) else {}
+
+    def get_compiled_query(self, request, data, query):
+        """
+        Resolve the compiled query from the document cache, the persisted queries or the query string.
+        :return: CompiledQuery or an ExecutionResult with the error, None if there is no query at all
+        """
+        persisted = self.get_extensions(request, data).get('persistedQuery') or {}
+        sha256 = persisted.get('sha256Hash') if isinstance(persisted, dict) else None
+
+        if query:
+            digest = hashlib.sha256(query.encode()).hexdigest()
+            if sha256:
+                if sha256 != digest:
+                    return ExecutionResult(errors=[GraphQLError('Provided sha256Hash does not match the query.')])
+        elif sha256:
+            digest = sha256
+        else:
+            return None
+
+        compiled = document_cache.get(digest)
+        if compiled is None:
+            if not query:
+                persisted_query = PersistedQuery.objects.filter(sha256=digest).first()
+                if persisted_query is None:
+                    return ExecutionResult(errors=[GraphQLError('PersistedQueryNotFound')])
+                query = persisted_query.query
+            compiled = compile_query(self.schema.graphql_schema, query)
+            document_cache.set(digest, compiled)
+
+        # only a query which compiles within the depth and the cost limits is registered
+        if query and sha256 and not compiled.errors:
+            PersistedQuery.objects.get_or_create(sha256=digest, defaults={'query': query})
+        return compiled
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        compiled = self.get_compiled_query(request, data, query)
+        if compiled is None:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+        if isinstance(compiled, ExecutionResult):
+            return compiled
+        if compiled.errors:
+            return ExecutionResult(data=None, errors=compiled.errors)
+
+        operation_ast = get_operation_ast(compiled.document, operation_name)
+        if request.method.lower() == "get" and operation_ast and operation_ast.operation != OperationType.QUERY:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseNotAllowed(
+                ["POST"], "Can only perform a {} operation from a POST request.".format(operation_ast.operation.value)
+            ))
+
+        # execute the cached document directly, schema.execute would parse and validate the query string again
+        options = {
+            "root_value": self.get_root_value(request),
+            "context_value": self.get_context(request),
+            "variable_values": variables,
+            "operation_name": operation_name,
+            "middleware": self.get_middleware(request),
+            "execution_context_class": self.execution_context_class,
+        }
+        try:
+            if (
+                operation_ast
+                and operation_ast.operation == OperationType.MUTATION
+                and (
+                    graphene_settings.ATOMIC_MUTATIONS is True
+                    or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+                )
+            ):
+                with transaction.atomic():
+                    result = execute(self.schema.graphql_schema, compiled.document, **options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+                return result
+
+            read_only = operation_ast is not None and operation_ast.operation == OperationType.QUERY
+            with replica_reads(read_only and not getattr(request, 'primary_pinned', False)):
+                return execute(self.schema.graphql_schema, compiled.document, **options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
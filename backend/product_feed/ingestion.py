@@ -0,0 +1,72 @@
+import json
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from rest_framework.exceptions import ValidationError
+
+from .coordination import item_sort_key, lock_item_ranges, supplier_lock
+from .models import Feed, RejectedRow
+from .serializers import ProductSerializer, record_changes, save_feed_product
+from .validation import validate_feed_fields, validate_row
+
+
+def storable(row):
+    """
+    Postgres jsonb cannot hold the null character, a row which was rejected for it must still be recorded.
+    :param row :(Object): the submitted row
+    :return: row : (Object) the row without null characters
+    """
+    return json.loads(json.dumps(row).replace('\\u0000', ''))
+
+
+def ingest_feed_partially(data):
+    """
+    Ingest a feed row by row and keep its valid products even if other rows fail. The rows are committed in chunks of
+    FEED_INGEST_CHUNK_SIZE, every row is written under its own savepoint so a database error only rolls back that row.
+    The rows which fail the validation or the write are recorded as RejectedRow against the feed with their errors.
+
+    The supplier's lock is held for the whole feed, every chunk takes the locks of its Item key ranges and writes its
+    valid rows in the order of their item keys, see coordination.
+    :param data :(Object): the feed data
+    :return: report : (Object) the feed id, the number of rows and the number of created and rejected rows
+    :raises ValidationError: if the feed fields are invalid, nothing is written then
+    """
+    feed_data, feed_errors = validate_feed_fields(data)
+    if feed_errors:
+        raise ValidationError(feed_errors)
+
+    amounts = data['amounts']
+    # one serializer validates every row, its fields are built once
+    serializer = ProductSerializer()
+    size = settings.FEED_INGEST_CHUNK_SIZE
+    rejected = 0
+    with supplier_lock(feed_data.get('supplier_id')):
+        feed = Feed.objects.create(**feed_data)
+        for offset in range(0, len(amounts), size):
+            valid, rejects = [], []
+            for index, row in enumerate(amounts[offset:offset + size], offset):
+                validated_data, errors = validate_row(serializer, row)
+                if errors is None:
+                    valid.append((index, row, validated_data))
+                else:
+                    rejects.append(RejectedRow(feed=feed, index=index, data=storable(row), errors=errors))
+            valid.sort(key=lambda entry: item_sort_key(entry[2]['item']))
+
+            changes = []
+            with transaction.atomic():
+                lock_item_ranges([validated_data['item'].get('code') for _, _, validated_data in valid])
+                for index, row, validated_data in valid:
+                    try:
+                        with transaction.atomic():
+                            changes.extend(save_feed_product(feed, validated_data))
+                    except DatabaseError as exc:
+                        errors = {'non_field_errors': [f'Product could not be saved: {exc}'.strip()]}
+                        rejects.append(RejectedRow(feed=feed, index=index, data=storable(row), errors=errors))
+
+                # record the written objects in the change feed, refresh their documents and record the rejects of
+                # the chunk
+                record_changes(changes)
+                RejectedRow.objects.bulk_create(sorted(rejects, key=lambda reject: reject.index))
+            rejected += len(rejects)
+
+    return {'feed': feed.pk, 'rows': len(amounts), 'created': len(amounts) - rejected, 'rejected': rejected}
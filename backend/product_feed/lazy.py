@@ -0,0 +1,20 @@
+from django.utils.module_loading import import_string
+
+
+def lazy_view(view_path, **initkwargs):
+    """
+    Wrap a class based view so that its module is only imported when the view serves its first request. This keeps
+    heavy optional stacks out of the worker's boot.
+    :param view_path :(str): the dotted path of the view class
+    :param initkwargs :(Object): the keyword arguments of the view's as_view
+    :return: view : (function)
+    """
+    view = None
+
+    def lazy(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            view = import_string(view_path).as_view(**initkwargs)
+        return view(request, *args, **kwargs)
+
+    return lazy
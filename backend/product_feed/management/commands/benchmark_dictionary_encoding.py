@@ -0,0 +1,87 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+# the encoded Item attributes with synthetic values of a realistic cardinality, the brand is stored as varchar in both
+# layouts
+ATTRIBUTES = {
+    'trade_item_unit_descriptor': ['CASE', 'EACH', 'PACK_OR_INNER_PACK', 'PALLET', 'DISPLAY_SHIPPER'],
+    'trade_item_unit_descriptor_name': ['Karton', 'Stück', 'Packung', 'Palette', 'Display'],
+    'unit_name': ['g', 'kg', 'ml', 'l', 'Stk'],
+    'packaging': ['CT', 'PUG', 'BT', 'BX', 'TR', 'BG'],
+    'status': ['active', 'inactive', 'draft'],
+    'validation_status': ['validated', 'pending', 'rejected'],
+    'type': ['gtin', 'ean', 'plu'],
+}
+BRANDS = 2000
+
+# the scans compared on both layouts, the placeholders are the values or the codes of the same attributes
+SCANS = {
+    'filter': 'SELECT count(*) FROM {table} WHERE trade_item_unit_descriptor = {descriptor} AND type = {type}',
+    'group': 'SELECT trade_item_unit_descriptor, unit_name, count(*) FROM {table} GROUP BY 1, 2',
+}
+
+
+class Command(BaseCommand):
+    help = ('Compare the storage and the scan speed of the varchar and the dictionary encoded layouts of the Item '
+            'attributes on a synthetic catalog, in temporary tables of the default database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='rows of the synthetic catalog')
+        parser.add_argument('--repeat', type=int, default=5, help='runs per scan, the median is reported')
+        parser.add_argument('--json', action='store_true', help='write machine readable output')
+
+    def create_tables(self, cursor, rows):
+        varchar_columns, encoded_columns = [], []
+        for attribute, values in ATTRIBUTES.items():
+            array = 'ARRAY[%s]' % ', '.join("'%s'" % value for value in values)
+            varchar_columns.append(f'({array})[1 + mod(i, {len(values)})]::varchar(255) AS {attribute}')
+            encoded_columns.append(f'(1 + mod(i, {len(values)}))::smallint AS {attribute}')
+        for columns in (varchar_columns, encoded_columns):
+            columns.append(f"('Brand ' || mod(i, {BRANDS}))::varchar(30) AS brand")
+
+        for table, columns in (('bench_varchar', varchar_columns), ('bench_encoded', encoded_columns)):
+            cursor.execute(f'CREATE TEMPORARY TABLE {table} ON COMMIT DROP AS '
+                           f'SELECT i AS id, (4000000000000 + i)::varchar(20) AS code, {", ".join(columns)} '
+                           f'FROM generate_series(1, %s) AS i', [rows])
+            cursor.execute(f'CREATE INDEX ON {table} (trade_item_unit_descriptor, type)')
+            cursor.execute(f'ANALYZE {table}')
+
+    def measure(self, cursor, table, repeat):
+        cursor.execute('SELECT pg_relation_size(%s), pg_indexes_size(%s)', [table, table])
+        heap, indexes = cursor.fetchone()
+        if table == 'bench_varchar':
+            params = {'descriptor': "'CASE'", 'type': "'gtin'"}
+        else:
+            params = {'descriptor': '1', 'type': '1'}
+
+        scans = {}
+        for name, sql in SCANS.items():
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                cursor.execute(sql.format(table=table, **params))
+                cursor.fetchall()
+                timings.append(time.perf_counter() - start)
+            scans[name] = statistics.median(timings) * 1000
+        return {'heap_bytes': heap, 'index_bytes': indexes, 'scan_ms': scans}
+
+    def handle(self, *args, **options):
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.create_tables(cursor, options['rows'])
+            results = {layout: self.measure(cursor, f'bench_{layout}', options['repeat'])
+                       for layout in ('varchar', 'encoded')}
+
+        if options['json']:
+            self.stdout.write(json.dumps({'rows': options['rows'], 'layouts': results}, indent=2))
+            return
+        self.stdout.write(f"{options['rows']} rows")
+        self.stdout.write(f"{'layout':<10}{'heap (MiB)':>12}{'index (MiB)':>13}"
+                          + ''.join(f'{name + " (ms)":>14}' for name in SCANS))
+        for layout, result in results.items():
+            self.stdout.write(f"{layout:<10}{result['heap_bytes'] / 1024 ** 2:>12.1f}"
+                              f"{result['index_bytes'] / 1024 ** 2:>13.1f}"
+                              + ''.join(f"{result['scan_ms'][name]:>14.1f}" for name in SCANS))
@@ -0,0 +1,64 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# boots a worker in a fresh interpreter and reports its boot time, its resident memory and the heavy stacks it imported
+BOOT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+elapsed = time.perf_counter() - start
+with open('/proc/self/status') as status:
+    rss = next(int(line.split()[1]) for line in status if line.startswith('VmRSS:'))
+print(json.dumps({
+    'seconds': elapsed,
+    'rss_kb': rss,
+    'modules': len(sys.modules),
+    'heavy_stacks': [name for name in %r if name in sys.modules],
+}))
+"""
+
+HEAVY_STACKS = ('graphene', 'graphene_django', 'graphql', 'rest_framework_swagger', 'openapi_codec', 'pyarrow')
+
+
+class Command(BaseCommand):
+    help = 'Boot a worker for every deployment role in a fresh interpreter and report its import time and RSS.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--roles', nargs='+', default=list(settings.DEPLOYMENT_ROLES),
+                            choices=list(settings.DEPLOYMENT_ROLES))
+        parser.add_argument('--repeat', type=int, default=3, help='boots per role, the median is reported')
+        parser.add_argument('--json', action='store_true', help='write machine readable output')
+
+    def boot(self, role):
+        env = dict(os.environ, DEPLOYMENT_ROLE=role, DJANGO_SETTINGS_MODULE=os.environ['DJANGO_SETTINGS_MODULE'])
+        output = subprocess.run([sys.executable, '-c', BOOT_SCRIPT % (HEAVY_STACKS,)], env=env, cwd=settings.BASE_DIR,
+                                capture_output=True, text=True, check=True).stdout
+        return json.loads(output.splitlines()[-1])
+
+    def handle(self, *args, **options):
+        results = {}
+        for role in options['roles']:
+            boots = [self.boot(role) for _ in range(options['repeat'])]
+            results[role] = {
+                'seconds': statistics.median(boot['seconds'] for boot in boots),
+                'rss_kb': statistics.median(boot['rss_kb'] for boot in boots),
+                'modules': boots[-1]['modules'],
+                'heavy_stacks': boots[-1]['heavy_stacks'],
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'role':<10}{'boot (s)':>10}{'RSS (MiB)':>12}{'modules':>10}  heavy stacks")
+        for role, result in results.items():
+            self.stdout.write(f"{role:<10}{result['seconds']:>10.3f}{result['rss_kb'] / 1024:>12.1f}"
+                              f"{result['modules']:>10}  {', '.join(result['heavy_stacks']) or '-'}")
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from product_feed.openapi import generate_schema
+
+
+class Command(BaseCommand):
+    help = 'Generate the OpenAPI schema of the API docs once and write it to API_SCHEMA_PATH.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--title', default=settings.API_SCHEMA_TITLE)
+
+    def handle(self, *args, **options):
+        schema = generate_schema(options['title'])
+        with open(settings.API_SCHEMA_PATH, 'wb') as artifact:
+            artifact.write(schema)
+        self.stdout.write(self.style.SUCCESS(f'Wrote the API schema to {settings.API_SCHEMA_PATH}'))
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from product_feed.documents import rebuild_code_index
+
+
+class Command(BaseCommand):
+    help = ('Build the memory mapped code index the detail endpoint serves the products of an item\'s code from, e.g. '
+            'when a host starts or periodically on a host which takes no writes. The writes rebuild the index of the '
+            'host they are made on.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='rebuild the whole index even if it is fresh')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='the database to read from')
+
+    def handle(self, *args, **options):
+        if not settings.PRODUCT_CODE_INDEX_PATH:
+            raise CommandError('PRODUCT_CODE_INDEX_PATH is not set')
+        codes = rebuild_code_index(options['database'], force=options['force'])
+        if codes is None:
+            self.stdout.write(f'The code index {settings.PRODUCT_CODE_INDEX_PATH} is fresh')
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Built the code index {settings.PRODUCT_CODE_INDEX_PATH} with {codes} codes'))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from product_feed.documents import document_batches, rebuild_code_index, stale_documents
+from product_feed.serializers import store_documents
+
+
+class Command(BaseCommand):
+    help = ('Check that the stored documents of all the items and products match their current representation, and '
+            'optionally repair the documents which are missing or stale. A repair rebuilds the code index of the host, '
+            'the other hosts rebuild theirs with build_code_index --force.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='objects compared per batch')
+        parser.add_argument('--repair', action='store_true', help='store the missing and stale documents')
+
+    def handle(self, *args, **options):
+        checked = stale = missing = 0
+        for product_documents, item_documents in document_batches(options['batch_size']):
+            stale_products, stale_items, batch_missing = stale_documents(product_documents, item_documents)
+            checked += len(product_documents) + len(item_documents)
+            stale += len(stale_products) + len(stale_items) - batch_missing
+            missing += batch_missing
+            if options['verbosity'] > 1:
+                for pk in stale_items:
+                    self.stdout.write(f'item {pk}')
+                for pk in stale_products:
+                    self.stdout.write(f'product {pk}')
+            if options['repair'] and (stale_products or stale_items):
+                with transaction.atomic():
+                    store_documents(stale_products, stale_items)
+
+        summary = f'Checked {checked} documents, {missing} missing and {stale} stale'
+        if not missing and not stale:
+            self.stdout.write(self.style.SUCCESS(summary))
+        elif options['repair']:
+            # the documents are stored without a change, the code index does not see them as a write
+            rebuild_code_index(force=True)
+            self.stdout.write(self.style.SUCCESS(f'{summary}, repaired'))
+        else:
+            raise CommandError(summary)
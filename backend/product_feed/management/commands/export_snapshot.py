@@ -0,0 +1,42 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from product_feed.snapshots import FORMATS, latest_change_token, read_snapshot_metadata, snapshot_chunks
+
+
+class Command(BaseCommand):
+    help = ('Write a columnar snapshot of the catalog, the products joined to their items and feeds, as Parquet or as '
+            'an Arrow IPC stream. An incremental snapshot only holds the products written since a previous snapshot.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='the snapshot file, written atomically')
+        parser.add_argument('--format', choices=FORMATS, help='defaults to the extension of the output, else parquet')
+        since = parser.add_mutually_exclusive_group()
+        since.add_argument('--since', type=int, help='the change token of the previous snapshot')
+        since.add_argument('--since-snapshot', help='the previous snapshot file, its change token is used as --since')
+        parser.add_argument('--batch-size', type=int, default=settings.SNAPSHOT_BATCH_SIZE,
+                            help='rows per record batch')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='the database to read from')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        file_format = options['format'] or ('arrow' if output.endswith(('.arrow', '.arrows')) else 'parquet')
+        since = options['since']
+        if options['since_snapshot']:
+            try:
+                since = int(read_snapshot_metadata(options['since_snapshot'])['change_token'])
+            except (OSError, KeyError, ValueError) as exc:
+                raise CommandError(f'Cannot read the change token of {options["since_snapshot"]}: {exc}')
+
+        change_token = latest_change_token(options['database'])
+        partial = f'{output}.partial'
+        with open(partial, 'wb') as snapshot:
+            for chunk in snapshot_chunks(file_format, options['database'], change_token, since, options['batch_size']):
+                snapshot.write(chunk)
+        os.replace(partial, output)
+        kind = 'full' if since is None else f'incremental since {since}'
+        self.stdout.write(self.style.SUCCESS(f'Wrote the {kind} {file_format} snapshot {output} up to change token '
+                                             f'{change_token}'))
@@ -0,0 +1,249 @@
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+ENDPOINTS = ('list', 'detail', 'upload', 'graphql')
+DEFAULT_MIX = 'list=50,detail=30,upload=10,graphql=10'
+GRAPHQL_QUERY = 'query LoadTest($id: Int) { product(id: $id) { id amount bbd } }'
+
+
+def parse_mix(mix):
+    """
+    Parse the workload mix, e.g. list=50,detail=30,upload=10,graphql=10, the weights are relative.
+    :param mix :(str):
+    :return: weights : (dict) endpoint to weight
+    """
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise CommandError(f'Unknown endpoint {name!r} in the mix, expected one of {", ".join(ENDPOINTS)}.')
+        try:
+            weights[name] = float(weight)
+        except ValueError:
+            raise CommandError(f'Invalid weight {weight!r} for {name} in the mix.')
+    if not any(weight > 0 for weight in weights.values()):
+        raise CommandError('The mix has no endpoint with a positive weight.')
+    return weights
+
+
+def generate_feed(rng, size):
+    """
+    Generate a feed in the format of products.json with new random item codes.
+    :param rng :(Random):
+    :param size :(int): the number of products in the feed
+    :return: feed : (Object)
+    """
+    session_id = rng.randrange(10 ** 12, 10 ** 13)
+    return {
+        'supplier_id': str(rng.randrange(1000, 1100)),
+        'user_id': 'loadtest@example.com',
+        'session_id': session_id,
+        'session_start_time': '2022-04-29T11:40:14.860Z',
+        'session_end_time': '2022-04-29T11:56:37.132Z',
+        'amounts': [{
+            'amount': rng.randrange(1, 100),
+            'bbd': '2022-07-31T00:00:00Z',
+            'comment': '',
+            'item': {
+                'code': str(rng.randrange(10 ** 12, 10 ** 13)),
+                'type': 'gtin',
+                'brand': 'Load Test',
+                'description': f'Load test product {index} of session {session_id}',
+                'amount_multiplier': rng.randrange(1, 25),
+                'net_weight': rng.randrange(100, 20000),
+                'packaging': 'CT',
+                'trade_item_unit_descriptor': 'CASE',
+                'unit_name': 'g',
+                'related_products': [],
+            },
+        } for index in range(size)],
+    }
+
+
+def percentile(values, pct):
+    """
+    Nearest rank percentile.
+    :param values :(list): sorted values
+    :param pct :(float): between 0 and 100
+    :return: (float) the percentile, None for no values
+    """
+    if not values:
+        return None
+    rank = max(int(-(-pct * len(values) // 100)), 1)
+    return values[rank - 1]
+
+
+def summarize(samples, elapsed):
+    """
+    Summarize the samples of every endpoint.
+    :param samples :(dict): endpoint to a list of (latency in seconds, status code or None for a transport error)
+    :param elapsed :(float): the wall clock seconds of the run
+    :return: report : (dict) endpoint to its throughput, latency percentiles in milliseconds and error rate
+    """
+    report = {}
+    for name in sorted(samples):
+        latencies = sorted(latency * 1000 for latency, _ in samples[name])
+        statuses = Counter(str(status_code) if status_code else 'error' for _, status_code in samples[name])
+        errors = sum(1 for _, status_code in samples[name] if not status_code or status_code >= 400)
+        report[name] = {
+            'requests': len(latencies),
+            'errors': errors,
+            'error_rate': errors / len(latencies),
+            'throughput': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': latencies[-1],
+            'statuses': dict(statuses),
+        }
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """
+    Compare a report with a baseline report.
+    :param report :(dict): the endpoints of the current run
+    :param baseline :(dict): the endpoints of the baseline run
+    :param tolerance :(float): the accepted relative regression, 0.2 accepts 20% slower and 20% less throughput
+    :return: regressions : (list : str)
+    """
+    regressions = []
+    for name, base in baseline.items():
+        current = report.get(name)
+        if current is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if base[metric] and current[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f'{name} {metric}: {current[metric]:.1f} > {base[metric]:.1f} (baseline)')
+        if current['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f"{name} throughput: {current['throughput']:.1f} < {base['throughput']:.1f} (baseline)")
+        if current['error_rate'] > base['error_rate'] + tolerance / 10:
+            regressions.append(f"{name} error_rate: {current['error_rate']:.3f} > {base['error_rate']:.3f} (baseline)")
+    return regressions
+
+
+class Command(BaseCommand):
+    help = ('Replay a mix of product list, product detail, feed upload and GraphQL requests against a running server at '
+            'a target request rate and report the throughput, latency percentiles and error rate of every endpoint.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help='base URL of the server')
+        parser.add_argument('--rate', type=float, default=20, help='target requests per second over all endpoints')
+        parser.add_argument('--duration', type=float, default=30, help='seconds of load')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f'relative endpoint weights, default {DEFAULT_MIX}')
+        parser.add_argument('--concurrency', type=int, default=16, help='maximum requests in flight')
+        parser.add_argument('--feed-size', type=int, default=25, help='products per generated feed upload')
+        parser.add_argument('--seed-products', type=int, default=50,
+                            help='products uploaded before the run for the detail and GraphQL requests')
+        parser.add_argument('--timeout', type=float, default=30, help='seconds per request')
+        parser.add_argument('--random-seed', type=int, default=0)
+        parser.add_argument('--output', help='write the JSON report to this file')
+        parser.add_argument('--baseline', help='JSON report of a previous run, fail on a regression beyond tolerance')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='accepted relative regression')
+        parser.add_argument('--json', action='store_true', help='write the JSON report to stdout')
+
+    def setup_targets(self, session, options, rng):
+        """
+        Upload a seed feed and collect the codes, the product ids and the number of list pages the requests ask for.
+        """
+        base = options['url'].rstrip('/')
+        response = session.post(f'{base}/api/feed/upload', json=generate_feed(rng, options['seed_products']),
+                                timeout=options['timeout'])
+        if response.status_code != 201:
+            raise CommandError(f'The seed feed upload failed with {response.status_code}: {response.text[:200]}')
+        page = session.get(f'{base}/api/product/', timeout=options['timeout']).json()
+        codes = [amount['item']['code'] for amount in response.json()['amounts']]
+        ids = [product['id'] for product in page['results']]
+        pages = max(-(-page['count'] // max(len(page['results']), 1)), 1)
+        return codes, ids, pages
+
+    def handle(self, *args, **options):
+        weights = parse_mix(options['mix'])
+        rng = random.Random(options['random_seed'])
+        base = options['url'].rstrip('/')
+        local = threading.local()
+
+        def get_session():
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+                # every request is an anonymous client, an upload must not pin the later reads to the primary database
+                local.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            return local.session
+
+        codes, ids, pages = self.setup_targets(get_session(), options, rng)
+
+        # the requests are prepared ahead so generating them does not count as latency
+        count = int(options['rate'] * options['duration'])
+        names = rng.choices(list(weights), weights=list(weights.values()), k=count)
+        plan = []
+        for name in names:
+            if name == 'list':
+                plan.append((name, 'GET', f'{base}/api/product/', {'params': {'page': rng.randint(1, min(pages, 3))}}))
+            elif name == 'detail':
+                plan.append((name, 'GET', f'{base}/api/product/{rng.choice(codes)}', {}))
+            elif name == 'upload':
+                plan.append((name, 'POST', f'{base}/api/feed/upload',
+                             {'json': generate_feed(rng, options['feed_size'])}))
+            else:
+                plan.append((name, 'POST', f'{base}/api/graphql/',
+                             {'json': {'query': GRAPHQL_QUERY, 'variables': {'id': rng.choice(ids or [0])}}}))
+
+        samples = defaultdict(list)
+        lock = threading.Lock()
+
+        def send(name, method, url, kwargs, scheduled):
+            try:
+                response = get_session().request(method, url, timeout=options['timeout'], **kwargs)
+                status_code = response.status_code
+                if name == 'graphql' and status_code == 200 and response.json().get('errors'):
+                    status_code = 422
+            except (requests.RequestException, ValueError):
+                status_code = None
+            # the latency is measured from the scheduled start, a request queued behind slow ones counts as slow
+            latency = time.perf_counter() - scheduled
+            with lock:
+                samples[name].append((latency, status_code))
+
+        interval = 1 / options['rate']
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            for index, (name, method, url, kwargs) in enumerate(plan):
+                scheduled = start + index * interval
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(send, name, method, url, kwargs, scheduled)
+        elapsed = time.perf_counter() - start
+
+        report = {
+            'config': {key: options[key] for key in ('url', 'rate', 'duration', 'mix', 'concurrency', 'feed_size')},
+            'elapsed_s': elapsed,
+            'endpoints': summarize(samples, elapsed),
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(f"{'endpoint':<10}{'requests':>10}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+                              f"{'errors':>9}")
+            for name, result in report['endpoints'].items():
+                self.stdout.write(f"{name:<10}{result['requests']:>10}{result['throughput']:>9.1f}"
+                                  f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+                                  f"{result['error_rate']:>9.1%}")
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = compare(report['endpoints'], json.load(baseline)['endpoints'], options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from product_feed.documents import document_batches, rebuild_code_index
+from product_feed.serializers import store_documents
+
+
+class Command(BaseCommand):
+    help = ('Render and store the documents of all the items and products, e.g. after a deployment which changed their '
+            'representation. Every batch is committed on its own, the listings stay available meanwhile. The code '
+            'index of the host is rebuilt afterwards, the other hosts rebuild theirs with build_code_index --force.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='objects rendered and stored per transaction')
+
+    def handle(self, *args, **options):
+        products = items = 0
+        for product_documents, item_documents in document_batches(options['batch_size']):
+            with transaction.atomic():
+                store_documents(product_documents, item_documents)
+            products, items = products + len(product_documents), items + len(item_documents)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the documents of {items} items and {products} products'))
+        # the documents are stored without a change, the code index does not see them as a write
+        if rebuild_code_index(force=True) is not None:
+            self.stdout.write(self.style.SUCCESS('Rebuilt the code index'))
@@ -0,0 +1,26 @@
+from django.conf import settings
+
+from .routers import track_writes
+
+
+class PrimaryPinMiddleware:
+    """
+        Read-your-writes stickiness for the read replicas. A successful request which wrote to the database sets a signed
+        cookie which pins the client to the primary database for PRIMARY_PIN_SECONDS. The views read
+        request.primary_pinned to decide whether their reads may go to a replica.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.primary_pinned = request.get_signed_cookie(
+            settings.PRIMARY_PIN_COOKIE, default=None, max_age=settings.PRIMARY_PIN_SECONDS) is not None
+
+        with track_writes() as written:
+            response = self.get_response(request)
+
+        if written and response.status_code < 400:
+            response.set_signed_cookie(settings.PRIMARY_PIN_COOKIE, '1', max_age=settings.PRIMARY_PIN_SECONDS,
+                                       httponly=True, samesite='Lax')
+        return response
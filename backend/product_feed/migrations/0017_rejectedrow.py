@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-19 11:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_feed', '0016_persistedquery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RejectedRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField()),
+                ('data', models.JSONField()),
+                ('errors', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('feed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rejected_rows', to='product_feed.feed')),
+            ],
+            options={
+                'ordering': ('feed', 'index'),
+            },
+        ),
+    ]
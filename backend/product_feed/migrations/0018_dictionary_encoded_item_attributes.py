@@ -0,0 +1,111 @@
+# Generated by Django 4.2 on 2026-10-19 11:57
+
+from django.db import migrations, models
+import product_feed.dictionary
+
+# the encoded attributes with their code column type and their varchar length
+ATTRIBUTES = (
+    ('brand', 'integer', 30),
+    ('packaging', 'smallint', 50),
+    ('status', 'smallint', 20),
+    ('trade_item_unit_descriptor', 'smallint', 255),
+    ('trade_item_unit_descriptor_name', 'smallint', 255),
+    ('type', 'smallint', 30),
+    ('unit_name', 'smallint', 10),
+    ('validation_status', 'smallint', 20),
+)
+
+
+def encode_sql(attribute, column_type):
+    return f"""
+        INSERT INTO product_feed_attributevalue (attribute, code, value)
+        SELECT '{attribute}', row_number() OVER (ORDER BY value), value
+        FROM (SELECT DISTINCT "{attribute}" AS value FROM product_feed_item WHERE "{attribute}" IS NOT NULL) AS item_values;
+        ALTER TABLE product_feed_item ADD COLUMN "{attribute}_code" {column_type} NULL;
+        UPDATE product_feed_item SET "{attribute}_code" = attribute_value.code FROM product_feed_attributevalue AS attribute_value
+        WHERE attribute_value.attribute = '{attribute}' AND attribute_value.value = product_feed_item."{attribute}";
+        ALTER TABLE product_feed_item DROP COLUMN "{attribute}";
+        ALTER TABLE product_feed_item RENAME COLUMN "{attribute}_code" TO "{attribute}";
+    """
+
+
+def decode_sql(attribute, max_length):
+    return f"""
+        ALTER TABLE product_feed_item ADD COLUMN "{attribute}_value" varchar({max_length}) NULL;
+        UPDATE product_feed_item SET "{attribute}_value" = attribute_value.value FROM product_feed_attributevalue AS attribute_value
+        WHERE attribute_value.attribute = '{attribute}' AND attribute_value.code = product_feed_item."{attribute}";
+        ALTER TABLE product_feed_item DROP COLUMN "{attribute}";
+        ALTER TABLE product_feed_item RENAME COLUMN "{attribute}_value" TO "{attribute}";
+        DELETE FROM product_feed_attributevalue WHERE attribute = '{attribute}';
+    """
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_feed', '0017_rejectedrow'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttributeValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attribute', models.CharField(max_length=50)),
+                ('code', models.IntegerField()),
+                ('value', models.CharField(max_length=255)),
+            ],
+            options={
+                'unique_together': {('attribute', 'code'), ('attribute', 'value')},
+            },
+        ),
+        # the values are moved to the dictionary and the columns are rewritten with their codes
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(encode_sql(attribute, column_type), decode_sql(attribute, max_length))
+                for attribute, column_type, max_length in ATTRIBUTES
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='item',
+                    name='brand',
+                    field=product_feed.dictionary.DictionaryEncodedField(blank=True, max_length=30, null=True, small=False),
+                ),
+                migrations.AlterField(
+                    model_name='item',
+                    name='packaging',
+                    field=product_feed.dictionary.DictionaryEncodedField(blank=True, max_length=50, null=True),
+                ),
+                migrations.AlterField(
+                    model_name='item',
+                    name='status',
+                    field=product_feed.dictionary.DictionaryEncodedField(blank=True, max_length=20, null=True),
+                ),
+                migrations.AlterField(
+                    model_name='item',
+                    name='trade_item_unit_descriptor',
+                    field=product_feed.dictionary.DictionaryEncodedField(blank=True, max_length=255, null=True),
+                ),
+                migrations.AlterField(
+                    model_name='item',
+                    name='trade_item_unit_descriptor_name',
+                    field=product_feed.dictionary.DictionaryEncodedField(blank=True, max_length=255, null=True),
+                ),
+                migrations.AlterField(
+                    model_name='item',
+                    name='type',
+                    field=product_feed.dictionary.DictionaryEncodedField(blank=True, max_length=30, null=True),
+                ),
+                migrations.AlterField(
+                    model_name='item',
+                    name='unit_name',
+                    field=product_feed.dictionary.DictionaryEncodedField(blank=True, max_length=10, null=True),
+                ),
+                migrations.AlterField(
+                    model_name='item',
+                    name='validation_status',
+                    field=product_feed.dictionary.DictionaryEncodedField(blank=True, max_length=20, null=True),
+                ),
+            ],
+        ),
+    ]
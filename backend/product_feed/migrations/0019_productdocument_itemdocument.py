@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-19 12:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_feed', '0018_dictionary_encoded_item_attributes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemDocument',
+            fields=[
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='document', serialize=False, to='product_feed.item')),
+                ('document', models.TextField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='document', serialize=False, to='product_feed.product')),
+                ('document', models.TextField()),
+            ],
+        ),
+    ]
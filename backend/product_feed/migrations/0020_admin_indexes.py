@@ -0,0 +1,31 @@
+# Generated by Django 4.2 on 2026-10-19 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_feed', '0019_productdocument_itemdocument'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='feed',
+            name='supplier_id',
+            field=models.CharField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='relatedproduct',
+            name='gtin',
+            field=models.CharField(db_index=True, max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['status'], name='product_fee_status_630f42_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['validation_status'], name='product_fee_validat_fdb8d3_idx'),
+        ),
+    ]
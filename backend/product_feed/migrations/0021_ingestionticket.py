@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-19 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_feed', '0020_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('supplier_id', models.CharField()),
+                ('rows', models.IntegerField()),
+                ('admitted', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2 on 2026-10-19 16:40
+
+from django.db import migrations, models
+
+# the brand column is rewritten with its values and its dictionary is dropped, the reverse encodes it again
+DECODE_BRAND_SQL = """
+    ALTER TABLE product_feed_item ADD COLUMN brand_value varchar(30) NULL;
+    UPDATE product_feed_item SET brand_value = attribute_value.value FROM product_feed_attributevalue AS attribute_value
+    WHERE attribute_value.attribute = 'brand' AND attribute_value.code = product_feed_item.brand;
+    ALTER TABLE product_feed_item DROP COLUMN brand;
+    ALTER TABLE product_feed_item RENAME COLUMN brand_value TO brand;
+    DELETE FROM product_feed_attributevalue WHERE attribute = 'brand';
+"""
+
+ENCODE_BRAND_SQL = """
+    INSERT INTO product_feed_attributevalue (attribute, code, value)
+    SELECT 'brand', row_number() OVER (ORDER BY value), value
+    FROM (SELECT DISTINCT brand AS value FROM product_feed_item WHERE brand IS NOT NULL) AS item_values;
+    ALTER TABLE product_feed_item ADD COLUMN brand_code integer NULL;
+    UPDATE product_feed_item SET brand_code = attribute_value.code FROM product_feed_attributevalue AS attribute_value
+    WHERE attribute_value.attribute = 'brand' AND attribute_value.value = product_feed_item.brand;
+    ALTER TABLE product_feed_item DROP COLUMN brand;
+    ALTER TABLE product_feed_item RENAME COLUMN brand_code TO brand;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_feed', '0022_change_deletions'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(DECODE_BRAND_SQL, ENCODE_BRAND_SQL),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='item',
+                    name='brand',
+                    field=models.CharField(blank=True, max_length=30, null=True),
+                ),
+            ],
+        ),
+    ]
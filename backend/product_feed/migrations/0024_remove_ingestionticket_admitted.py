@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-19 12:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_feed', '0023_decode_item_brand'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='ingestionticket',
+            name='admitted',
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.db import models
 
+from .dictionary import DictionaryEncodedField
+
 
 class Feed(models.Model):
     """
@@ -13,7 +15,7 @@ class Feed(models.Model):
         - session_start_time : str (to store the session start time stamp from the provided Feed)
         - session_end_tine : DateTime (to store the session end time stamp from the provided Feed)
     """
-    supplier_id = models.CharField()
+    supplier_id = models.CharField(db_index=True)
     user_id = models.CharField()
     session_id = models.CharField()
     session_start_time = models.DateTimeField()
@@ -29,7 +31,7 @@ class RelatedProduct(models.Model):
          - gtin : str (to store related product's item's code as gtin)
          - trade_item_unit_descriptor : str (to store related product's item's trade_item_unit_descriptor)
      """
-    gtin = models.CharField(max_length=20)
+    gtin = models.CharField(max_length=20, db_index=True)
     trade_item_unit_descriptor = models.CharField(max_length=50)
 
 
@@ -51,6 +53,7 @@ class Product(models.Model):
             - lot_number : str (to store the Product's lot number if imported)
             - cutting_plant_registration : str (to store the product's cutting plant registration code)
             - item : Object (this is the item Object which tells more about the product)
+            - updated_at : DateTime (touched on every save, its indexed max is used as the listing watermark for ETags)
     """
     product_feed = models.ForeignKey(to=Feed, on_delete=models.CASCADE, related_name='amounts', null=True)
     amount = models.IntegerField()
@@ -63,6 +66,7 @@ class Product(models.Model):
     lot_number = models.CharField(null=True, blank=True)
     cutting_plant_registration = models.CharField(null=True, blank=True)
     item = models.ForeignKey('Item', on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
 
 class Item(models.Model):
@@ -97,29 +101,175 @@ class Item(models.Model):
                - unit_name : str (to store the unit name)
                - vat_rate : str(to store the Vate rate information)
                - vat : Object (this is a JSON based field because we can expect an object. But I didn't have a new table because the information could be vary as per item)
+               - updated_at : DateTime (touched on every save by the ingestion paths, used for ETag / Last-Modified)
+
+           The low cardinality attributes type, packaging, status, trade_item_unit_descriptor,
+           trade_item_unit_descriptor_name, unit_name and validation_status are dictionary encoded: the rows store a
+           small integer code of the AttributeValue dictionary and the value is decoded from a process local map. The
+           brand has too many distinct values to be cached in every process and is stored as it is.
 
     """
     amount_multiplier = models.IntegerField(null=True, blank=True)
     brand = models.CharField(max_length=30, null=True, blank=True)
     categ_id = models.IntegerField(null=True, blank=True)
     category_id = models.CharField(max_length=15, null=True, blank=True)
-    code = models.CharField(max_length=20)
-    type = models.CharField(max_length=30, null=True, blank=True)
+    code = models.CharField(max_length=20, db_index=True)
+    type = DictionaryEncodedField(max_length=30, null=True, blank=True)
     description = models.CharField(max_length=255, null=True, blank=True)
     gross_weight = models.JSONField(null=True, blank=True)
     net_weight = models.JSONField(null=True, blank=True)
     hierarchies = models.JSONField(null=True, blank=True)
     notes = models.CharField(max_length=255, null=True, blank=True)
     edeka_article_number = models.CharField(max_length=20, null=True, blank=True)
-    packaging = models.CharField(max_length=50, null=True, blank=True)
+    packaging = DictionaryEncodedField(max_length=50, null=True, blank=True)
     regulated_name = models.CharField(max_length=30, null=True, blank=True)
     requires_best_before_date = models.BooleanField(null=True, blank=True, default=False)
     requires_meat_info = models.BooleanField(null=True, blank=True)
-    status = models.CharField(max_length=20, null=True, blank=True)
-    trade_item_unit_descriptor = models.CharField(max_length=255, null=True, blank=True)
-    trade_item_unit_descriptor_name = models.CharField(max_length=255, null=True, blank=True)
-    unit_name = models.CharField(max_length=10, null=True, blank=True)
-    validation_status = models.CharField(max_length=20, null=True, blank=True)
+    status = DictionaryEncodedField(max_length=20, null=True, blank=True)
+    trade_item_unit_descriptor = DictionaryEncodedField(max_length=255, null=True, blank=True)
+    trade_item_unit_descriptor_name = DictionaryEncodedField(max_length=255, null=True, blank=True)
+    unit_name = DictionaryEncodedField(max_length=10, null=True, blank=True)
+    validation_status = DictionaryEncodedField(max_length=20, null=True, blank=True)
     vat_rate = models.CharField(max_length=20, null=True, blank=True)
     related_products = models.ManyToManyField(RelatedProduct, related_name='items')
     vat = models.JSONField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        # the admin's list filters
+        indexes = [models.Index(fields=['status']), models.Index(fields=['validation_status'])]
+
+
+class AttributeValue(models.Model):
+    """
+        This is Attribute Value django ORM model class. It is the dictionary of the dictionary encoded Item attributes,
+        every distinct value of an attribute has a small integer code which the Item rows store instead of the value.
+
+        :param
+            - attribute : str (the name of the encoded attribute, e.g. trade_item_unit_descriptor)
+            - code : int (the code of the value, unique per attribute)
+            - value : str (the attribute value)
+    """
+    attribute = models.CharField(max_length=50)
+    code = models.IntegerField()
+    value = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = (('attribute', 'code'), ('attribute', 'value'))
+
+
+class Change(models.Model):
+    """
+        This is Change django ORM model class. Every Product and Item written by the ingestion paths appends a row here
+        in the same transaction, so the primary key is a monotonic change token that downstream consumers use to sync
+        only what changed since their last pull. The tokens are allocated under a lock held until commit, so they
+        become visible in commit order, see coordination.lock_change_feed.
+
+        :param
+            - id : int (the change token, increases with every recorded change)
+            - model : str (the changed model, either product or item)
+            - object_id : int (the primary key of the changed Product or Item)
+            - action : str (either created, updated or deleted)
+            - created_at : DateTime (to store when the change was recorded)
+    """
+    PRODUCT = 'product'
+    ITEM = 'item'
+    MODEL_CHOICES = ((PRODUCT, 'Product'), (ITEM, 'Item'))
+
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTION_CHOICES = ((CREATED, 'Created'), (UPDATED, 'Updated'), (DELETED, 'Deleted'))
+
+    model = models.CharField(max_length=10, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # the latest deletion is part of the conditional GET validators, see conditional
+        indexes = [models.Index(fields=['id'], condition=models.Q(action='deleted'), name='change_deletion_idx')]
+
+
+class PersistedQuery(models.Model):
+    """
+        This is Persisted Query django ORM model class. GraphQL clients register a query once with its sha256 hash and
+        afterwards send only the hash instead of the whole query string.
+
+        :param
+            - sha256 : str (the hex sha256 hash of the query string)
+            - query : str (the registered GraphQL query string)
+            - created_at : DateTime (to store when the query was registered)
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    query = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class RejectedRow(models.Model):
+    """
+        This is Rejected Row django ORM model class. A feed ingested in partial mode keeps its valid products and
+        records every rejected product here, so the supplier only resubmits the rejects.
+
+        :relations
+            - Feed : ManyToOne (the feed the row was rejected from)
+        :param
+            - index : int (the position of the row in the feed's amounts)
+            - data : JSON (the submitted row)
+            - errors : JSON (the validation or database errors of the row)
+            - created_at : DateTime (to store when the row was rejected)
+    """
+    feed = models.ForeignKey(to=Feed, on_delete=models.CASCADE, related_name='rejected_rows')
+    index = models.IntegerField()
+    data = models.JSONField()
+    errors = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('feed', 'index')
+
+
+class ProductDocument(models.Model):
+    """
+        This is Product Document django ORM model class. It is the materialized read model of the product listings,
+        the rendered JSON document of a product without its item. The ingestion paths refresh it in the transaction of
+        the write, the listings join it with the ItemDocument of the product's item instead of serializing the product.
+
+        :relations
+            - Product : OneToOne (the rendered product, also the primary key)
+        :param
+            - document : str (the JSON text of the product as the API renders it, without the item field)
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='document')
+    document = models.TextField()
+
+
+class ItemDocument(models.Model):
+    """
+        This is Item Document django ORM model class. It is the rendered JSON document of an item with its related
+        products, stored once per item and shared by the documents of all the item's products.
+
+        :relations
+            - Item : OneToOne (the rendered item, also the primary key)
+        :param
+            - document : str (the JSON text of the item as the API renders it)
+    """
+    item = models.OneToOneField(Item, on_delete=models.CASCADE, primary_key=True, related_name='document')
+    document = models.TextField()
+
+
+class IngestionTicket(models.Model):
+    """
+        This is Ingestion Ticket django ORM model class. Every admitted feed upload holds a ticket while it is ingested,
+        the tickets are the state the admission control of all the web workers shares. The
+        owning database session holds the advisory lock of the ticket's id, so the ticket of a worker which died is
+        recognized and deleted by the next admission.
+
+        :param
+            - supplier_id : str (the supplier of the uploaded feed)
+            - rows : int (the number of rows of the feed)
+            - created_at : DateTime (to store when the upload was admitted)
+    """
+    supplier_id = models.CharField()
+    rows = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
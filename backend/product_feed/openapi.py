@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+from importlib import import_module
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from openapi_codec.encode import generate_swagger_object
+from rest_framework.permissions import AllowAny
+from rest_framework.renderers import BaseRenderer
+from rest_framework.response import Response
+from rest_framework.schemas.coreapi import SchemaGenerator
+from rest_framework.views import APIView
+from rest_framework_swagger.renderers import OpenAPIRenderer, SwaggerUIRenderer
+from rest_framework_swagger.settings import swagger_settings
+
+
+def source_paths():
+    """
+    :return: paths : (list : str) the root URL configuration and every Python module of the API_SCHEMA_SOURCE_PACKAGES,
+        the sources the schema is introspected from
+    """
+    paths = [import_module(settings.ROOT_URLCONF).__file__]
+    for package_name in settings.API_SCHEMA_SOURCE_PACKAGES:
+        for directory, directories, files in os.walk(os.path.dirname(import_module(package_name).__file__)):
+            directories[:] = sorted(name for name in directories if name != '__pycache__')
+            paths.extend(os.path.join(directory, name) for name in sorted(files) if name.endswith('.py'))
+    return paths
+
+
+def source_fingerprint():
+    """
+    Fingerprint the sources the schema is introspected from, the URL configuration and the modules of the API packages.
+    A schema artifact with another fingerprint is stale.
+    :return: fingerprint : (str)
+    """
+    digest = hashlib.sha256()
+    for path in source_paths():
+        digest.update(os.path.relpath(path, settings.BASE_DIR).encode())
+        with open(path, 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+def generate_schema(title):
+    """
+    Introspect the views and serializers and encode the OpenAPI schema. The schema is generated without a request so it
+    contains every public endpoint and no host, Swagger UI falls back to the host it is served from.
+    :param title :(str):
+    :return: schema : (bytes) the OpenAPI JSON document
+    """
+    document = SchemaGenerator(title=title).get_schema(request=None, public=True)
+    data = generate_swagger_object(document)
+    data.update(OpenAPIRenderer().get_customizations())
+    data['x-source-fingerprint'] = source_fingerprint()
+    return json.dumps(data).encode()
+
+
+@lru_cache(maxsize=None)
+def get_schema(title):
+    """
+    Load the schema artifact written by the build_api_schema command, or generate the schema if the artifact is missing
+    or stale. The result is kept for the lifetime of the process.
+    :param title :(str):
+    :return: (bytes, str) the OpenAPI JSON document and its ETag
+    """
+    try:
+        with open(settings.API_SCHEMA_PATH, 'rb') as artifact:
+            schema = artifact.read()
+        if json.loads(schema).get('x-source-fingerprint') != source_fingerprint():
+            schema = None
+    except (OSError, ValueError):
+        schema = None
+    if schema is None:
+        schema = generate_schema(title)
+    return schema, '"%s"' % hashlib.md5(schema).hexdigest()
+
+
+class CachedOpenAPIRenderer(BaseRenderer):
+    """
+    Renders the already encoded OpenAPI document as is.
+    """
+    media_type = 'application/openapi+json'
+    charset = None
+    format = 'openapi'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
+
+
+class CachedSwaggerUIRenderer(SwaggerUIRenderer):
+    """
+    Renders Swagger UI with the already encoded OpenAPI document as its spec.
+    """
+
+    def set_context(self, data, renderer_context):
+        renderer_context['USE_SESSION_AUTH'] = swagger_settings.USE_SESSION_AUTH
+        renderer_context.update(self.get_auth_urls())
+        renderer_context['drs_settings'] = json.dumps(self.get_ui_settings())
+        renderer_context['spec'] = data.decode()
+
+
+class CachedSchemaView(APIView):
+    """
+        This is the API docs view. It serves the precomputed OpenAPI schema instead of introspecting every view and
+        serializer on each hit.
+
+        get:
+            Returns:
+                Swagger UI for browsers, otherwise the OpenAPI JSON document with an ETag and caching headers. A
+                matching If-None-Match returns 304.
+    """
+    title = None
+    schema = None
+    permission_classes = [AllowAny]
+    renderer_classes = [CachedOpenAPIRenderer, CachedSwaggerUIRenderer]
+
+    def get(self, request):
+        content, etag = get_schema(self.title)
+        if request.accepted_renderer.format != CachedOpenAPIRenderer.format:
+            # the UI page carries the user and a csrf token, it must not be shared
+            return Response(content)
+
+        response = get_conditional_response(request, etag=etag) or Response(content)
+        response.headers['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=settings.API_SCHEMA_MAX_AGE)
+        return response
@@ -0,0 +1,122 @@
+import tempfile
+import zlib
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError, UnsupportedMediaType
+from rest_framework.parsers import JSONParser
+
+# size of the compressed reads and the maximum size of every decompressed chunk
+CHUNK_SIZE = 64 * 1024
+
+
+class PayloadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Decompressed request body exceeds the allowed size.'
+    default_code = 'payload_too_large'
+
+
+def _zlib_chunks(stream, wbits):
+    """
+    Decompress a gzip or deflate body chunk by chunk. The output of every call is capped at CHUNK_SIZE so a small
+    compressed chunk can never expand into a large buffer.
+    :param stream : (file) the compressed request body
+    :param wbits : (int) zlib window bits selecting the gzip or the zlib container
+    :return: chunks : (generator of bytes)
+    """
+    decompressor = zlib.decompressobj(wbits)
+    try:
+        while True:
+            data = stream.read(CHUNK_SIZE)
+            if not data:
+                break
+            while data:
+                yield decompressor.decompress(data, CHUNK_SIZE)
+                data = decompressor.unconsumed_tail
+        yield decompressor.flush()
+    except zlib.error as exc:
+        raise ParseError(f'Invalid compressed body: {exc}')
+    if not decompressor.eof:
+        raise ParseError('Compressed body is truncated.')
+
+
+def _gzip_chunks(stream):
+    return _zlib_chunks(stream, 16 + zlib.MAX_WBITS)
+
+
+def _deflate_chunks(stream):
+    return _zlib_chunks(stream, zlib.MAX_WBITS)
+
+
+def _zstd_chunks(stream):
+    import zstandard
+
+    try:
+        yield from zstandard.ZstdDecompressor().read_to_iter(stream, read_size=CHUNK_SIZE, write_size=CHUNK_SIZE)
+    except zstandard.ZstdError as exc:
+        raise ParseError(f'Invalid compressed body: {exc}')
+
+
+def _lz4_chunks(stream):
+    import lz4.frame
+
+    decompressor = lz4.frame.LZ4FrameDecompressor()
+    try:
+        while not decompressor.eof:
+            data = stream.read(CHUNK_SIZE)
+            if not data:
+                raise ParseError('Compressed body is truncated.')
+            yield decompressor.decompress(data, max_length=CHUNK_SIZE)
+            # drain what is buffered in the decompressor before reading more input
+            while not decompressor.needs_input and not decompressor.eof:
+                yield decompressor.decompress(b'', max_length=CHUNK_SIZE)
+    except RuntimeError as exc:
+        raise ParseError(f'Invalid compressed body: {exc}')
+
+
+DECODERS = {
+    'gzip': _gzip_chunks,
+    'x-gzip': _gzip_chunks,
+    'deflate': _deflate_chunks,
+    'zstd': _zstd_chunks,
+    'lz4': _lz4_chunks,
+}
+
+
+class DecompressingJSONParser(JSONParser):
+    """
+        JSON parser which honours the Content-Encoding of the request.
+
+        The compressed body is read from the request stream and decompressed incrementally into a spooled temporary
+        file, which stays in memory up to FILE_UPLOAD_MAX_MEMORY_SIZE and moves to disk beyond, the decompressed size
+        is capped by FEED_UPLOAD_MAX_DECOMPRESSED_SIZE to protect against decompression bombs. The JSON document is
+        then parsed as a whole, the decompressed text and the parsed feed are held in memory, so the cap bounds the
+        memory of a parse and must fit in a worker.
+
+        methods:
+            - parse
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding in ('', 'identity'):
+            return super().parse(stream, media_type, parser_context)
+
+        decoder = DECODERS.get(encoding)
+        if decoder is None:
+            raise UnsupportedMediaType(media_type, detail=f'Unsupported Content-Encoding "{encoding}".')
+
+        limit = settings.FEED_UPLOAD_MAX_DECOMPRESSED_SIZE
+        body = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        size = 0
+        for chunk in decoder(stream):
+            size += len(chunk)
+            if size > limit:
+                body.close()
+                raise PayloadTooLarge()
+            body.write(chunk)
+        body.seek(0)
+
+        with body:
+            return super().parse(body, media_type, parser_context)
@@ -0,0 +1,133 @@
+import cProfile
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+
+class StackSampler:
+    """
+        A sampling profiler for one thread. A background thread records the stack of the profiled thread every interval,
+        and the samples are written in the collapsed stack format that flamegraph.pl and speedscope read.
+
+        methods:
+            - start
+            - stop
+            - write_collapsed
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f'{frame.f_code.co_name} ({frame.f_code.co_filename})')
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as collapsed:
+            for stack, count in self.samples.most_common():
+                collapsed.write(f'{stack} {count}\n')
+
+
+class SQLTrace:
+    """
+    Database execute wrapper which records every statement with its database alias and duration.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'database': context['connection'].alias,
+                'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+                'sql': sql,
+                'many': many,
+            })
+
+
+def should_profile(request):
+    """
+    A request is profiled if an admin asks for it with the X-Profile header or the profile query parameter, or if it is
+    drawn by the PROFILING_SAMPLE_RATE sampling. This is the only work done for a request which is not profiled.
+    :param request :(HttpRequest):
+    :return: (bool)
+    """
+    if 'HTTP_X_PROFILE' in request.META or 'profile' in request.GET:
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            return True
+    rate = settings.PROFILING_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+class ProfiledViewMixin:
+    """
+        Profiles the view on demand. A profiled request writes three files to PROFILING_OUTPUT_DIR and returns their
+        common prefix in the X-Profile-Id response header:
+
+            - <id>.prof : the cProfile statistics, readable with pstats or snakeviz
+            - <id>.collapsed : the sampled stacks in collapsed format, ready for flamegraph.pl or speedscope
+            - <id>.sql.json : the SQL statements with their database and duration
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if not should_profile(request):
+            return super().dispatch(request, *args, **kwargs)
+
+        profile_id = f'{time.strftime("%Y%m%dT%H%M%S")}-{type(self).__name__}-{uuid.uuid4().hex[:8]}'
+        profiler = cProfile.Profile()
+        sampler = StackSampler(threading.get_ident(), settings.PROFILING_SAMPLE_INTERVAL)
+        trace = SQLTrace()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(trace))
+            sampler.start()
+            profiler.enable()
+            try:
+                response = super().dispatch(request, *args, **kwargs)
+                # the template responses are rendered out of dispatch, profile the rendering as well
+                if hasattr(response, 'render') and callable(response.render):
+                    response.render()
+            finally:
+                profiler.disable()
+                sampler.stop()
+
+        os.makedirs(settings.PROFILING_OUTPUT_DIR, exist_ok=True)
+        path = os.path.join(settings.PROFILING_OUTPUT_DIR, profile_id)
+        profiler.dump_stats(f'{path}.prof')
+        sampler.write_collapsed(f'{path}.collapsed')
+        with open(f'{path}.sql.json', 'w') as sql_file:
+            json.dump({'path': request.get_full_path(), 'method': request.method, 'queries': trace.queries}, sql_file,
+                      indent=2)
+        response['X-Profile-Id'] = profile_id
+        return response
@@ -0,0 +1,69 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# set while a view serves reads which may be answered by a replica
+_replica_reads = ContextVar('replica_reads', default=False)
+# the models written while a request is served
+_written_models = ContextVar('written_models', default=None)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """
+    Route the reads made inside the block to the read replicas.
+    :param enabled :(bool): False keeps the reads on the primary, e.g. for a client pinned to the primary
+    """
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def track_writes():
+    """
+    Collect the labels of the models written inside the block.
+    :return: written : (set) filled as the block writes
+    """
+    written = set()
+    token = _written_models.set(written)
+    try:
+        yield written
+    finally:
+        _written_models.reset(token)
+
+
+class ReplicaRouter:
+    """
+        This is the database router of the product feed. Writes always go to the primary (default) database. Reads go to
+        a random replica from DATABASE_REPLICAS inside replica_reads blocks, and to the primary everywhere else, so an
+        ingestion never reads its own writes from a lagging replica.
+
+        methods:
+            - db_for_read
+            - db_for_write
+            - allow_relation
+    """
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        written = _written_models.get()
+        if written is not None:
+            written.add(model._meta.label)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same data as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
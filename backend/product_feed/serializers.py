@@ -1,6 +1,195 @@
 import unicodedata
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Item, Product, Feed, RelatedProduct
+from rest_framework.renderers import JSONRenderer
+from .cache import item_cache
+from .coordination import item_sort_key, lock_change_feed, lock_item_ranges, supplier_lock
+from .fieldsets import SparseFieldsetMixin
+from .models import Item, Product, Feed, RelatedProduct, Change, RejectedRow, ProductDocument, ItemDocument
+
+
+def normalize_code(code):
+    """
+    Normalize an item's code the way it is stored in the database, without the leading zeros.
+    :param code :(str or int):
+    :return: normalized_code : (str)
+    """
+    return str(int(code))
+
+
+def save_item(item_data, provided_only=False):
+    """
+    Create the item identified by the combination of code and type or update the existing one with the item data.
+    The Item identity cache is consulted before the database: an item with a known primary key is updated without
+    being looked up. The item is always written, the last write wins also over the writes of other processes.
+    :param item_data :(Object): the validated item data without the related products
+    :param provided_only :(bool): update only the provided fields data of an existing item
+    :return: (int, str) the item's primary key and Change.CREATED or Change.UPDATED
+    """
+    key = (item_data.get("code"), item_data.get("type"))
+    update_data = {attr: value for attr, value in item_data.items() if value} if provided_only else item_data
+
+    item_id = item_cache.get(key)
+    if item_id is not None:
+        # update does not touch the auto_now field itself
+        if Item.objects.filter(pk=item_id).update(updated_at=timezone.now(), **update_data):
+            item_cache.set_on_commit(key, item_id)
+            return item_id, Change.UPDATED
+        # the cached item has been deleted in the meantime
+        item_cache.discard(key)
+
+    try:
+        # try to get the existing item with combination of code and type field, if exist then update
+        item = Item.objects.get(code=key[0], type=key[1])
+        for attr, value in update_data.items():
+            setattr(item, attr, value)
+        item.save()
+        action = Change.UPDATED
+    except Item.DoesNotExist:
+        # if item does not exist then create a new one with provided data.
+        item = Item.objects.create(**item_data)
+        action = Change.CREATED
+    item_cache.set_on_commit(key, item.pk)
+    return item.pk, action
+
+
+def link_related_products(item_id, related_products_data):
+    """
+    Link the related products to the item, a related product which is already linked to the item by its gtin is skipped.
+    :param item_id :(int): the item's primary key
+    :param related_products_data :(list : Object): the validated related products data
+    """
+    through = Item.related_products.through
+    for related_product_data in related_products_data:
+        if not through.objects.filter(item_id=item_id, relatedproduct__gtin=related_product_data.get("gtin")).exists():
+            related_product = RelatedProduct.objects.create(**related_product_data)
+            through.objects.create(item_id=item_id, relatedproduct=related_product)
+
+
+def save_feed_product(feed, amount_data):
+    """
+    Write a product of a feed with its item and its related products.
+    :param feed :(Feed):
+    :param amount_data :(Object): the validated product data
+    :return: changes : (list : Change) the change feed rows of the written objects, not saved yet
+    """
+    changes = []
+    # extract the item object from Product Object
+    item_data = amount_data.pop('item')
+    # extract the related Products from the Product Object
+    related_products_data = item_data.pop('related_products', [])
+    item_id, item_action = save_item(item_data)
+    if item_action:
+        changes.append(Change(model=Change.ITEM, object_id=item_id, action=item_action))
+
+    # create a new Product Object and attached an Item object
+    prod = Product.objects.create(product_feed=feed, item_id=item_id, **amount_data)
+    changes.append(Change(model=Change.PRODUCT, object_id=prod.pk, action=Change.CREATED))
+
+    # for related product we must have Item created before then we can related products to that item as
+    # many to many field record.
+    link_related_products(item_id, related_products_data)
+    return changes
+
+
+def save_feed_products(feed, amounts_data):
+    """
+    Write the products of a feed with their items and their related products. The items are written first, in the
+    order of their keys, so that concurrent ingestions lock the Item rows in the same order; the products are then
+    created in the order of the feed.
+    :param feed :(Feed):
+    :param amounts_data :(list : Object): the validated products data
+    :return: changes : (list : Change) the change feed rows of the written objects, not saved yet
+    """
+    changes, item_ids = [], [None] * len(amounts_data)
+    for index in sorted(range(len(amounts_data)), key=lambda index: item_sort_key(amounts_data[index]['item'])):
+        item_data = {attr: value for attr, value in amounts_data[index]['item'].items() if attr != 'related_products'}
+        item_ids[index], item_action = save_item(item_data)
+        if item_action:
+            changes.append(Change(model=Change.ITEM, object_id=item_ids[index], action=item_action))
+
+    for item_id, amount_data in zip(item_ids, amounts_data):
+        related_products_data = amount_data.pop('item').get('related_products', [])
+        prod = Product.objects.create(product_feed=feed, item_id=item_id, **amount_data)
+        changes.append(Change(model=Change.PRODUCT, object_id=prod.pk, action=Change.CREATED))
+        link_related_products(item_id, related_products_data)
+    return changes
+
+
+def render_json(data):
+    """
+    :param data :(Object): serialized data
+    :return: document : (str) the JSON text of the data as the API renders it
+    """
+    return JSONRenderer().render(data).decode()
+
+
+def render_documents(products=(), items=()):
+    """
+    Render the stored documents of products and items.
+    :param products :(list : Product):
+    :param items :(list : Item): with their related products prefetched
+    :return: (dict, dict) the product documents without their item and the item documents, by primary key
+    """
+    products, items = list(products), list(items)
+    product_documents = {
+        product.pk: render_json(data)
+        for product, data in zip(products, ProductDocumentSerializer(products, many=True).data)
+    }
+    item_documents = {item.pk: render_json(data) for item, data in zip(items, ItemSerializer(items, many=True).data)}
+    return product_documents, item_documents
+
+
+def store_documents(product_documents, item_documents):
+    """
+    Insert or replace the stored documents.
+    :param product_documents :(dict): the product documents by product primary key
+    :param item_documents :(dict): the item documents by item primary key
+    """
+    ProductDocument.objects.bulk_create(
+        [ProductDocument(product_id=pk, document=document) for pk, document in product_documents.items()],
+        update_conflicts=True, unique_fields=['product'], update_fields=['document'])
+    ItemDocument.objects.bulk_create(
+        [ItemDocument(item_id=pk, document=document) for pk, document in item_documents.items()],
+        update_conflicts=True, unique_fields=['item'], update_fields=['document'])
+
+
+def refresh_documents(product_ids=(), item_ids=()):
+    """
+    Render and store the documents of the products and of their items, and of the other given items.
+    :param product_ids :(list : int):
+    :param item_ids :(list : int):
+    """
+    products = list(Product.objects.filter(pk__in=product_ids)) if product_ids else []
+    item_ids = set(item_ids) | {product.item_id for product in products}
+    items = Item.objects.filter(pk__in=item_ids).prefetch_related('related_products') if item_ids else []
+    store_documents(*render_documents(products, items))
+
+
+# sent with the changes once a transaction which recorded them is committed, e.g. to rebuild the code index
+changes_committed = Signal()
+
+
+def record_changes(changes):
+    """
+    Record the written objects in the change feed and refresh their stored documents, within the transaction of the
+    write. The document of a written product's item is refreshed as well, its related products may have changed.
+    The change rows are inserted last, under the lock of the change feed, so their tokens follow the commit order; the
+    callers record their changes at the end of the transaction, see lock_change_feed. Every write path records its
+    changes here, so changes_committed is sent for every committed write.
+    :param changes :(list : Change): the change feed rows of the written objects, not saved yet
+    """
+    refresh_documents(
+        product_ids=[change.object_id for change in changes if change.model == Change.PRODUCT],
+        item_ids=[change.object_id for change in changes if change.model == Change.ITEM],
+    )
+    if changes:
+        with transaction.atomic(savepoint=False):
+            lock_change_feed()
+            Change.objects.bulk_create(changes)
+        transaction.on_commit(lambda: changes_committed.send(sender=Change, changes=changes))
 
 
 class UnicodeCharField(serializers.CharField):
@@ -24,7 +213,7 @@ class UnicodeCharField(serializers.CharField):
         return super().to_internal_value(normalized_data)
 
 
-class RelatedProductSerializer(serializers.ModelSerializer):
+class RelatedProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
             This is the Model serializer class for Related Products data.
 
@@ -45,11 +234,11 @@ class RelatedProductSerializer(serializers.ModelSerializer):
                 :param data :(Object):
                 :return: normalized_data : (Object)
         """
-        data['gtin'] = str(int(data['gtin']))
+        data['gtin'] = normalize_code(data['gtin'])
         return super().to_internal_value(data)
 
 
-class ItemSerializer(serializers.ModelSerializer):
+class ItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
             This is the Model serializer class for Items.
 
@@ -80,7 +269,7 @@ class ItemSerializer(serializers.ModelSerializer):
         """
         # to remove the zero from start in the code before storing to database.
         if data.get('code'):
-            data['code'] = str(int(data.get('code')))
+            data['code'] = normalize_code(data.get('code'))
 
         # if there's no type field, it must set None in DB.
         if 'type' not in data:
@@ -112,15 +301,139 @@ class ItemSerializer(serializers.ModelSerializer):
         data = super().to_representation(instance)
 
         # on database side this is a char field but we receive boolean for response, so I transform to string.
-        if not data['notes']:
+        # the fields may be pruned by a sparse fieldset.
+        if 'notes' in data and not data['notes']:
             data['notes'] = False
         # on database side this is a char field but we receive boolean for response, so I transform to string.
-        if not data['edeka_article_number']:
+        if 'edeka_article_number' in data and not data['edeka_article_number']:
             data['edeka_article_number'] = False
         return data
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductListSerializer(serializers.ListSerializer):
+    """
+            This is the List serializer class for Products, it is used when many products are posted at once.
+
+            methods:
+                - create
+    """
+
+    @transaction.atomic
+    def create(self, validated_data):
+        """
+                This method override the create method of ListSerializer class.
+                It creates the products with set based queries instead of repeating the single product create for every
+                element: the Items are resolved from the Item identity cache or with one query and written with one bulk
+                insert and bulk updates, the Products, Related Products and the change feed rows are written with
+                bulk inserts.
+                The Items follow the same rules as ProductSerializer.create, only provided fields data is updated.
+                :param validated_data :(list : Object):
+                :return: products : (list : Product Object) in the order of the validated data
+        """
+        keys = [(product_data['item'].get('code'), product_data['item'].get('type')) for product_data in validated_data]
+        lock_item_ranges([code for code, _ in keys])
+        items_data = [
+            {attr: value for attr, value in product_data['item'].items() if attr != 'related_products'}
+            for product_data in validated_data
+        ]
+
+        # the items known to the Item identity cache are updated by their primary key without being looked up, with
+        # the provided fields data of all their elements, the last element wins
+        cached = {}
+        for key, item_data in zip(keys, items_data):
+            item_id = item_cache.get(key) if key not in cached else cached[key][0]
+            if item_id is not None:
+                cached[key] = (item_id, {**cached.get(key, (None, {}))[1],
+                                         **{attr: value for attr, value in item_data.items() if value}})
+        stale = {key for key in keys if key not in cached}
+        if cached:
+            # bulk update does not touch the auto_now field itself
+            now, by_fields = timezone.now(), {}
+            for item_id, update_data in cached.values():
+                by_fields.setdefault(tuple(sorted(update_data)), []).append(
+                    Item(pk=item_id, updated_at=now, **update_data))
+            updated = sum(Item.objects.bulk_update(cached_items, fields=[*fields, 'updated_at'])
+                          for fields, cached_items in by_fields.items())
+            if updated < len(cached):
+                # some cached items have been deleted in the meantime, they are resolved like the unknown items
+                found = set(Item.objects.filter(pk__in=[item_id for item_id, _ in cached.values()])
+                            .values_list('pk', flat=True))
+                for key in [key for key, (item_id, _) in cached.items() if item_id not in found]:
+                    item_cache.discard(key)
+                    stale.add(key)
+                    del cached[key]
+        item_ids = {key: item_id for key, (item_id, _) in cached.items()}
+
+        # resolve the other existing items with one query, the oldest item wins if a code and type pair is duplicated
+        existing = {}
+        if stale:
+            for item in Item.objects.filter(code__in={code for code, _ in stale}).order_by('id'):
+                existing.setdefault((item.code, item.type), item)
+
+        items, new_items, updated_fields = {}, [], set()
+        for key, item_data in zip(keys, items_data):
+            if key not in stale:
+                continue
+            item = items.get(key) or existing.get(key)
+            if item is None:
+                # if item does not exist then create a new one with provided data.
+                item = Item(**item_data)
+                new_items.append(item)
+            else:
+                for attr, value in item_data.items():
+                    if value:
+                        setattr(item, attr, value)
+                        updated_fields.add(attr)
+            items[key] = item
+
+        Item.objects.bulk_create(new_items)
+        new_keys = {(item.code, item.type) for item in new_items}
+        updated_items = [item for key, item in items.items() if key not in new_keys]
+        if updated_items:
+            # bulk update does not touch the auto_now field itself
+            now = timezone.now()
+            for item in updated_items:
+                item.updated_at = now
+            Item.objects.bulk_update(updated_items, fields=sorted(updated_fields | {'updated_at'}))
+
+        for key, item in items.items():
+            item_ids[key] = item.pk
+        for key, item_id in item_ids.items():
+            item_cache.set_on_commit(key, item_id)
+
+        # create the Products Objects and attached the Item objects
+        products = Product.objects.bulk_create([
+            Product(item_id=item_ids[key], **{attr: value for attr, value in product_data.items() if attr != 'item'})
+            for key, product_data in zip(keys, validated_data)
+        ])
+
+        # link only the related products which are not linked to the item yet
+        through = Item.related_products.through
+        linked = set(through.objects.filter(item_id__in=set(item_ids.values()))
+                     .values_list('item_id', 'relatedproduct__gtin'))
+        links = []
+        for key, product_data in zip(keys, validated_data):
+            item_id = item_ids[key]
+            for related_product_data in product_data['item'].get('related_products') or []:
+                if (item_id, related_product_data.get('gtin')) not in linked:
+                    linked.add((item_id, related_product_data.get('gtin')))
+                    links.append((item_id, RelatedProduct(**related_product_data)))
+        RelatedProduct.objects.bulk_create([related_product for _, related_product in links])
+        through.objects.bulk_create([
+            through(item_id=item_id, relatedproduct_id=related_product.pk) for item_id, related_product in links
+        ])
+
+        # record the written objects in the change feed and refresh their documents
+        record_changes(
+            [Change(model=Change.ITEM, object_id=item.pk, action=Change.CREATED) for item in new_items]
+            + [Change(model=Change.ITEM, object_id=item.pk, action=Change.UPDATED) for item in updated_items]
+            + [Change(model=Change.ITEM, object_id=item_id, action=Change.UPDATED) for item_id, _ in cached.values()]
+            + [Change(model=Change.PRODUCT, object_id=product.pk, action=Change.CREATED) for product in products]
+        )
+        return products
+
+
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
             This is the Model serializer class for Product.
 
@@ -141,21 +454,29 @@ class ProductSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'product_feed': {'required': False},
         }
+        list_serializer_class = ProductListSerializer
 
     def validate_item(self, value):
         """
         Validate the related item instance. It must be validated and presented to create a new product.
+        The item serializer is built once per product serializer, building its fields costs more than the validation.
         """
-        item_serializer = ItemSerializer(data=value)
-        if not item_serializer.is_valid():
-            raise serializers.ValidationError(item_serializer.errors)
+        if not hasattr(self, '_item_serializer'):
+            self._item_serializer = ItemSerializer()
+        try:
+            self._item_serializer.run_validation(value)
+        except serializers.ValidationError as exc:
+            raise serializers.ValidationError(exc.detail)
         return value
 
+    @transaction.atomic
     def create(self, validated_data):
         """
                 This method override the create method of ModelSerializer class.
                 This method works for create request object.
                 As we have to create or insert data to multiple tables, so we must have to over-ride this method to insert the data.
+                The written Item and Product are recorded in the change feed and their documents are refreshed within
+                the same transaction.
                 :param validated_data :(Object):
                 :return: Product : (Object)
         """
@@ -163,29 +484,36 @@ class ProductSerializer(serializers.ModelSerializer):
         item_data = validated_data.pop('item')
         # extract the related Products from the Product Object
         related_products_data = item_data.pop('related_products', [])
-        try:
-            # try to get the existing item with combination of code and type field, if exist then update
-            # only provided fields data
-            item = Item.objects.get(code=item_data.get("code"), type=item_data.get("type"))
-            for attr, value in item_data.items():
-                if value:
-                    setattr(item, attr, value)
-            item.save()
-        except Item.DoesNotExist:
-            # if item does not exist then create a new one with provided data.
-            item = Item.objects.create(**item_data)
+        lock_item_ranges([item_data.get('code')])
+        # update only provided fields data of an existing item
+        item_id, item_action = save_item(item_data, provided_only=True)
         # create a new Product Object and attached an Item object
-        prod = Product.objects.create(item=item, **validated_data)
+        prod = Product.objects.create(item_id=item_id, **validated_data)
 
         # for related product we must have Item created before then we can related products to that item as
         # many to many field record.
-        for related_product_data in related_products_data:
-            if not item.related_products.filter(gtin=related_product_data.get("gtin")).exists():
-                related_product = RelatedProduct.objects.create(**related_product_data)
-                item.related_products.add(related_product)
+        link_related_products(item_id, related_products_data)
+
+        # record the written objects in the change feed and refresh their documents
+        changes = [Change(model=Change.PRODUCT, object_id=prod.pk, action=Change.CREATED)]
+        if item_action:
+            changes.insert(0, Change(model=Change.ITEM, object_id=item_id, action=item_action))
+        record_changes(changes)
         return prod
 
 
+class ProductDocumentSerializer(ProductSerializer):
+    """
+            This is the Model serializer class for the stored product documents, the product without its item. The
+            item's document is stored once per item and joined to the product's document when it is served.
+    """
+    item = None
+
+    class Meta(ProductSerializer.Meta):
+        fields = None
+        exclude = ('item',)
+
+
 class DataSerializer(serializers.ModelSerializer):
     """
                 This is the Model serializer class for Feed which insert the data from json file.
@@ -209,36 +537,87 @@ class DataSerializer(serializers.ModelSerializer):
                 This method override the create method of ModelSerializer class for Feed.
                 This method works for create request object.
                 As we have to create or insert data to multiple tables, so we must have to over-ride this method to insert the data.
+                The written Items and Products are recorded in the change feed and their documents are refreshed within
+                the same transaction.
+                The feeds of one supplier are ingested one after another, the transaction takes the supplier's lock
+                and the locks of the Item key ranges it writes before writing any item, see coordination.
                 :param validated_data :(Object):
                 :return: Product : (Object)
         """
         # extract the Products list from Feed.
         amounts_data = validated_data.pop('amounts')
-        # create the Feed Object from the provided data
-        feed = Feed.objects.create(**validated_data)
-        for amount_data in amounts_data:
-            # extract the item object from Product Object
-            item_data = amount_data.pop('item')
-            # extract the related Products from the Product Object
-            related_products_data = item_data.pop('related_products', [])
-            try:
-                # try to get the existing item with combination of code and type field, if exist then update
-                # only provided fields data
-                item = Item.objects.get(code=item_data.get("code"), type=item_data.get("type"))
-                for attr, value in item_data.items():
-                    setattr(item, attr, value)
-                item.save()
-            except Item.DoesNotExist:
-                # if item does not exist then create a new one with provided data.
-                item = Item.objects.create(**item_data)
+        with supplier_lock(validated_data.get('supplier_id')), transaction.atomic():
+            lock_item_ranges([amount_data['item'].get('code') for amount_data in amounts_data])
+            # create the Feed Object from the provided data
+            feed = Feed.objects.create(**validated_data)
+            changes = save_feed_products(feed, amounts_data)
+
+            # record the written objects in the change feed and refresh their documents
+            record_changes(changes)
+        return feed
 
-            # create a new Product Object and attached an Item object
-            Product.objects.create(product_feed=feed, item=item, **amount_data)
 
-            # for related product we must have Item created before then we can related products to that item as
-            # many to many field record.
-            for related_product_data in related_products_data:
-                if not item.related_products.filter(gtin=related_product_data.get("gtin")).exists():
-                    related_product = RelatedProduct.objects.create(**related_product_data)
-                    item.related_products.add(related_product)
-        return feed
+class CodeLookupSerializer(serializers.Serializer):
+    """
+            This is the serializer class for the batch lookup of products by item's codes.
+
+            instance:
+                - codes (the item's codes to look up, normalized like the stored item's codes)
+
+            methods:
+                - validate_codes
+    """
+    codes = serializers.ListField(child=serializers.CharField(), allow_empty=False, max_length=1000)
+
+    def validate_codes(self, value):
+        """
+        Normalize the codes and drop the duplicates while keeping the requested order.
+        """
+        try:
+            return list(dict.fromkeys(normalize_code(code) for code in value))
+        except ValueError:
+            raise serializers.ValidationError('Item codes must be numeric.')
+
+
+class ChangeSerializer(serializers.ModelSerializer):
+    """
+            This is the Model serializer class for the change feed entries.
+
+            instance:
+                - token (the change token, consumers pass the last one back as since)
+                - data (the current state of the changed Product or Item)
+
+            context:
+                - objects (the changed objects prefetched by the view, keyed by model and primary key)
+
+            methods:
+                - get_data
+    """
+    token = serializers.IntegerField(source='id')
+    data = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Change
+        fields = ('token', 'model', 'object_id', 'action', 'data')
+
+    def get_data(self, change):
+        """
+        Serialize the current state of the changed object, None if it was deleted in the meantime.
+        :param change :(Change):
+        :return: data : (Object)
+        """
+        instance = self.context['objects'][change.model].get(change.object_id)
+        if instance is None:
+            return None
+        serializer_class = ProductSerializer if change.model == Change.PRODUCT else ItemSerializer
+        return serializer_class(instance).data
+
+
+class RejectedRowSerializer(serializers.ModelSerializer):
+    """
+            This is the Model serializer class for the rows rejected by a partial feed ingestion.
+    """
+
+    class Meta:
+        model = RejectedRow
+        fields = ('index', 'data', 'errors', 'created_at')
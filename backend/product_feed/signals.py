@@ -0,0 +1,33 @@
+from django.db.models.signals import post_delete, post_migrate
+from django.dispatch import receiver
+
+from .cache import item_cache
+from .dictionary import dictionaries
+from .documents import code_index_rebuilder
+from .models import Change, Item
+from .serializers import changes_committed
+
+
+@receiver(post_delete, sender=Item)
+def discard_deleted_item(sender, instance, **kwargs):
+    """
+    Drop a deleted Item from the Item identity cache so the ingestion paths never bind a product to it.
+    """
+    item_cache.discard((instance.code, instance.type))
+
+
+@receiver(post_migrate)
+def clear_attribute_dictionaries(sender, **kwargs):
+    """
+    Drop the cached attribute dictionaries after a migration or a flush, their codes may no longer be in the database.
+    """
+    for dictionary in dictionaries.values():
+        dictionary.clear()
+
+
+@receiver(changes_committed, sender=Change)
+def schedule_code_index_rebuild(sender, changes, **kwargs):
+    """
+    Bring the code index of the host up to the committed changes, in the background.
+    """
+    code_index_rebuilder.schedule()
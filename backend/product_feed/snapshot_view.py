@@ -0,0 +1,51 @@
+from django.db import router
+from django.http import Http404, StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.views import APIView
+
+from .models import Product
+from .snapshots import CONTENT_TYPES, FORMATS, latest_change_token, snapshot_chunks
+from .views import ReplicaReadMixin
+
+
+class SnapshotView(ReplicaReadMixin, APIView):
+    """
+            This endpoint streams a columnar snapshot of the catalog, the products joined to their items and feeds, for
+            analytics. The module imports pyarrow and is only imported on the first snapshot request.
+
+            get:
+                Args:
+                    file_format (str) : parquet, a row group per record batch, or arrow, the Arrow IPC stream format
+                    since (int) : optional, the change token of the previous snapshot, only the products written after
+                    it or whose item was written after it are exported
+                Returns:
+                    the snapshot file, streamed from a server side cursor in record batches. Its schema metadata holds
+                    the change_token to pass as since for the next incremental snapshot, the token is also returned in
+                    the X-Change-Token header. Deleted products are not part of an incremental snapshot.
+                Raises:
+                    NotFound: If the file format is not supported.
+                    ValidationError: If since is not a non-negative integer.
+    """
+
+    allowed_methods = ['GET']
+
+    def get(self, request, file_format, format=None):
+        if file_format not in FORMATS:
+            raise Http404
+        since = request.query_params.get('since')
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                raise ValidationError({'detail': 'since must be an integer.'})
+            if since < 0:
+                raise ValidationError({'detail': 'since must not be negative.'})
+
+        # the streamed body is read after the view returns, outside of the replica routing of the request
+        using = router.db_for_read(Product)
+        change_token = latest_change_token(using)
+        response = StreamingHttpResponse(snapshot_chunks(file_format, using, change_token, since),
+                                         content_type=CONTENT_TYPES[file_format])
+        response['Content-Disposition'] = f'attachment; filename="catalog-{change_token}.{file_format}"'
+        response['X-Change-Token'] = str(change_token)
+        return response
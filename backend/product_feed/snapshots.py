@@ -0,0 +1,238 @@
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.db import connections, models, transaction
+
+from .coordination import latest_change_token
+from .dictionary import DictionaryEncodedField
+from .models import AttributeValue, Change, Feed, Item, Product, RelatedProduct
+
+FORMATS = ('parquet', 'arrow')
+CONTENT_TYPES = {'parquet': 'application/vnd.apache.parquet', 'arrow': 'application/vnd.apache.arrow.stream'}
+
+# the string columns with few distinct values, they are dictionary encoded like the encoded Item attributes
+CATEGORICAL = {
+    'product_country_of_disassembly', 'product_country_of_rearing', 'product_country_of_slaughter',
+    'item_category_id', 'item_vat_rate', 'feed_supplier_id', 'feed_user_id',
+}
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+RELATED_PRODUCTS = pa.list_(pa.struct([('gtin', pa.string()), ('trade_item_unit_descriptor', pa.string())]))
+
+
+class Column:
+    """
+        A column of the catalog snapshot, a field of Product, Item or Feed.
+
+        :param
+            - name : str (the column name, the field name prefixed with the model name)
+            - sql : str (the selected expression)
+            - arrow_type : DataType (the arrow type of the column)
+            - kind : str (value, json for a JSON field written as its JSON text, encoded for a dictionary encoded
+                Item attribute whose codes are read as they are stored, category for a string dictionary encoded per
+                batch)
+            - attribute : str (the dictionary of an encoded column)
+    """
+
+    def __init__(self, name, sql, arrow_type, kind='value', attribute=None):
+        self.name = name
+        self.sql = sql
+        self.arrow_type = arrow_type
+        self.kind = kind
+        self.attribute = attribute
+
+
+def _field_column(prefix, alias, field):
+    name, sql = f'{prefix}_{field.name}', f'{alias}.{field.column}'
+    if isinstance(field, DictionaryEncodedField):
+        return Column(name, sql, DICTIONARY, 'encoded', field.attribute)
+    if isinstance(field, models.JSONField):
+        return Column(name, sql, pa.string(), 'json')
+    if isinstance(field, (models.AutoField, models.BigIntegerField)):
+        return Column(name, sql, pa.int64())
+    if isinstance(field, models.IntegerField):
+        return Column(name, sql, pa.int32())
+    if isinstance(field, models.BooleanField):
+        return Column(name, sql, pa.bool_())
+    if isinstance(field, models.DateTimeField):
+        return Column(name, sql, pa.timestamp('us', tz='UTC'))
+    return Column(name, sql, DICTIONARY if name in CATEGORICAL else pa.string(),
+                  'category' if name in CATEGORICAL else 'value')
+
+
+def snapshot_columns():
+    """
+    :return: columns : (list : Column) the fields of Product, of its Item with the related products and of its Feed
+    """
+    columns = []
+    for prefix, alias, model in (('product', 'product', Product), ('item', 'item', Item), ('feed', 'feed', Feed)):
+        columns.extend(_field_column(prefix, alias, field) for field in model._meta.concrete_fields
+                       if not field.is_relation)
+    through = Item.related_products.through._meta.db_table
+    columns.append(Column(
+        'item_related_products',
+        f"(SELECT json_agg(json_build_object('gtin', related.gtin, "
+        f"'trade_item_unit_descriptor', related.trade_item_unit_descriptor) ORDER BY related.id) "
+        f'FROM {through} link JOIN {RelatedProduct._meta.db_table} related ON related.id = link.relatedproduct_id '
+        f'WHERE link.item_id = item.id)',
+        RELATED_PRODUCTS,
+    ))
+    return columns
+
+
+def snapshot_schema(columns, change_token, since):
+    """
+    :return: schema : (Schema) the arrow schema of the snapshot, its metadata holds the change token the snapshot is
+        complete up to, and the token of the previous snapshot for an incremental one
+    """
+    return pa.schema([pa.field(column.name, column.arrow_type) for column in columns], metadata={
+        'change_token': str(change_token),
+        'since': '' if since is None else str(since),
+    })
+
+
+def _encoded_array(values, dictionary):
+    """
+    :param values :(list : int): the stored codes of an encoded attribute
+    :param dictionary :(tuple): the position of every code and the values of the attribute in code order
+    :return: DictionaryArray of the attribute's values, without decoding them
+    """
+    positions, dictionary_values = dictionary
+    indices = pa.array([None if code is None else positions[code] for code in values], pa.int32())
+    return pa.DictionaryArray.from_arrays(indices, dictionary_values)
+
+
+def _array(column, values, dictionaries):
+    if column.kind == 'encoded':
+        return _encoded_array(values, dictionaries[column.attribute])
+    if column.kind == 'json':
+        return pa.array([None if value is None else json.dumps(value) for value in values], pa.string())
+    if column.kind == 'category':
+        return pa.array(values, pa.string()).dictionary_encode().cast(DICTIONARY)
+    return pa.array(values, column.arrow_type)
+
+
+def snapshot_batches(columns, schema, using, since=None, batch_size=None):
+    """
+    Read the catalog from a server side cursor and convert it to record batches. The snapshot is read in one
+    repeatable read transaction, so it is consistent however long it takes.
+    :param columns :(list : Column):
+    :param schema :(Schema): the schema of the columns, see snapshot_schema
+    :param using :(str): the database alias to read from
+    :param since :(int): the change token of the previous snapshot, only the products written after it or whose item
+        was written after it are read from the commit ordered change feed; None for a full snapshot
+    :param batch_size :(int): rows per record batch, defaults to SNAPSHOT_BATCH_SIZE
+    :return: batches : (generator : RecordBatch)
+    """
+    batch_size = batch_size or settings.SNAPSHOT_BATCH_SIZE
+    sql = (f'SELECT {", ".join(column.sql for column in columns)} '
+           f'FROM {Product._meta.db_table} product '
+           f'JOIN {Item._meta.db_table} item ON item.id = product.item_id '
+           f'LEFT JOIN {Feed._meta.db_table} feed ON feed.id = product.product_feed_id ')
+    params = []
+    if since is not None:
+        sql += (f'WHERE product.id IN (SELECT object_id FROM {Change._meta.db_table} WHERE model = %s AND id > %s) '
+                f'OR product.item_id IN (SELECT object_id FROM {Change._meta.db_table} WHERE model = %s AND id > %s) ')
+        params = [Change.PRODUCT, since, Change.ITEM, since]
+    sql += 'ORDER BY product.id'
+
+    connection = connections[using]
+    outermost = not connection.in_atomic_block
+    with transaction.atomic(using=using):
+        if outermost:
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        # the dictionaries of the encoded attributes, read in the snapshot of the rows
+        dictionaries = {}
+        for column in columns:
+            if column.kind == 'encoded' and column.attribute not in dictionaries:
+                entries = AttributeValue.objects.using(using).filter(attribute=column.attribute).order_by(
+                    'code').values_list('code', 'value')
+                dictionaries[column.attribute] = (
+                    {code: position for position, (code, _) in enumerate(entries)},
+                    pa.array([value for _, value in entries], pa.string()),
+                )
+
+        with connection.chunked_cursor() as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                values = list(zip(*rows))
+                yield pa.record_batch([_array(column, values[index], dictionaries)
+                                       for index, column in enumerate(columns)], schema=schema)
+
+
+class ChunkSink:
+    """
+        A write only file which keeps the bytes written by an arrow writer until they are taken, so a snapshot can be
+        streamed batch by batch.
+
+        methods:
+            - write
+            - take
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def snapshot_chunks(format, using, change_token, since=None, batch_size=None):
+    """
+    Write a catalog snapshot batch by batch.
+    :param format :(str): parquet, a row group per record batch, or arrow, the Arrow IPC stream format
+    :param using :(str): the database alias to read from
+    :param change_token :(int): the change token the snapshot is complete up to, read before the snapshot starts so
+        that a row written meanwhile is at worst repeated by the next incremental snapshot and never missed
+    :param since :(int): the change token of the previous snapshot for an incremental snapshot, see snapshot_batches
+    :param batch_size :(int): rows per record batch
+    :return: chunks : (generator : bytes) the snapshot file
+    """
+    columns = snapshot_columns()
+    schema = snapshot_schema(columns, change_token, since)
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(sink, schema) if format == 'parquet' else pa.ipc.new_stream(sink, schema)
+    for batch in snapshot_batches(columns, schema, using, since, batch_size):
+        writer.write_batch(batch)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def read_snapshot_metadata(path):
+    """
+    :param path :(str): a snapshot file written by snapshot_chunks
+    :return: metadata : (dict) the change token of the snapshot and of the snapshot it is incremental to, as str
+    """
+    with open(path, 'rb') as snapshot:
+        is_parquet = snapshot.read(4) == b'PAR1'
+    if is_parquet:
+        metadata = pq.read_schema(path).metadata
+    else:
+        with pa.OSFile(path) as source:
+            metadata = pa.ipc.open_stream(source).schema.metadata
+    return {key.decode(): value.decode() for key, value in metadata.items() if key in (b'change_token', b'since')}
@@ -1,8 +1,46 @@
+import gzip
+import io
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+import lz4.frame
+import pyarrow as pa
+import pyarrow.parquet as pq
+import zstandard
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import FieldError
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.test import LiveServerTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.http import parse_http_date
 from rest_framework import status
-from rest_framework.test import APITestCase
-from .models import Product, Item
-from .serializers import ProductSerializer
+from rest_framework.test import APIClient, APITestCase
+from . import dictionary
+from .admin import EstimatedCountPaginator
+from .cache import item_cache
+from .code_index import code_index
+from .coordination import SUPPLIER_LOCK, item_range_key, latest_change_token, supplier_key
+from .dictionary import close_insert_connections, dictionaries
+from .documents import code_index_rebuilder, rebuild_code_index
+from .graphql_view import document_cache
+from .management.commands.loadtest import compare
+from .openapi import get_schema, source_paths
+from .models import Product, Item, PersistedQuery, AttributeValue, ProductDocument, ItemDocument, Change, Feed, \
+    IngestionTicket
+from .serializers import ProductSerializer, record_changes, save_item
+
+
+def tearDownModule():
+    # the test databases are dropped once the module has run, no session may be left on them
+    close_insert_connections()
 
 
 class ProductListCreateAPIViewTest(APITestCase):
@@ -93,3 +131,1165 @@ class ProductListCreateAPIViewTest(APITestCase):
         self.assertEqual(response.get('comment'), expected_data.get('comment'))
         self.assertEqual(response.get('amount'), expected_data.get('amount'))
         self.assertEqual(response.get('item').get('code'), expected_data.get('item').get('code'))
+
+
+class ProductConditionalGetTest(APITestCase):
+    url = reverse('products_list')
+
+    def setUp(self):
+        item = Item.objects.create(code=1)
+        Product.objects.create(item=item, amount=1)
+
+    def test_list_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response.headers['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        # the watermark query runs, the page query and serializer must not
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # a new product changes the watermark so the old tag is not a match anymore
+        Product.objects.create(item=Item.objects.get(code=1), amount=2)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_detail_not_modified(self):
+        response = self.client.get(f"{self.url}1")
+        etag = response.headers['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f"{self.url}1", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # the page is part of the tag
+        response = self.client.get(f"{self.url}1?page=1", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get(f"{self.url}1", HTTP_IF_MODIFIED_SINCE=response.headers['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_not_modified_after_delete(self):
+        Product.objects.create(item=Item.objects.create(code=2), amount=2)
+        etag, detail_etag = self.client.get(self.url).headers['ETag'], self.client.get(f"{self.url}1").headers['ETag']
+        last_modified = self.client.get(self.url).headers['Last-Modified']
+
+        # an admin deletes the older item with its product, the newest updated_at do not move
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.client.post(reverse('admin:product_feed_item_changelist'), {
+            'action': 'delete_selected_set', '_selected_action': [Item.objects.get(code=1).pk]})
+        self.client.logout()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(self.client.get(f"{self.url}1", HTTP_IF_NONE_MATCH=detail_etag).status_code,
+                         status.HTTP_200_OK)
+        self.assertGreaterEqual(parse_http_date(response.headers['Last-Modified']), parse_http_date(last_modified))
+        self.assertEqual(
+            list(Change.objects.filter(action=Change.DELETED).values_list('model', flat=True)), ['product', 'item'])
+
+
+class ChangeFeedAPIViewTest(APITestCase):
+    url = reverse('changes')
+
+    def test_changes_since_token(self):
+        # the product endpoint records the item and the product
+        self.client.post(reverse('products_list'), {'item': {'code': '0042'}, 'amount': 1}, format='json')
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data.get('results')
+        self.assertEqual([(change['model'], change['action']) for change in results],
+                         [('item', 'created'), ('product', 'created')])
+        self.assertEqual(results[0]['data']['code'], '42')
+        self.assertEqual(results[1]['data']['amount'], 1)
+        token = response.data.get('next')
+
+        # nothing changed since the last token
+        response = self.client.get(self.url, {'since': token})
+        self.assertEqual(response.data.get('results'), [])
+        self.assertEqual(response.data.get('next'), token)
+
+        # the same item is updated and a second product is created
+        self.client.post(reverse('products_list'), {'item': {'code': '42'}, 'amount': 2}, format='json')
+        response = self.client.get(self.url, {'since': token, 'limit': 1})
+        self.assertEqual([(change['model'], change['action']) for change in response.data.get('results')],
+                         [('item', 'updated')])
+        response = self.client.get(self.url, {'since': response.data.get('next')})
+        self.assertEqual(response.data.get('results')[0]['data']['amount'], 2)
+
+    def test_invalid_token(self):
+        response = self.client.get(self.url, {'since': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ChangeFeedCommitOrderTest(TransactionTestCase):
+    url = reverse('changes')
+
+    def test_tokens_follow_commit_order(self):
+        recorded, commit = threading.Event(), threading.Event()
+
+        def slow_writer():
+            # records its change first and commits last
+            with transaction.atomic():
+                record_changes([Change(model=Change.ITEM, object_id=1, action=Change.UPDATED)])
+                recorded.set()
+                commit.wait(10)
+            connection.close()
+
+        def writer():
+            with transaction.atomic():
+                record_changes([Change(model=Change.ITEM, object_id=2, action=Change.UPDATED)])
+            connection.close()
+
+        slow = threading.Thread(target=slow_writer)
+        slow.start()
+        recorded.wait(10)
+        fast = threading.Thread(target=writer)
+        fast.start()
+        fast.join(0.5)
+        # the second writer waits for the first one's commit before it allocates its token
+        self.assertTrue(fast.is_alive())
+        response = self.client.get(self.url)
+        self.assertEqual((response.data['results'], response.data['next']), ([], 0))
+
+        commit.set()
+        slow.join(10)
+        fast.join(10)
+        response = self.client.get(self.url)
+        self.assertEqual([change['object_id'] for change in response.data['results']], [1, 2])
+        self.assertEqual(response.data['results'][0]['token'], min(Change.objects.values_list('id', flat=True)))
+
+
+class CompressedFeedUploadTest(APITestCase):
+    url = reverse('product_list_upload')
+
+    def setUp(self):
+        with open(settings.BASE_DIR / 'products.json') as products_file:
+            feed = json.load(products_file)
+        feed['amounts'] = feed['amounts'][:2]
+        self.body = json.dumps(feed).encode()
+
+    def upload(self, body, encoding):
+        return self.client.generic('POST', self.url, body, content_type='application/json',
+                                   HTTP_CONTENT_ENCODING=encoding)
+
+    def test_upload_compressed(self):
+        compressors = {
+            'gzip': gzip.compress,
+            'deflate': zlib.compress,
+            'zstd': zstandard.ZstdCompressor().compress,
+            'lz4': lz4.frame.compress,
+        }
+        for encoding, compress in compressors.items():
+            with self.subTest(encoding=encoding):
+                response = self.upload(compress(self.body), encoding)
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+                self.assertEqual(len(response.data.get('amounts')), 2)
+        self.assertEqual(Product.objects.count(), 2 * len(compressors))
+
+    def test_decompressed_size_limit(self):
+        with override_settings(FEED_UPLOAD_MAX_DECOMPRESSED_SIZE=len(self.body) - 1):
+            response = self.upload(gzip.compress(self.body), 'gzip')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(Product.objects.exists())
+
+    def test_invalid_body(self):
+        response = self.upload(gzip.compress(self.body)[:-20], 'gzip')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.upload(self.body, 'br')
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+
+class ProductBulkCreateTest(APITestCase):
+    url = reverse('products_list')
+
+    def test_bulk_create(self):
+        existing = Item.objects.create(code='7', type='gtin', brand='Old')
+        data = [
+            {'item': {'code': '0007', 'type': 'gtin', 'brand': 'New',
+                      'related_products': [{'gtin': '0099', 'trade_item_unit_descriptor': 'CASE'}]}, 'amount': 1},
+            {'item': {'code': '8'}, 'amount': 2},
+            {'item': {'code': '0008', 'related_products': [{'gtin': '99', 'trade_item_unit_descriptor': 'CASE'}]},
+             'amount': 3},
+        ]
+        # five more queries load, render and store the documents of the written products and items, one more takes the
+        # locks of the Item key ranges and one more the lock of the change feed
+        with self.assertNumQueries(19):
+            response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([result['data']['amount'] for result in response.data], [1, 2, 3])
+
+        # the existing item is updated, the duplicated new item is created once
+        existing.refresh_from_db()
+        self.assertEqual(existing.brand, 'New')
+        self.assertEqual(Item.objects.count(), 2)
+        self.assertEqual(Item.objects.get(code='8').related_products.get().gtin, '99')
+        self.assertEqual(response.data[0]['data']['item']['related_products'], [
+            {'gtin': '99', 'trade_item_unit_descriptor': 'CASE'}])
+
+        # related products are not linked twice
+        self.client.post(self.url, data[:1], format='json')
+        self.assertEqual(existing.related_products.count(), 1)
+
+    def test_bulk_partial_success(self):
+        response = self.client.post(self.url, [{'item': {'code': '1'}, 'amount': 1}, {'item': {'code': '2'}}],
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data[0]['status'], status.HTTP_201_CREATED)
+        self.assertEqual(response.data[1]['status'], status.HTTP_400_BAD_REQUEST)
+        self.assertIn('amount', response.data[1]['errors'])
+        self.assertEqual(Product.objects.count(), 1)
+
+        response = self.client.post(self.url, [{'item': {'code': '2'}}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(PRODUCT_BULK_CREATE_MAX_SIZE=2)
+    def test_bulk_create_max_size(self):
+        data = [{'item': {'code': str(code)}, 'amount': 1} for code in range(3)]
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(self.client.post(self.url, data[:2], format='json').status_code, status.HTTP_201_CREATED)
+
+
+class ProductLookupAPIViewTest(APITestCase):
+    url = reverse('products_lookup')
+
+    def test_lookup_codes(self):
+        item1 = Item.objects.create(code='11')
+        item2 = Item.objects.create(code='22')
+        Product.objects.create(item=item1, amount=1)
+        Product.objects.create(item=item1, amount=2)
+        Product.objects.create(item=item2, amount=3)
+
+        # the products are loaded joined with their items, the related products with one prefetch query
+        with self.assertNumQueries(2):
+            response = self.client.post(self.url, {'codes': ['0011', '22', '11', '33']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data.get('results')
+        self.assertEqual(list(results), ['11', '22', '33'])
+        self.assertEqual([product['amount'] for product in results['11']], [1, 2])
+        self.assertEqual([product['amount'] for product in results['22']], [3])
+        self.assertEqual(results['33'], [])
+
+    def test_invalid_codes(self):
+        response = self.client.post(self.url, {'codes': ['12a']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, {'codes': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ItemIdentityCacheTest(APITestCase):
+    url = reverse('products_list')
+
+    def setUp(self):
+        item_cache.clear()
+        self.addCleanup(item_cache.clear)
+
+    def test_repeated_item_skips_lookup(self):
+        data = {'item': {'code': '5', 'type': 'gtin', 'brand': 'Brand'}, 'amount': 1}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, data, format='json')
+
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['item']['brand'], 'Brand')
+        self.assertFalse([query for query in queries if '"product_feed_item"."code" =' in query['sql']])
+        self.assertEqual(item_cache.stats()['hits'], 1)
+
+        # a changed payload updates the cached item by its primary key
+        data['item']['brand'] = 'Other'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, data, format='json')
+        self.assertEqual(Item.objects.get().brand, 'Other')
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_cached_item_is_written(self):
+        data = {'item': {'code': '5', 'type': 'gtin', 'brand': 'Brand'}, 'amount': 1}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, data, format='json')
+
+        # another process writes the item, the same payload is written again and wins
+        Item.objects.update(brand='Elsewhere')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, data, format='json')
+        self.assertEqual(Item.objects.get().brand, 'Brand')
+
+        Item.objects.update(brand='Elsewhere')
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, [data, {'item': {'code': '6'}, 'amount': 2}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Item.objects.get(code='5').brand, 'Brand')
+        self.assertFalse([query for query in queries if '"product_feed_item"."code" IN (\'5\'' in query['sql']])
+        self.assertEqual(Change.objects.filter(model=Change.ITEM, action=Change.UPDATED).count(), 2)
+
+        # a cached item deleted in the meantime is created again
+        Item.objects.filter(code='5').delete()
+        item_cache.set(('5', 'gtin'), Item.objects.get(code='6').pk + 100)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, [data], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(item_cache.get(('5', 'gtin')), Item.objects.get(code='5').pk)
+
+    def test_rollback_does_not_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    save_item({'code': '6', 'type': None})
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertIsNone(item_cache.get(('6', None)))
+        self.assertEqual(item_cache.stats()['misses'], 2)
+
+
+class GraphQLPersistedQueryTest(APITestCase):
+    url = reverse('graphql')
+    query = '{ products { id amount } }'
+
+    def setUp(self):
+        document_cache.clear()
+        Product.objects.create(item=Item.objects.create(code=1), amount=4)
+
+    def post(self, data):
+        return self.client.post(self.url, data, format='json', HTTP_ACCEPT='application/json')
+
+    def test_persisted_query(self):
+        sha256 = hashlib.sha256(self.query.encode()).hexdigest()
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': sha256}}
+
+        response = self.post({'extensions': extensions})
+        self.assertEqual(response.json()['errors'][0]['message'], 'PersistedQueryNotFound')
+
+        # register the query with its hash
+        response = self.post({'query': self.query, 'extensions': extensions})
+        self.assertEqual(response.json()['data'], {'products': [{'id': str(Product.objects.get().id), 'amount': 4}]})
+        self.assertTrue(PersistedQuery.objects.filter(sha256=sha256).exists())
+
+        # the hash alone is enough, the document comes from the cache and only the products query runs
+        with self.assertNumQueries(1):
+            response = self.post({'extensions': extensions})
+        self.assertEqual(response.json()['data']['products'][0]['amount'], 4)
+
+        # another process without the cached document loads the persisted query
+        document_cache.clear()
+        response = self.client.get(self.url, {'extensions': json.dumps(extensions)}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['data']['products'][0]['amount'], 4)
+
+        response = self.post({'query': '{ products { id } }', 'extensions': extensions})
+        self.assertIn('does not match', response.json()['errors'][0]['message'])
+
+    def test_document_cache(self):
+        self.post({'query': self.query})
+        self.post({'query': self.query})
+        self.assertEqual(document_cache.stats()['hits'], 1)
+        self.assertEqual(document_cache.stats()['size'], 1)
+
+    @override_settings(GRAPHQL_MAX_DEPTH=1)
+    def test_depth_limit(self):
+        response = self.post({'query': '{ products { id } }'})
+        self.assertIn('Query depth 2 exceeds', response.json()['errors'][0]['message'])
+
+    @override_settings(GRAPHQL_MAX_COST=20)
+    def test_cost_limit(self):
+        # the list of products multiplies the cost of its fields
+        response = self.post({'query': '{ products { id amount comment } }'})
+        self.assertIn('Query cost 31 exceeds', response.json()['errors'][0]['message'])
+
+        # a query over the limits is not registered as a persisted query, nor is an invalid one
+        for query in ('{ products { id amount comment } }', '{ products { unknown } }'):
+            extensions = {'persistedQuery': {'version': 1, 'sha256Hash': hashlib.sha256(query.encode()).hexdigest()}}
+            response = self.post({'query': query, 'extensions': extensions})
+            self.assertIn('errors', response.json())
+        self.assertFalse(PersistedQuery.objects.exists())
+        response = self.post({'query': '{ product(id: %d) { id amount comment } }' % Product.objects.get().id})
+        self.assertNotIn('errors', response.json())
+
+
+class CachedSchemaViewTest(APITestCase):
+    url = reverse('api_docs')
+
+    def setUp(self):
+        get_schema.cache_clear()
+        self.addCleanup(get_schema.cache_clear)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'api_schema.json')
+
+    def test_serves_artifact(self):
+        with override_settings(API_SCHEMA_PATH=self.path):
+            call_command('build_api_schema', stdout=open(os.devnull, 'w'))
+            with open(self.path) as artifact:
+                schema = json.load(artifact)
+            self.assertIn('/api/product/', schema['paths'])
+
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(json.loads(response.content), schema)
+            self.assertIn('max-age', response.headers['Cache-Control'])
+
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response.headers['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_stale_artifact_is_regenerated(self):
+        with open(self.path, 'w') as artifact:
+            json.dump({'swagger': '2.0', 'paths': {}, 'x-source-fingerprint': 'stale'}, artifact)
+        with override_settings(API_SCHEMA_PATH=self.path):
+            response = self.client.get(self.url)
+        self.assertIn('/api/product/', json.loads(response.content)['paths'])
+
+        response = self.client.get(self.url, HTTP_ACCEPT='text/html')
+        self.assertContains(response, 'window.drsSpec')
+
+    def test_source_paths(self):
+        # every module of the package the views and serializers are spread over is fingerprinted
+        names = {os.path.relpath(path, settings.BASE_DIR) for path in source_paths()}
+        self.assertTrue({'productFeed/urls.py', 'product_feed/views.py', 'product_feed/fieldsets.py',
+                         'product_feed/snapshot_view.py', 'product_feed/management/commands/build_api_schema.py'}
+                        <= names)
+
+
+class StartupBenchmarkTest(APITestCase):
+
+    def test_rest_role_skips_optional_stacks(self):
+        output = io.StringIO()
+        call_command('benchmark_startup', roles=['rest', 'all'], repeat=1, json=True, stdout=output)
+        results = json.loads(output.getvalue())
+        self.assertEqual(results['rest']['heavy_stacks'], [])
+        self.assertIn('rest_framework_swagger', results['all']['heavy_stacks'])
+        self.assertGreater(results['rest']['rss_kb'], 0)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+class ReplicaRoutingTest(APITestCase):
+    # the second local database stands in for a read replica which has not caught up with the primary
+    databases = {'default', 'replica_0'}
+    url = reverse('products_list')
+
+    def setUp(self):
+        item = Item.objects.using('replica_0').create(code='1')
+        Product.objects.using('replica_0').create(item=item, amount=5)
+
+    def test_reads_go_to_replica(self):
+        response = self.client.get(self.url)
+        self.assertEqual([product['amount'] for product in response.data.get('results')], [5])
+
+        response = self.client.get(f"{self.url}1")
+        self.assertEqual(len(response.data.get('results')), 1)
+
+        response = self.client.post(reverse('products_lookup'), {'codes': ['1']}, format='json')
+        self.assertEqual(len(response.data.get('results')['1']), 1)
+        self.assertNotIn(settings.PRIMARY_PIN_COOKIE, response.cookies)
+
+        response = self.client.post(reverse('graphql'), {'query': '{ products { amount } }'}, format='json',
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['data']['products'], [{'amount': 5}])
+
+    def test_read_your_writes(self):
+        response = self.client.post(self.url, {'item': {'code': '2'}, 'amount': 7}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn(settings.PRIMARY_PIN_COOKIE, response.cookies)
+
+        # the write went to the primary only
+        self.assertTrue(Product.objects.using('default').filter(amount=7).exists())
+        self.assertFalse(Product.objects.using('replica_0').filter(amount=7).exists())
+
+        # the writing client is pinned to the primary and reads its own write
+        response = self.client.get(self.url)
+        self.assertEqual([product['amount'] for product in response.data.get('results')], [7])
+
+        # once the pin has expired the client reads from the replica again
+        self.client.cookies.clear()
+        response = self.client.get(self.url)
+        self.assertEqual([product['amount'] for product in response.data.get('results')], [5])
+
+
+class ProfiledViewTest(APITestCase):
+    url = reverse('products_list')
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        Product.objects.create(item=Item.objects.create(code=1), amount=1)
+
+    def test_admin_profiles_a_request(self):
+        from django.contrib.auth.models import User
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        with override_settings(PROFILING_OUTPUT_DIR=self.output_dir):
+            response = self.client.get(self.url, {'profile': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile_id = response['X-Profile-Id']
+        self.assertEqual(sorted(os.listdir(self.output_dir)),
+                         [f'{profile_id}.collapsed', f'{profile_id}.prof', f'{profile_id}.sql.json'])
+        with open(os.path.join(self.output_dir, f'{profile_id}.sql.json')) as sql_file:
+            self.assertTrue(any('product_feed_product' in query['sql'] for query in json.load(sql_file)['queries']))
+
+    def test_profile_header_is_ignored_for_other_users(self):
+        with override_settings(PROFILING_OUTPUT_DIR=self.output_dir):
+            response = self.client.get(self.url, HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(self.output_dir), [])
+
+    def test_sampled_request_is_profiled(self):
+        with override_settings(PROFILING_OUTPUT_DIR=self.output_dir, PROFILING_SAMPLE_RATE=1.0):
+            response = self.client.post(reverse('product_list_upload'), [], format='json')
+        self.assertIn('X-Profile-Id', response)
+
+
+class LoadTestCommandTest(LiveServerTestCase):
+
+    def test_reports_every_endpoint_and_compares_with_baseline(self):
+        report_path = os.path.join(tempfile.mkdtemp(), 'report.json')
+        call_command('loadtest', url=self.live_server_url, rate=20, duration=1, feed_size=2, seed_products=3,
+                     output=report_path, stdout=io.StringIO())
+        with open(report_path) as report_file:
+            endpoints = json.load(report_file)['endpoints']
+        self.assertEqual(sum(endpoint['requests'] for endpoint in endpoints.values()), 20)
+        for endpoint in endpoints.values():
+            self.assertEqual(endpoint['error_rate'], 0, endpoint)
+            self.assertLessEqual(endpoint['p50_ms'], endpoint['p95_ms'])
+
+        baseline = {name: dict(endpoint, p95_ms=endpoint['p95_ms'] / 10) for name, endpoint in endpoints.items()}
+        self.assertTrue(compare(endpoints, baseline, 0.2))
+        self.assertEqual(compare(endpoints, endpoints, 0.2), [])
+
+
+class FeedDryRunTest(APITestCase):
+    url = reverse('product_list_upload')
+
+    def setUp(self):
+        with open(os.path.join(settings.BASE_DIR, 'products.json')) as feed_file:
+            self.feed = json.load(feed_file)
+        self.feed['amounts'][1]['amount'] = 'many'
+        self.feed['amounts'][4]['item']['code'] = 'not a code'
+        del self.feed['amounts'][7]['item']
+
+    def assert_dry_run(self):
+        with self.assertNumQueries(0):
+            response = self.client.post(f'{self.url}?dry_run=1', self.feed, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['rows'], len(self.feed['amounts']))
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 4, 7])
+        self.assertIn('amount', response.data['errors'][0]['errors'])
+        self.assertIn('item', response.data['errors'][2]['errors'])
+        self.assertFalse(Product.objects.exists())
+
+    def test_dry_run_reports_row_errors_without_writing(self):
+        self.assert_dry_run()
+
+    @override_settings(FEED_VALIDATION_CHUNK_SIZE=4, FEED_VALIDATION_WORKERS=2)
+    def test_dry_run_validates_chunks_in_process_pool(self):
+        self.assert_dry_run()
+
+    def test_valid_feed(self):
+        self.feed['amounts'] = self.feed['amounts'][:1]
+        response = self.client.post(f'{self.url}?dry_run=true', self.feed, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['valid'])
+        self.assertEqual(response.data['errors'], [])
+
+
+class PartialFeedIngestionTest(APITestCase):
+    url = reverse('product_list_upload')
+
+    def setUp(self):
+        with open(os.path.join(settings.BASE_DIR, 'products.json')) as feed_file:
+            self.feed = json.load(feed_file)
+        self.feed['amounts'] = self.feed['amounts'][:5]
+        self.feed['amounts'][1]['item']['code'] = 'not a code'
+        self.feed['amounts'][3]['amount'] = 'many'
+
+    @override_settings(FEED_INGEST_CHUNK_SIZE=2)
+    def test_valid_rows_are_kept_and_rejects_reported(self):
+        response = self.client.post(f'{self.url}?partial=1', self.feed, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual((response.data['rows'], response.data['created'], response.data['rejected']), (5, 3, 2))
+        self.assertEqual(Product.objects.filter(product_feed=response.data['feed']).count(), 3)
+
+        report = self.client.get(response.data['rejects'])
+        self.assertEqual(report.status_code, status.HTTP_200_OK)
+        rejects = report.data['results']
+        self.assertEqual([reject['index'] for reject in rejects], [1, 3])
+        self.assertIn('amount', rejects[1]['errors'])
+
+        # resubmit only the corrected rejects
+        amounts = [reject['data'] for reject in rejects]
+        amounts[0]['item']['code'] = '4000000000001'
+        amounts[1]['amount'] = 1
+        response = self.client.post(f'{self.url}?partial=1', dict(self.feed, amounts=amounts), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Product.objects.count(), 5)
+
+    def test_database_error_rejects_only_its_row(self):
+        self.feed['amounts'][1]['item']['code'] = '4000000000001'
+        # passes the validation but postgres rejects the null character in jsonb
+        self.feed['amounts'][3]['item']['net_weight'] = {'value': '\u0000'}
+        response = self.client.post(f'{self.url}?partial=1', self.feed, format='json')
+        self.assertEqual(response.data['rejected'], 1)
+        self.assertEqual(Product.objects.count(), 4)
+        self.assertEqual(self.client.get(response.data['rejects']).data['results'][0]['index'], 3)
+
+    def test_invalid_feed_fields_write_nothing(self):
+        del self.feed['supplier_id']
+        response = self.client.post(f'{self.url}?partial=1', self.feed, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Product.objects.exists())
+
+    def test_unknown_feed(self):
+        response = self.client.get(reverse('feed_rejects', args=[0]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class DictionaryEncodedAttributeTest(APITestCase):
+
+    def test_attributes_are_stored_as_codes(self):
+        item = Item.objects.create(code='1', type='gtin', trade_item_unit_descriptor='CASE', brand='Alsan-S')
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT type, trade_item_unit_descriptor, brand FROM product_feed_item WHERE id = %s',
+                           [item.pk])
+            self.assertEqual([type(value) for value in cursor.fetchone()], [int, int, str])
+
+        item.refresh_from_db()
+        self.assertEqual((item.type, item.trade_item_unit_descriptor, item.brand), ('gtin', 'CASE', 'Alsan-S'))
+        self.assertEqual(Item.objects.get(type='gtin', code='1'), item)
+        self.assertEqual(Item.objects.filter(type__in=['ean', 'gtin']).get(), item)
+        self.assertFalse(Item.objects.filter(type='never seen').exists())
+        self.assertFalse(AttributeValue.objects.filter(attribute='type', value='never seen').exists())
+
+        # the bulk update encodes every value of its CASE expression
+        other = Item.objects.create(code='2', type='gtin')
+        item.packaging, other.packaging = 'CT', 'BX'
+        Item.objects.bulk_update([item, other], fields=['packaging'])
+        self.assertEqual(dict(Item.objects.values_list('code', 'packaging')), {'1': 'CT', '2': 'BX'})
+
+        # the other lookups of a CharField would compare the codes
+        for lookup in ('icontains', 'startswith', 'gt', 'lower__exact'):
+            with self.assertRaisesMessage(FieldError, 'dictionary encoded field type'):
+                Item.objects.filter(**{f'type__{lookup}': 'gt'}).exists()
+
+    def test_new_values_share_one_connection(self):
+        Item.objects.create(code='1', unit_name='g')
+        insert_connection = dictionary.insert_connection(connection.alias)
+        Item.objects.create(code='2', unit_name='kg', packaging='BT')
+        self.assertIs(dictionary.insert_connection(connection.alias), insert_connection)
+
+        # a miss reads the missing entry only, not the whole dictionary
+        dictionaries['unit_name'].clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(Item.objects.get(code='2').unit_name, 'kg')
+        self.assertEqual(len(queries), 2)
+        self.assertIn("attribute = 'unit_name' AND code = ", queries[1]['sql'])
+
+    def test_api_output_is_unchanged(self):
+        with open(os.path.join(settings.BASE_DIR, 'products.json')) as feed_file:
+            feed = json.load(feed_file)
+        feed['amounts'] = feed['amounts'][:3]
+        self.client.post(reverse('product_list_upload'), feed, format='json')
+
+        results = self.client.get(reverse('products_list')).data['results']
+        for amount, result in zip(feed['amounts'], results):
+            for attribute in ('brand', 'type', 'packaging', 'trade_item_unit_descriptor',
+                              'trade_item_unit_descriptor_name', 'unit_name', 'validation_status'):
+                self.assertEqual(result['item'][attribute], amount['item'][attribute])
+
+    def test_benchmark(self):
+        output = io.StringIO()
+        call_command('benchmark_dictionary_encoding', rows=20000, repeat=1, json=True, stdout=output)
+        layouts = json.loads(output.getvalue())['layouts']
+        self.assertLess(layouts['encoded']['heap_bytes'], layouts['varchar']['heap_bytes'])
+
+
+class SparseFieldsetTest(APITestCase):
+    url = reverse('products_list')
+
+    def setUp(self):
+        item = Item.objects.create(code='7', type='gtin', description='Walnuts', net_weight={'value': 500})
+        item.related_products.create(gtin='99', trade_item_unit_descriptor='CASE')
+        self.product = Product.objects.create(item=item, amount=3, comment='a long comment')
+
+    def test_fields_prune_payload_and_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'fields': 'id,amount,bbd,item.code,item.description'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'id': self.product.pk, 'amount': 3, 'bbd': None, 'item': {'code': '7', 'description': 'Walnuts'}}])
+        page_query = next(query['sql'] for query in queries if 'INNER JOIN "product_feed_item"' in query['sql']
+                          and 'COUNT' not in query['sql'])
+        self.assertNotIn('net_weight', page_query)
+        self.assertNotIn('comment', page_query)
+        self.assertFalse(any('product_feed_relatedproduct' in query['sql'] for query in queries))
+
+    def test_nested_object_as_primary_key_or_expanded(self):
+        response = self.client.get(self.url, {'fields': 'id,item'})
+        self.assertEqual(response.data['results'][0]['item'], self.product.item_id)
+
+        response = self.client.get(self.url, {'fields': 'item.code,item.related_products'})
+        related_product = self.product.item.related_products.get()
+        self.assertEqual(response.data['results'][0]['item'], {'code': '7', 'related_products': [related_product.pk]})
+
+        response = self.client.get(self.url, {'fields': 'item.code', 'expand': 'item.related_products'})
+        self.assertEqual(response.data['results'][0]['item']['related_products'],
+                         [{'gtin': '99', 'trade_item_unit_descriptor': 'CASE'}])
+
+    def test_detail_and_full_representation(self):
+        response = self.client.get(f'{self.url}7', {'fields': 'amount'})
+        self.assertEqual(response.data['results'], [{'amount': 3}])
+
+        # without a fieldset the representation is unchanged and the relations are loaded with the page
+        with override_settings(PRODUCT_DOCUMENTS=False), self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['results'], ProductSerializer([self.product], many=True).data)
+
+    def test_unknown_field(self):
+        response = self.client.get(self.url, {'fields': 'id,item.colour'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProductDocumentTest(APITestCase):
+    url = reverse('products_list')
+
+    def setUp(self):
+        self.client.post(self.url, [
+            {'item': {'code': '7', 'type': 'gtin', 'brand': 'Nuts',
+                      'related_products': [{'gtin': '99', 'trade_item_unit_descriptor': 'CASE'}]}, 'amount': 1},
+            {'item': {'code': '7', 'type': 'gtin'}, 'amount': 2},
+        ], format='json')
+
+    def expected(self, products):
+        return json.loads(json.dumps(ProductSerializer(products, many=True).data))
+
+    def test_documents_are_refreshed_by_ingestion(self):
+        self.assertEqual(ProductDocument.objects.count(), 2)
+        self.assertEqual(ItemDocument.objects.count(), 1)
+
+        # a related product linked by a later write shows in the documents of the item's earlier products
+        self.client.post(self.url, {'item': {'code': '7', 'type': 'gtin', 'related_products': [
+            {'gtin': '98', 'trade_item_unit_descriptor': 'EACH'}]}, 'amount': 3}, format='json')
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['results'], self.expected(Product.objects.order_by('id')))
+        self.assertEqual(len(response.data['results'][0]['item']['related_products']), 2)
+
+    def test_page_is_served_from_documents(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+            detail = self.client.get(f'{self.url}7')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(response.data['results'], self.expected(Product.objects.order_by('id')))
+        self.assertEqual(detail.data['results'], self.expected(Product.objects.order_by('id')))
+        # the product and item tables are read for the ids only
+        self.assertFalse(any('"product_feed_item"."brand"' in query['sql'] for query in queries))
+
+        # a product without a document is rendered with the serializer
+        product = Product.objects.create(item=Item.objects.get(), amount=4)
+        response = self.client.get(f'{self.url}7')
+        self.assertEqual(response.data['results'][-1], self.expected([product])[0])
+
+    def test_rebuild_and_check(self):
+        Product.objects.create(item=Item.objects.get(), amount=4)
+        ItemDocument.objects.update(document='{}')
+        with self.assertRaisesMessage(CommandError, '1 missing and 1 stale'):
+            call_command('check_documents', stdout=io.StringIO())
+
+        call_command('rebuild_documents', batch_size=1, stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('check_documents', stdout=out)
+        self.assertIn('0 missing and 0 stale', out.getvalue())
+        self.assertEqual(ProductDocument.objects.count(), 3)
+
+
+class IngestionCoordinatorTest(TransactionTestCase):
+    url = reverse('product_list_upload')
+
+    def feed(self, supplier_id):
+        with open(settings.BASE_DIR / 'products.json') as products_file:
+            feed = json.load(products_file)
+        return dict(feed, supplier_id=supplier_id, amounts=feed['amounts'][:2])
+
+    def test_feeds_of_a_supplier_queue(self):
+        # another session ingests a feed of supplier a
+        session = connections.create_connection('default')
+        with session.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s, %s)', [SUPPLIER_LOCK, supplier_key('a')])
+
+        responses = {}
+
+        def upload(supplier_id, query=''):
+            responses[supplier_id] = APIClient().post(self.url + query, self.feed(supplier_id), format='json')
+            connection.close()
+
+        queued = threading.Thread(target=upload, args=('a', '?partial=1'))
+        parallel = threading.Thread(target=upload, args=('b',))
+        queued.start()
+        parallel.start()
+        parallel.join(10)
+        self.assertEqual(responses['b'].status_code, status.HTTP_201_CREATED)
+        self.assertTrue(queued.is_alive())
+
+        session.close()
+        queued.join(10)
+        self.assertEqual(responses['a'].status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Product.objects.count(), 4)
+        self.assertRegex(responses['a']['Server-Timing'], r'items-lock;dur=[0-9.]+, supplier-lock;dur=[0-9.]+')
+        self.assertGreater(float(responses['a']['Server-Timing'].rsplit('dur=', 1)[1]), 0)
+
+    def test_item_ranges(self):
+        self.assertEqual(item_range_key('4000000000001'), item_range_key('4000000009999'))
+        self.assertNotEqual(item_range_key('4000000000001'), item_range_key('4100000000001'))
+
+
+class ScalableAdminTest(APITestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.client.post(reverse('products_list'), [
+            {'item': {'code': str(code), 'type': 'gtin', 'validation_status': 'unvalidated'}, 'amount': code}
+            for code in range(1, 6)
+        ], format='json')
+
+    def test_changelists(self):
+        for model in ('feed', 'product', 'item', 'relatedproduct'):
+            with self.subTest(model=model):
+                response = self.client.get(reverse(f'admin:product_feed_{model}_changelist'))
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertNotIn('delete_selected"', response.content.decode())
+
+        # the items are joined and the changelist is counted once
+        url = reverse('admin:product_feed_product_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        Product.objects.create(item=Item.objects.first(), amount=6)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(url)
+        self.assertContains(response, '6 products')
+
+        # the code is searched like it is stored
+        response = self.client.get(url, {'q': '0003'})
+        self.assertEqual([product.amount for product in response.context['cl'].result_list], [3])
+
+        response = self.client.get(reverse('admin:product_feed_item_changelist'), {'validation_status': 'validated'})
+        self.assertEqual(response.context['cl'].result_count, 0)
+
+    def test_estimated_count(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE product_feed_product')
+        with override_settings(ADMIN_EXACT_COUNT_THRESHOLD=0), self.assertNumQueries(1):
+            self.assertEqual(EstimatedCountPaginator(Product.objects.order_by('pk'), 10).count, 5)
+        with override_settings(ADMIN_EXACT_COUNT_THRESHOLD=0):
+            self.assertGreaterEqual(EstimatedCountPaginator(Product.objects.filter(amount__gt=3).order_by('pk'), 10).count, 1)
+        self.assertEqual(EstimatedCountPaginator(Product.objects.filter(amount__gt=3).order_by('pk'), 10).count, 2)
+
+    def test_set_based_actions(self):
+        items = Item.objects.order_by('code')[:2]
+        changes = Change.objects.count()
+        with override_settings(ADMIN_ACTION_CHUNK_SIZE=1):
+            response = self.client.post(reverse('admin:product_feed_item_changelist'), {
+                'action': 'mark_validated', '_selected_action': [item.pk for item in items]})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(Item.objects.filter(validation_status='validated').count(), 2)
+        self.assertEqual(Change.objects.count(), changes + 2)
+        self.assertIn('"validation_status":"validated"', ItemDocument.objects.get(pk=items[0].pk).document)
+
+        products = Product.objects.filter(item__in=items)
+        response = self.client.post(reverse('admin:product_feed_product_changelist'), {
+            'action': 'delete_selected_set', '_selected_action': [product.pk for product in products]})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(Product.objects.count(), 3)
+        self.assertEqual(ProductDocument.objects.count(), 3)
+
+
+class CatalogSnapshotCommitOrderTest(TransactionTestCase):
+
+    def snapshot(self, **params):
+        response = self.client.get(reverse('snapshot', args=['arrow']), params)
+        table = pa.ipc.open_stream(io.BytesIO(b''.join(response.streaming_content))).read_all()
+        return response['X-Change-Token'], table.column('product_amount').to_pylist()
+
+    def test_incremental_snapshot_after_concurrent_writes(self):
+        recorded, commit = threading.Event(), threading.Event()
+
+        def write(amount, wait=False):
+            with transaction.atomic():
+                product = Product.objects.create(item=Item.objects.create(code=str(amount)), amount=amount)
+                record_changes([Change(model=Change.PRODUCT, object_id=product.pk, action=Change.CREATED)])
+                if wait:
+                    recorded.set()
+                    commit.wait(10)
+            connection.close()
+
+        slow = threading.Thread(target=write, args=(1, True))
+        slow.start()
+        recorded.wait(10)
+        fast = threading.Thread(target=write, args=(2,))
+        fast.start()
+        fast.join(0.5)
+
+        # neither write is committed, the later one waits for the token order of the earlier one
+        token, amounts = self.snapshot()
+        self.assertEqual((token, amounts), ('0', []))
+
+        commit.set()
+        slow.join(10)
+        fast.join(10)
+        self.assertEqual(self.snapshot(since=token)[1], [1, 2])
+
+
+class CatalogSnapshotTest(APITestCase):
+
+    def setUp(self):
+        self.client.post(reverse('products_list'), [
+            {'item': {'code': str(code), 'type': 'gtin', 'brand': 'Nuts', 'category_id': 'snacks',
+                      'related_products': [{'gtin': '99', 'trade_item_unit_descriptor': 'CASE'}]}, 'amount': code}
+            for code in range(1, 4)
+        ], format='json')
+
+    def snapshot(self, file_format, **params):
+        response = self.client.get(reverse('snapshot', args=[file_format]), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = io.BytesIO(b''.join(response.streaming_content))
+        if file_format == 'parquet':
+            return response, pq.read_table(content)
+        return response, pa.ipc.open_stream(content).read_all()
+
+    def test_full_and_incremental_snapshots(self):
+        response, table = self.snapshot('parquet')
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(table.column('product_amount').to_pylist(), [1, 2, 3])
+        self.assertEqual(table.column('item_code').to_pylist(), ['1', '2', '3'])
+        self.assertEqual(table.schema.field('item_type').type, pa.dictionary(pa.int32(), pa.string()))
+        self.assertEqual(table.column('item_type').to_pylist(), ['gtin'] * 3)
+        self.assertEqual(table.column('item_category_id').to_pylist(), ['snacks'] * 3)
+        self.assertEqual(table.column('item_related_products').to_pylist()[0],
+                         [{'gtin': '99', 'trade_item_unit_descriptor': 'CASE'}])
+        token = table.schema.metadata[b'change_token'].decode()
+        self.assertEqual(response['X-Change-Token'], token)
+
+        Product.objects.filter(amount=2).update(amount=4)
+        self.client.post(reverse('products_list'), {'item': {'code': '1', 'type': 'gtin'}, 'amount': 5}, format='json')
+        response, table = self.snapshot('arrow', since=token)
+        # the new product and the earlier product of its item
+        self.assertEqual(table.column('product_amount').to_pylist(), [1, 5])
+        self.assertEqual(table.schema.metadata[b'since'].decode(), token)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get(reverse('snapshot', args=['csv'])).status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('snapshot', args=['arrow']), {'since': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            full = os.path.join(directory, 'catalog.parquet')
+            call_command('export_snapshot', full, batch_size=2, stdout=io.StringIO())
+            self.assertEqual(pq.ParquetFile(full).metadata.num_row_groups, 2)
+            self.assertEqual(pq.read_table(full).num_rows, 3)
+
+            incremental = os.path.join(directory, 'changes.arrow')
+            call_command('export_snapshot', incremental, since_snapshot=full, stdout=io.StringIO())
+            with pa.OSFile(incremental) as source:
+                self.assertEqual(pa.ipc.open_stream(source).read_all().num_rows, 0)
+            self.assertFalse(os.path.exists(f'{incremental}.partial'))
+
+
+@override_settings(FEED_ADMISSION_MAX_INGESTIONS=1)
+class FeedAdmissionTest(TransactionTestCase):
+    client_class = APIClient
+    url = reverse('product_list_upload')
+
+    def setUp(self):
+        # the items of the flushed tables must not be found in the identity cache
+        item_cache.clear()
+        self.addCleanup(item_cache.clear)
+
+    def feed(self, supplier_id):
+        with open(settings.BASE_DIR / 'products.json') as products_file:
+            feed = json.load(products_file)
+        return dict(feed, supplier_id=supplier_id, amounts=feed['amounts'][:2])
+
+    def hold_ticket(self, supplier_id, rows=1):
+        # the ticket of an ingestion in another worker
+        session = connections.create_connection('default')
+        with session.cursor() as cursor:
+            cursor.execute('INSERT INTO product_feed_ingestionticket (supplier_id, rows, created_at) '
+                           'VALUES (%s, %s, now()) RETURNING id', [supplier_id, rows])
+            cursor.execute('SELECT pg_advisory_lock(%s)', [cursor.fetchone()[0]])
+        self.addCleanup(session.close)
+        return session
+
+    def assert_refused(self, feed):
+        with self.assertLogs('product_feed.admission', 'WARNING') as logs:
+            response = self.client.post(self.url, feed, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], str(settings.FEED_ADMISSION_RETRY_AFTER))
+        self.assertIn('Refused a feed upload', logs.output[0])
+
+    def test_refused_at_capacity(self):
+        session = self.hold_ticket('a')
+        self.assert_refused(self.feed('b'))
+        self.assertEqual(Feed.objects.count(), 0)
+        self.assertEqual(IngestionTicket.objects.count(), 1)
+
+        # the ticket of a worker which died is released
+        session.close()
+        with self.assertLogs('product_feed.admission', 'WARNING') as logs:
+            response = self.client.post(self.url, self.feed('b'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(logs.output, ['WARNING:product_feed.admission:Deleted 1 ingestion tickets of ended sessions'])
+        self.assertEqual(IngestionTicket.objects.count(), 0)
+
+    @override_settings(FEED_ADMISSION_MAX_INGESTIONS=3, FEED_ADMISSION_SUPPLIER_MAX_INGESTIONS=1)
+    def test_supplier_limits(self):
+        self.hold_ticket('a')
+        # the upload is refused right away, it does not wait for the ingestion of its supplier
+        start = time.perf_counter()
+        self.assert_refused(self.feed('a'))
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(self.client.post(self.url, self.feed('b'), format='json').status_code,
+                         status.HTTP_201_CREATED)
+
+    @override_settings(FEED_ADMISSION_MAX_INGESTIONS=3, FEED_ADMISSION_MAX_ROWS=3)
+    def test_rows_in_flight(self):
+        self.hold_ticket('a', rows=2)
+        self.assert_refused(self.feed('b'))
+        self.assertEqual(self.client.post(self.url, dict(self.feed('b'), amounts=self.feed('b')['amounts'][:1]),
+                                          format='json').status_code, status.HTTP_201_CREATED)
+
+
+def wait_for_code_index_rebuild():
+    thread = code_index_rebuilder.thread
+    if thread is not None:
+        thread.join(10)
+
+
+class CodeIndexTest(APITestCase):
+    url = reverse('products_list')
+
+    def setUp(self):
+        # the commit callbacks executed by the test publish the items of the rolled back writes to the identity cache
+        item_cache.clear()
+        self.addCleanup(item_cache.clear)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'product_code.index')
+        settings_override = override_settings(PRODUCT_CODE_INDEX_PATH=self.path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.post([
+            {'item': {'code': '7', 'type': 'gtin', 'brand': 'Nuts',
+                      'related_products': [{'gtin': '99', 'trade_item_unit_descriptor': 'CASE'}]}, 'amount': 1},
+            {'item': {'code': '7', 'type': 'gtin'}, 'amount': 2},
+            {'item': {'code': '8', 'type': 'gtin'}, 'amount': 3},
+        ])
+
+    def post(self, data):
+        # the rebuild scheduled by the write runs on a connection of its own, which does not see the test's writes
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, data, format='json')
+        wait_for_code_index_rebuild()
+
+    def test_detail_is_served_from_the_index(self):
+        with override_settings(PRODUCT_CODE_INDEX_PATH=''):
+            expected = self.client.get(f'{self.url}7')
+        out = io.StringIO()
+        call_command('build_code_index', stdout=out)
+        self.assertIn('with 2 codes', out.getvalue())
+
+        # only the newest change token and the latest deletion are read
+        with self.assertNumQueries(2):
+            response = self.client.get(f'{self.url}7')
+            unknown = self.client.get(f'{self.url}9')
+        self.assertEqual(response.data, expected.data)
+        self.assertEqual(response['ETag'], expected['ETag'])
+        self.assertEqual(response['Last-Modified'], expected['Last-Modified'])
+        self.assertEqual(unknown.data['count'], 0)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(f'{self.url}7', HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+                             status.HTTP_304_NOT_MODIFIED)
+
+    def test_stale_index_falls_back_to_the_database(self):
+        self.assertEqual(self.client.get(f'{self.url}7').data['count'], 2)
+        self.assertEqual(rebuild_code_index(), 2)
+        self.assertIsNone(rebuild_code_index())
+
+        self.post({'item': {'code': '7', 'type': 'gtin'}, 'amount': 4})
+        self.assertFalse(code_index.is_fresh(latest_change_token()))
+        self.assertEqual(self.client.get(f'{self.url}7').data['count'], 3)
+
+        # only the entry of the written code is read again
+        with self.assertLogs('product_feed.documents', 'INFO') as logs:
+            self.assertEqual(rebuild_code_index(), 2)
+        self.assertIn('Updated 1 of the 2 codes', logs.output[0])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(f'{self.url}7').data['count'], 3)
+        with override_settings(PRODUCT_CODE_INDEX_PATH=''):
+            expected = self.client.get(f'{self.url}7')
+        self.assertEqual(self.client.get(f'{self.url}7').data, expected.data)
+
+    def test_moved_product_rebuilds_the_whole_index(self):
+        rebuild_code_index()
+        product = Product.objects.get(amount=3)
+        product.item = Item.objects.get(code='7')
+        product.save()
+        record_changes([Change(model=Change.PRODUCT, object_id=product.pk, action=Change.UPDATED)])
+
+        with self.assertLogs('product_feed.documents', 'INFO') as logs:
+            self.assertEqual(rebuild_code_index(), 1)
+        self.assertIn('Rebuilt the code index with 1 codes', logs.output[0])
+        self.assertEqual(len(code_index.lookup('7', latest_change_token()).documents), 3)
+        self.assertEqual(code_index.lookup('8', latest_change_token()).documents, [])
+
+
+class CodeIndexRebuildTest(TransactionTestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        item_cache.clear()
+        self.addCleanup(item_cache.clear)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PRODUCT_CODE_INDEX_PATH=os.path.join(directory.name, 'code.index'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_rebuilt_after_ingestion(self):
+        with open(settings.BASE_DIR / 'products.json') as products_file:
+            feed = json.load(products_file)
+        response = self.client.post(reverse('product_list_upload'), dict(feed, amounts=feed['amounts'][:2]),
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        wait_for_code_index_rebuild()
+        self.assertTrue(code_index.is_fresh(latest_change_token()))
+        code = Item.objects.order_by('pk').first().code
+        self.assertEqual(len(code_index.lookup(code, latest_change_token()).documents),
+                         Product.objects.filter(item__code=code).count())
+
+    def test_rebuilt_after_every_write(self):
+        url = reverse('products_list')
+        self.client.post(url, [
+            {'item': {'code': '7', 'type': 'gtin'}, 'amount': 1},
+            {'item': {'code': '8', 'type': 'gtin'}, 'amount': 2},
+        ], format='json')
+        wait_for_code_index_rebuild()
+        self.assertTrue(code_index.is_fresh(latest_change_token()))
+
+        with self.assertLogs('product_feed.documents', 'INFO') as logs:
+            self.client.post(url, {'item': {'code': '7', 'type': 'gtin'}, 'amount': 3}, format='json')
+            wait_for_code_index_rebuild()
+        self.assertIn('Updated 1 of the 2 codes', logs.output[0])
+        self.assertEqual(len(code_index.lookup('7', latest_change_token()).documents), 2)
+
+        # a deletion in the admin rebuilds the whole index
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        with self.assertLogs('product_feed.documents', 'INFO') as logs:
+            self.client.post(reverse('admin:product_feed_item_changelist'), {
+                'action': 'delete_selected_set', '_selected_action': [Item.objects.get(code='8').pk]})
+            wait_for_code_index_rebuild()
+        self.assertIn('Rebuilt the code index with 1 codes', logs.output[0])
+        self.assertTrue(code_index.is_fresh(latest_change_token()))
+        self.assertEqual(code_index.lookup('8', latest_change_token()).documents, [])
@@ -1,16 +1,29 @@
+from django.conf import settings
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
-from .views import ProductView, FeedUploadView, ProductDetailView
-from graphene_django.views import GraphQLView
-from .schema import schema
+from .lazy import lazy_view
+from .views import ProductView, FeedUploadView, ProductDetailView, ChangeFeedView, ProductLookupView, \
+    FeedRejectsView
 
 urlpatterns = [
 
     path('product/', ProductView.as_view(), name='products_list'),
+    path('product/lookup', ProductLookupView.as_view(), name='products_lookup'),
     path('product/<str:code>', ProductDetailView.as_view(), name='products_detail'),
 
     path('feed/upload', FeedUploadView.as_view(), name='product_list_upload'),
+    path('feed/<int:pk>/rejects', FeedRejectsView.as_view(), name='feed_rejects'),
 
-    path('graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True, schema=schema))),
+    path('changes/', ChangeFeedView.as_view(), name='changes'),
+
+    # pyarrow is imported on the first snapshot request
+    path('snapshot.<str:file_format>', lazy_view('product_feed.snapshot_view.SnapshotView'), name='snapshot'),
 
 ]
+
+if 'graphql' in settings.OPTIONAL_STACKS:
+    # the graphene stack is imported on the first GraphQL request
+    urlpatterns.append(
+        path('graphql/', csrf_exempt(lazy_view('product_feed.graphql_view.CachedGraphQLView', graphiql=True)),
+             name='graphql'),
+    )
@@ -0,0 +1,109 @@
+import json
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+
+from .serializers import DataSerializer, ProductSerializer
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    The process pool of the feed validation, started on the first dry run and kept for the lifetime of the process.
+    The workers are started with the FEED_VALIDATION_START_METHOD, forkserver or spawn, never forked from the web
+    worker with its threads and database connections, and set up Django on their own.
+    :return: ProcessPoolExecutor
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.FEED_VALIDATION_WORKERS,
+                                        mp_context=multiprocessing.get_context(settings.FEED_VALIDATION_START_METHOD),
+                                        initializer=django.setup)
+        return _pool
+
+
+def validate_row(serializer, row):
+    """
+    Validate and normalize a product of a feed.
+    :param serializer :(ProductSerializer): the serializer every row of the feed is validated with
+    :param row :(Object): the product data
+    :return: (Object, Object) the validated data and None, or None and the errors of the row as plain data
+    """
+    try:
+        return serializer.run_validation(row), None
+    except ValidationError as exc:
+        errors = exc.detail
+    except (AttributeError, KeyError, TypeError, ValueError) as exc:
+        # the normalization of a malformed row, e.g. a code which is not a number
+        errors = {'non_field_errors': [f'Invalid product: {exc!r}']}
+    return None, json.loads(json.dumps(errors))
+
+
+def validate_rows(offset, rows):
+    """
+    Validate and normalize the products of a feed without saving them.
+    :param offset :(int): the index of the first row in the feed
+    :param rows :(list : Object): the products data
+    :return: errors : (list : Object) the index and the errors of every invalid row
+    """
+    # one serializer validates every row, its fields are built once
+    serializer = ProductSerializer()
+    errors = []
+    for index, row in enumerate(rows, offset):
+        _, row_errors = validate_row(serializer, row)
+        if row_errors is not None:
+            errors.append({'index': index, 'errors': row_errors})
+    return errors
+
+
+def validate_feed_fields(data):
+    """
+    Validate the fields of a feed apart from its products, the products are validated row by row.
+    :param data :(Object): the feed data
+    :return: (Object, Object) the validated feed fields without the products, and the errors of the feed fields
+    """
+    serializer = DataSerializer(data=dict(data, amounts=[]))
+    if serializer.is_valid():
+        validated_data, errors = serializer.validated_data, {}
+        validated_data.pop('amounts')
+    else:
+        validated_data, errors = None, dict(serializer.errors)
+    if not isinstance(data.get('amounts'), list):
+        errors['amounts'] = ['Expected a list of items.']
+    return validated_data, errors
+
+
+def validate_feed(data):
+    """
+    Validate and normalize a whole feed without writing to the database. The feed fields are validated in process, the
+    products are validated in chunks of FEED_VALIDATION_CHUNK_SIZE rows across the process pool, a feed of a single
+    chunk is validated in process.
+    :param data :(Object): the feed data
+    :return: report : (Object) the number of rows, the feed errors and the errors of every invalid row by index
+    """
+    _, feed_errors = validate_feed_fields(data)
+    amounts = data['amounts'] if isinstance(data.get('amounts'), list) else []
+
+    size = settings.FEED_VALIDATION_CHUNK_SIZE
+    if len(amounts) <= size or not settings.FEED_VALIDATION_WORKERS:
+        errors = validate_rows(0, amounts)
+    else:
+        chunks = get_pool().map(validate_rows, range(0, len(amounts), size),
+                                (amounts[offset:offset + size] for offset in range(0, len(amounts), size)))
+        errors = [error for chunk in chunks for error in chunk]
+
+    return {
+        'dry_run': True,
+        'valid': not feed_errors and not errors,
+        'rows': len(amounts),
+        'invalid_rows': len(errors),
+        'feed_errors': feed_errors,
+        'errors': errors,
+    }
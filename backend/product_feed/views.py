@@ -1,59 +1,231 @@
 # External apps
+import json
+
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import status, generics
 from rest_framework.views import APIView
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
 
 # Project app imports
-from .models import Product
-from .serializers import ProductSerializer, DataSerializer
+from .admission import admit, check_capacity, feed_size
+from .conditional import lookup_code, product_etag, product_last_modified
+from .coordination import server_timing, track_lock_waits
+from .documents import DocumentResponse, load_documents
+from .fieldsets import Fieldset
+from .ingestion import ingest_feed_partially
+from .models import Product, Item, Change, Feed, RejectedRow
+from .parsers import DecompressingJSONParser, PayloadTooLarge
+from .profiling import ProfiledViewMixin
+from .routers import replica_reads
+from .serializers import ProductSerializer, DataSerializer, ChangeSerializer, CodeLookupSerializer, \
+    RejectedRowSerializer
+from .validation import validate_feed
+
+
+class ReplicaReadMixin:
+    """
+        Routes the reads of the view's read methods to the read replicas, unless the client is pinned to the primary
+        database after a write of its own.
+    """
+    replica_methods = SAFE_METHODS
+
+    def dispatch(self, request, *args, **kwargs):
+        enabled = request.method in self.replica_methods and not getattr(request, 'primary_pinned', False)
+        with replica_reads(enabled):
+            return super().dispatch(request, *args, **kwargs)
+
+
+class SparseFieldsetViewMixin:
+    """
+        Renders the sparse fieldset asked with ?fields= and ?expand= on the read methods and loads only the columns and
+        the relations it needs, see Fieldset. Without ?fields= every field is rendered and every relation is joined or
+        prefetched.
+    """
+
+    def get_fieldset(self):
+        if not hasattr(self, '_fieldset'):
+            self._fieldset = None
+            # the schema generator introspects the view without a request
+            if self.request is not None and self.request.method in SAFE_METHODS:
+                self._fieldset = Fieldset.from_request(self.request, self.get_serializer_class())
+        return self._fieldset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fieldset'] = self.get_fieldset()
+        return context
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request is None or self.request.method not in SAFE_METHODS:
+            return queryset
+        fieldset = self.get_fieldset()
+        if fieldset is None:
+            return queryset.select_related('item').prefetch_related('item__related_products')
+        return fieldset.prune_queryset(queryset)
+
+
+class ProductDocumentMixin:
+    """
+        Serves the pages of the read methods from the stored product documents, the page is the concatenation of the
+        documents and no product is instantiated or serialized, see load_documents. The documents serve the JSON
+        renderer without a sparse fieldset when PRODUCT_DOCUMENTS is on, every other request is serialized.
+    """
+
+    def serves_documents(self):
+        return (settings.PRODUCT_DOCUMENTS and self.get_fieldset() is None
+                and self.request.accepted_renderer.format == 'json')
+
+    def document_response(self, queryset):
+        """
+        :param queryset :(QuerySet): the products of the page, in primary key order
+        :return: DocumentResponse with the page of the products as the paginator renders it
+        """
+        ids = queryset.order_by('pk').values_list('pk', flat=True)
+        page = self.paginate_queryset(ids)
+        return self.page_response(load_documents(list(ids if page is None else page), ids.db), page is not None)
+
+    def page_response(self, documents, paginated):
+        """
+        :param documents :(list : str): the documents of the page
+        :param paginated :(bool): whether the page was paginated
+        :return: DocumentResponse with the page of the products as the paginator renders it
+        """
+        results = '[%s]' % ','.join(documents)
+        if not paginated:
+            return DocumentResponse(results)
+        return DocumentResponse(
+            f'{{"count":{self.paginator.page.paginator.count},"next":{json.dumps(self.paginator.get_next_link())},'
+            f'"previous":{json.dumps(self.paginator.get_previous_link())},"results":{results}}}'
+        )
 
 
-class ProductView(generics.ListCreateAPIView):
+@method_decorator(condition(etag_func=product_etag, last_modified_func=product_last_modified), name='get')
+class ProductView(ProfiledViewMixin, ReplicaReadMixin, SparseFieldsetViewMixin, ProductDocumentMixin,
+                  generics.ListCreateAPIView):
     """
         This is the Product's Generic View for List and Create API
 
         list:
             List all of the products in the system.
                 Args:
-                    accepts only pagination params
+                    accepts pagination params
+                    fields (query param) : optional, the fields to render e.g. id,amount,bbd,item.code
+                    expand (query param) : optional, the nested objects to render in full e.g. item.related_products
                 Returns:
                     returns the products listing with pagination
                 Raises:
                      NotFound: If no more items found for the page or invalid page number provided.
+                Conditional:
+                     responds with ETag and Last-Modified, a matching If-None-Match or If-Modified-Since returns 304
+                     without running the page query.
+                Documents:
+                     without a sparse fieldset the JSON page is assembled from the stored product documents.
         create:
-            Create a new product
+            Create a new product, or many products at once if a list is posted
                 Args:
                     Product (Object) : accepts an item object minimally must and for item code must be provide
+                    or
+                    Products (list : Product Object) : the products are created with set based queries
                 Returns:
                     Product (Object ): returns the newly created product Object
+                    or
+                    results (list : Object) : the index, status and created product or errors for every element,
+                    valid elements are created even if others fail validation. The response status is 201 if all
+                    elements are created, 400 if none and 207 otherwise. The partial success only covers the
+                    validation errors, the valid elements are written in one transaction and a database error rolls
+                    back all of them.
                 Raises:
                      InvalidItem: If no item's code provided return invalid item error.
+                     PayloadTooLarge: If more than PRODUCT_BULK_CREATE_MAX_SIZE products are posted at once.
     """
 
     serializer_class = ProductSerializer
-    queryset = Product.objects.all()
+    queryset = Product.objects.order_by('id')
     pagination_class = PageNumberPagination
 
+    def create(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return super().create(request, *args, **kwargs)
 
-class ProductDetailView(generics.RetrieveAPIView):
+        if len(request.data) > settings.PRODUCT_BULK_CREATE_MAX_SIZE:
+            raise PayloadTooLarge(f'At most {settings.PRODUCT_BULK_CREATE_MAX_SIZE} products can be created at once.')
+
+        # validate every element on its own so one invalid element does not reject the whole list
+        results, valid = [None] * len(request.data), []
+        for index, element in enumerate(request.data):
+            serializer = self.get_serializer(data=element)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                results[index] = {'index': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors}
+
+        if not valid:
+            return Response(results, status=status.HTTP_400_BAD_REQUEST)
+
+        products = self.get_serializer(many=True).create([validated_data for _, validated_data in valid])
+        prefetch_related_objects(products, 'item__related_products')
+        for (index, _), product in zip(valid, products):
+            results[index] = {'index': index, 'status': status.HTTP_201_CREATED,
+                              'data': self.get_serializer(product).data}
+
+        if len(valid) < len(results):
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+        return Response(results, status=response_status)
+
+    def list(self, request, *args, **kwargs):
+        if self.serves_documents():
+            return self.document_response(Product.objects.all())
+        return super().list(request, *args, **kwargs)
+
+
+@method_decorator(condition(etag_func=product_etag, last_modified_func=product_last_modified), name='get')
+class ProductDetailView(ReplicaReadMixin, SparseFieldsetViewMixin, ProductDocumentMixin, generics.RetrieveAPIView):
     """
         This is the Product's Retrieval API which accept item's code and return the products matching item's code.
             retrieve:
                 List the products in the system with provided item's code.
                     Args:
                         code (str) : Item's code is provided on the basis of which the products extracted.
+                        fields, expand (query params) : optional sparse fieldset, as for the products listing
                     Returns:
                         products (list : Product Object): returns the products listing with pagination with provided code
+                    Conditional:
+                        responds with ETag and Last-Modified, a matching If-None-Match or If-Modified-Since returns 304
+                        without running the page query.
+                    Documents:
+                        without a sparse fieldset the JSON page is assembled from the stored product documents.
+                    Code index:
+                        while the code index is complete up to the newest change token, read with the latest
+                        deletion in one query, the documents and the conditional GET watermark of the code are read
+                        from the memory mapped index, else from the database.
 
     """
 
     serializer_class = ProductSerializer
-    queryset = Product.objects.all()
+    queryset = Product.objects.order_by('id')
     pagination_class = PageNumberPagination
 
     def retrieve(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.queryset.filter(item__code=kwargs.get("code")))
+        if self.serves_documents():
+            entry = lookup_code(request, kwargs.get('code'))
+            if entry is not None:
+                page = self.paginate_queryset(entry.documents)
+                return self.page_response(entry.documents if page is None else page, page is not None)
+            return self.document_response(Product.objects.filter(item__code=kwargs.get("code")))
+        queryset = self.filter_queryset(self.get_queryset().filter(item__code=kwargs.get("code")))
 
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -64,7 +236,39 @@ class ProductDetailView(generics.RetrieveAPIView):
         return Response(serializer.data)
 
 
-class FeedUploadView(APIView):
+class ProductLookupView(ReplicaReadMixin, APIView):
+    """
+            This endpoint looks up the products of many item's codes in one round trip.
+
+            post:
+                Args:
+                    codes (list : str) : the item's codes, with or without leading zeros, at most 1000
+                Returns:
+                    results (Object) : the products (list : Product Object) of every normalized code, an empty list for
+                    unknown codes
+                Raises:
+                    ValidationError: If no codes or a non-numeric code is provided.
+    """
+
+    allowed_methods = ['POST']
+    # the lookup only reads
+    replica_methods = ('POST',)
+
+    def post(self, request, format=None):
+        lookup = CodeLookupSerializer(data=request.data)
+        lookup.is_valid(raise_exception=True)
+        codes = lookup.validated_data['codes']
+
+        # resolve all the codes with one indexed query and prefetch the related products
+        products = Product.objects.filter(item__code__in=codes).select_related('item').prefetch_related(
+            'item__related_products').order_by('id')
+        results = {code: [] for code in codes}
+        for product in products:
+            results[product.item.code].append(ProductSerializer(product).data)
+        return Response({'results': results})
+
+
+class FeedUploadView(ProfiledViewMixin, APIView):
     """
             This endpoint created to upload or insert the data to system in the feed manner.
             You can upload the data as Json and as same format as provided in products.json file
@@ -73,14 +277,63 @@ class FeedUploadView(APIView):
                 it accepts only the json file as input and insert the products to the database.
                 Args:
                     json file (as formatted like products.json)
+                    Content-Encoding (header) : optional gzip, deflate, zstd or lz4 compression of the body
+                    X-Profile (header) : optional, profiles the upload for admin users
+                    dry_run (query param) : optional, validate and normalize the feed without writing it
+                    partial (query param) : optional, keep the valid products and reject the invalid ones
                 Returns:
                     the inserted record to the databases.
+                    or with dry_run, the number of rows, the feed errors and the errors of every invalid row with its
+                    index. The rows are validated in parallel across a process pool and no database write is made.
+                    or with partial, the feed id, the number of created and rejected rows and the URL of the reject
+                    report. The rows are committed in chunks, 207 is returned if a row was rejected.
+                    The feeds of one supplier are ingested one after another, the feeds of different suppliers in
+                    parallel. The time waited for the ingestion locks is reported in the Server-Timing header.
+                    An upload is only ingested when the ingestions in flight, across all the workers and of its
+                    supplier, leave room for it and its rows, else it is refused right away. Dry runs are not
+                    admitted. The code index is rebuilt in the background after an ingestion.
+                Raises:
+                    Throttled: 429 with Retry-After, if there is no room for the upload. When every ingestion slot is
+                    taken the upload is refused before the body is read.
+                    PayloadTooLarge: If the decompressed body exceeds FEED_UPLOAD_MAX_DECOMPRESSED_SIZE.
+                    UnsupportedMediaType: If the Content-Encoding is not supported.
 
         """
 
     allowed_methods = ['POST']
+    parser_classes = (DecompressingJSONParser, FormParser, MultiPartParser)
+
+    def get_mode(self, request):
+        """
+        :return: mode : (str) dry_run, partial or None for the all or nothing ingestion
+        """
+        for mode in ('dry_run', 'partial'):
+            if request.query_params.get(mode, '').lower() in ('1', 'true', 'yes'):
+                return mode
+        return None
 
     def post(self, request, format=None):
+        if self.get_mode(request) == 'dry_run':
+            # a dry run makes no database query, it is not admitted
+            return self.ingest(request)
+        check_capacity()
+        with admit(*feed_size(request.data)), track_lock_waits() as waits:
+            response = self.ingest(request)
+        if waits:
+            response['Server-Timing'] = server_timing(waits)
+        return response
+
+    def ingest(self, request):
+        mode = self.get_mode(request)
+        if request.data and mode:
+            if not isinstance(request.data, dict):
+                return Response({'non_field_errors': ['Expected a feed object.']}, status=status.HTTP_400_BAD_REQUEST)
+            if mode == 'dry_run':
+                report = validate_feed(request.data)
+                return Response(report, status=status.HTTP_200_OK if report['valid'] else status.HTTP_400_BAD_REQUEST)
+            report = ingest_feed_partially(request.data)
+            report['rejects'] = reverse('feed_rejects', args=[report['feed']], request=request)
+            return Response(report, status=status.HTTP_207_MULTI_STATUS if report['rejected'] else status.HTTP_201_CREATED)
         if request.data:
             prods = DataSerializer(data=request.data)
             if prods.is_valid():
@@ -89,3 +342,78 @@ class FeedUploadView(APIView):
             return Response(prods.errors, status=status.HTTP_400_BAD_REQUEST)
         else:
             return Response(status=status.HTTP_400_BAD_REQUEST)
+
+
+class ChangeFeedView(APIView):
+    """
+            This endpoint returns the Products and Items created or modified after a change token, in token order, so
+            downstream mirrors can sync the changes instead of pulling the whole catalog.
+
+            get:
+                Args:
+                    since (int) : the last token the consumer has seen, 0 or omitted to start from the beginning
+                    limit (int) : the maximum number of changes to return, defaults to PAGE_SIZE and is capped at 1000
+                Returns:
+                    next (int) : the token to pass as since on the next call
+                    results (list : Change Object) : the changes with the current state of the changed objects
+                Raises:
+                    ValidationError: If since or limit is not a non-negative integer.
+
+            The tokens become visible in commit order, a change committed after a pull always has a higher token than
+            the next returned by that pull.
+    """
+
+    allowed_methods = ['GET']
+    max_limit = 1000
+
+    def get(self, request, format=None):
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = min(int(request.query_params.get('limit', api_settings.PAGE_SIZE)), self.max_limit)
+        except ValueError:
+            raise ValidationError({'detail': 'since and limit must be integers.'})
+        if since < 0 or limit < 1:
+            raise ValidationError({'detail': 'since must not be negative and limit must be positive.'})
+
+        changes = list(Change.objects.filter(id__gt=since).order_by('id')[:limit])
+
+        # load the changed objects in one query per model instead of one per change
+        ids = {Change.PRODUCT: set(), Change.ITEM: set()}
+        for change in changes:
+            ids[change.model].add(change.object_id)
+        objects = {
+            Change.PRODUCT: Product.objects.select_related('item').prefetch_related(
+                'item__related_products').in_bulk(ids[Change.PRODUCT]),
+            Change.ITEM: Item.objects.prefetch_related('related_products').in_bulk(ids[Change.ITEM]),
+        }
+
+        serializer = ChangeSerializer(changes, many=True, context={'objects': objects})
+        return Response({
+            'next': changes[-1].id if changes else since,
+            'results': serializer.data,
+        })
+
+
+class FeedRejectsView(generics.ListAPIView):
+    """
+            This endpoint returns the reject report of a feed ingested in partial mode.
+
+            get:
+                Args:
+                    pk (int) : the feed id returned by the partial upload
+                Returns:
+                    the rejected rows with their index in the feed, the submitted data and the errors, with pagination.
+                    The data of the rejects form the amounts of a feed which resubmits only the rejects.
+                Raises:
+                    NotFound: If the feed does not exist.
+    """
+    serializer_class = RejectedRowSerializer
+    pagination_class = PageNumberPagination
+    queryset = RejectedRow.objects.order_by('index')
+
+    def get_queryset(self):
+        return super().get_queryset().filter(feed_id=self.kwargs.get('pk'))
+
+    def list(self, request, *args, **kwargs):
+        get_object_or_404(Feed, pk=kwargs['pk'])
+        return super().list(request, *args, **kwargs)